@@ -0,0 +1,61 @@
+"""Measures how many grid cells a second FluidBatch steps as the batch grows.
+
+Each fluid of the batch gets its own viscosity, as in a parameter sweep. A batch of 1 is about the
+cost of stepping one Fluid, so the cells a second should climb with the batch size until every
+core is busy.
+
+    python benchmarks/bench_batch.py --size 128 --batches 1 4 16 64 --backend numba-cpu
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from fluid_sim.batch import BATCH_BACKENDS, FluidBatch
+
+
+def cells_per_second(batch_size: int, side_length: int, backend: str,
+                     steps: int) -> float:
+    fluids = FluidBatch(batch_size,
+                        side_length,
+                        0.05,
+                        1e-7,
+                        np.geomspace(1e-7, 1e-3, batch_size),
+                        backend=backend)
+    centre = side_length // 2
+    for member in range(batch_size):
+        fluids.add_density(member, centre, centre, 100)
+        fluids.add_velocity(member, centre, centre, 1, 1)
+    # The first step compiles the numba kernels
+    fluids.step()
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        fluids.step()
+    seconds = time.perf_counter() - start
+    return batch_size * side_length**2 * steps / seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=128)
+    parser.add_argument('--batches',
+                        type=int,
+                        nargs='+',
+                        default=[1, 4, 16, 64])
+    parser.add_argument('--backend',
+                        choices=list(BATCH_BACKENDS),
+                        default='numba-cpu')
+    parser.add_argument('--steps', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f'{"batch":>6} {"cells/sec":>12}')
+    for batch_size in args.batches:
+        rate = cells_per_second(batch_size, args.size, args.backend,
+                                args.steps)
+        print(f'{batch_size:>6} {rate:>12.3e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Measures how a DistributedFluid scales as it is split across more worker processes.
+
+Strong scaling steps the same board with each number of workers, so ideally the time of a step
+falls as 1 / workers. Weak scaling grows the board with the workers so each of them always has
+about --size squared cells, so ideally the time of a step stays the same. Efficiency is how close
+each run gets to that ideal, relative to a single worker.
+
+    python benchmarks/bench_distributed.py --size 2048 --workers 1 2 4 8 --steps 5
+"""
+
+import argparse
+import time
+
+from fluid_sim.distributed import DistributedFluid
+
+
+def seconds_per_step(side_length: int, workers: int, steps: int) -> float:
+    with DistributedFluid(side_length, 0.05, 1e-6, 1e-6,
+                          workers=workers) as fluid:
+        centre = side_length // 2
+        fluid.add_density(centre, centre, 100)
+        fluid.add_velocity(centre, centre, 1, 1)
+        # The first step waits for the workers to start up
+        fluid.step()
+
+        start = time.perf_counter()
+        for _ in range(steps):
+            fluid.step()
+        return (time.perf_counter() - start) / steps
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size',
+                        type=int,
+                        default=2048,
+                        help='The board of the strong scaling runs, and the '
+                        'cells each worker gets in the weak scaling runs')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--steps', type=int, default=5)
+    args = parser.parse_args()
+
+    # Both are relative to the first number of workers, which is usually 1
+    first = args.workers[0]
+
+    print('strong scaling')
+    print(f'{"workers":>8} {"size":>6} {"step ms":>9} {"speedup":>8} '
+          f'{"efficiency":>10}')
+    base = seconds_per_step(args.size, first, args.steps)
+    for workers in args.workers:
+        seconds = seconds_per_step(args.size, workers, args.steps)
+        speedup = base / seconds
+        print(f'{workers:>8} {args.size:>6} {seconds * 1e3:>9.2f} '
+              f'{speedup:>8.2f} {speedup * first / workers:>10.2f}')
+
+    print('\nweak scaling')
+    print(f'{"workers":>8} {"size":>6} {"step ms":>9} {"efficiency":>10}')
+    base = seconds_per_step(int(args.size * first**0.5), first, args.steps)
+    for workers in args.workers:
+        side_length = int(args.size * workers**0.5)
+        seconds = seconds_per_step(side_length, workers, args.steps)
+        print(f'{workers:>8} {side_length:>6} {seconds * 1e3:>9.2f} '
+              f'{base / seconds:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Measures how many grid cells a second a numba-cpu Fluid steps with its gauss-seidel sweeps fused
+and without.
+
+Fusing the sweeps only changes how the board moves through memory, so it pays off once a board is
+too big for the caches and each of the separate sweeps has to stream it from main memory.
+
+    python benchmarks/bench_fused.py --sizes 512 1024 2048 --steps 10
+"""
+
+import argparse
+import time
+
+from fluid_sim.fluid import Fluid, gaussian_brush
+
+
+def cells_per_second(side_length: int, fused: bool, steps: int) -> float:
+    fluid = Fluid(side_length,
+                  0.05,
+                  1e-6,
+                  1e-6,
+                  backend='numba-cpu',
+                  tolerance=0,
+                  fused=fused)
+    brush = gaussian_brush(4)
+    centre = side_length // 2
+    # The first step compiles the numba kernels
+    fluid.step()
+
+    seconds = 0.0
+    for _ in range(steps):
+        fluid.add_density_many(centre, centre, 50, brush)
+        fluid.add_velocity_many(centre, centre, 1, 1, brush)
+        start = time.perf_counter()
+        fluid.step()
+        seconds += time.perf_counter() - start
+    return side_length**2 * steps / seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes',
+                        type=int,
+                        nargs='+',
+                        default=[512, 1024, 2048])
+    parser.add_argument('--steps', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f'{"size":>6} {"unfused":>12} {"fused":>12} {"speedup":>8}')
+    for size in args.sizes:
+        unfused = cells_per_second(size, False, args.steps)
+        fused = cells_per_second(size, True, args.steps)
+        print(f'{size:>6} {unfused:>12.3e} {fused:>12.3e} '
+              f'{fused / unfused:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Compares float32 and float64 Fluids on the same scenario, both for speed and for how far apart
+the two end up.
+
+A gaussian splat of density is pushed in from the middle of the board every step, as main.py does
+with the mouse. Both precisions run exactly the same steps, the float64 run is taken as the
+reference and the error of the float32 run is reported relative to it.
+
+    python benchmarks/bench_precision.py --size 256 --steps 100 --backend numba-cpu
+"""
+
+import argparse
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+
+from fluid_sim.fluid import BACKENDS, FIELDS, Fluid, gaussian_brush
+
+
+def run(side_length: int, steps: int, backend: str,
+        dtype: np.dtype) -> Tuple[float, Dict[str, np.ndarray]]:
+    fluid = Fluid(side_length, 0.05, 1e-6, 1e-6, backend=backend, dtype=dtype)
+    brush = gaussian_brush(4)
+    centre = side_length // 2
+    # The first step compiles the numba kernels
+    fluid.step()
+
+    seconds = 0.0
+    for step in range(steps):
+        angle = step / 10
+        fluid.add_density_many(centre, centre, 50, brush)
+        fluid.add_velocity_many(centre, centre, np.cos(angle), np.sin(angle),
+                                brush)
+        start = time.perf_counter()
+        fluid.step()
+        seconds += time.perf_counter() - start
+    return seconds / steps, {
+        name: np.array(getattr(fluid, name), dtype=np.float64)
+        for name in FIELDS
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--backend',
+                        choices=[name for name in BACKENDS if name != 'cuda'],
+                        default='numba-cpu')
+    args = parser.parse_args()
+
+    seconds_64, fields_64 = run(args.size, args.steps, args.backend,
+                                np.float64)
+    seconds_32, fields_32 = run(args.size, args.steps, args.backend,
+                                np.float32)
+
+    print(f'{"dtype":>8} {"ms/step":>9} {"MB/field":>9}')
+    for dtype, seconds in ((np.float64, seconds_64), (np.float32, seconds_32)):
+        megabytes = args.size**2 * np.dtype(dtype).itemsize / 1e6
+        print(f'{np.dtype(dtype).name:>8} {seconds * 1e3:>9.2f} '
+              f'{megabytes:>9.2f}')
+    print(f'float32 is {seconds_64 / seconds_32:.2f}x the speed of float64')
+
+    print()
+    print(f'{"field":>8} {"max abs":>10} {"rel L2":>10}')
+    for name in FIELDS:
+        difference = fields_32[name] - fields_64[name]
+        relative = np.linalg.norm(difference) / np.linalg.norm(fields_64[name])
+        print(f'{name:>8} {np.abs(difference).max():>10.3e} '
+              f'{relative:>10.3e}')
+    mass_64 = fields_64['density'].sum()
+    mass_32 = fields_32['density'].sum()
+    print(f'total density differs by {abs(mass_32 - mass_64) / mass_64:.3e} '
+          f'of {mass_64:.6g}')
+
+
+if __name__ == '__main__':
+    main()
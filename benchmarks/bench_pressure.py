@@ -0,0 +1,101 @@
+"""Compares how long the pressure solvers take to reach a tolerance.
+
+The divergence comes from a random, smooth velocity field, so it has error at every scale like a
+real step does. Red-black sweeps are run until the residual is below the tolerance or the sweep
+limit is hit, whichever is first.
+
+    python benchmarks/bench_pressure.py --sizes 130 258 514 1026 --tolerance 1e-3
+"""
+
+import argparse
+import time
+from typing import Tuple
+
+import numpy as np
+
+from fluid_sim import numpy_utils
+from fluid_sim.solvers import MultigridSolver
+
+
+def make_divergence(side_length: int, seed: int = 0) -> np.ndarray:
+    """The divergence of a random velocity field, smoothed so that it has large scale structure."""
+    rng = np.random.default_rng(seed)
+    vel_x = rng.standard_normal((side_length, side_length))
+    vel_y = rng.standard_normal((side_length, side_length))
+    for _ in range(4):
+        for field in (vel_x, vel_y):
+            field[1:-1, 1:-1] = (field[:-2, 1:-1] + field[2:, 1:-1] +
+                                 field[1:-1, :-2] + field[1:-1, 2:]) / 4
+
+    p = np.zeros((side_length, side_length))
+    div = np.zeros((side_length, side_length))
+    numpy_utils.divergence(side_length, vel_x, vel_y, p, div)
+    # Gauss-Seidel can't reach any tolerance if the divergence doesn't sum to 0
+    div[1:-1, 1:-1] -= div[1:-1, 1:-1].mean()
+    return div
+
+
+def relative_residual(solver: MultigridSolver, p: np.ndarray,
+                      div: np.ndarray) -> float:
+    rhs = div.copy()
+    rhs[1:-1, 1:-1] -= rhs[1:-1, 1:-1].mean()
+    residual = solver.levels[0].residual(p, rhs)
+    return float(np.linalg.norm(residual) / np.linalg.norm(rhs[1:-1, 1:-1]))
+
+
+def time_gauss_seidel(side_length: int, div: np.ndarray, tolerance: float,
+                      max_sweeps: int) -> Tuple[float, int, float]:
+    # Only used to measure the residual the same way the multigrid solver does
+    measure = MultigridSolver(side_length, coarsest_size=side_length)
+    p = np.zeros((side_length, side_length))
+    sweeps = 0
+    residual = relative_residual(measure, p, div)
+    start = time.perf_counter()
+    while residual > tolerance and sweeps < max_sweeps:
+        for _ in range(10):
+            numpy_utils.lin_solve(side_length, 0, p, div, 1, 4)
+        sweeps += 10
+        residual = relative_residual(measure, p, div)
+    return time.perf_counter() - start, sweeps, residual
+
+
+def time_multigrid(side_length: int, div: np.ndarray,
+                   tolerance: float) -> Tuple[float, int, float]:
+    solver = MultigridSolver(side_length, tolerance, max_cycles=100)
+    p = np.zeros((side_length, side_length))
+    start = time.perf_counter()
+    result = solver.solve(p, div)
+    return time.perf_counter() - start, result.iterations, result.residual
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes',
+                        type=int,
+                        nargs='+',
+                        default=[130, 258, 514])
+    parser.add_argument('--tolerance', type=float, default=1e-3)
+    parser.add_argument('--max-sweeps',
+                        type=int,
+                        default=20000,
+                        help='Gives up on gauss-seidel after this many sweeps')
+    args = parser.parse_args()
+
+    print(f'{"size":>6} {"solver":>13} {"seconds":>9} {"iterations":>11} '
+          f'{"residual":>9}')
+    for side_length in args.sizes:
+        div = make_divergence(side_length)
+        runs = {
+            'gauss-seidel':
+            time_gauss_seidel(side_length, div, args.tolerance,
+                              args.max_sweeps),
+            'multigrid':
+            time_multigrid(side_length, div, args.tolerance),
+        }
+        for name, (seconds, iterations, residual) in runs.items():
+            print(f'{side_length:>6} {name:>13} {seconds:>9.3f} '
+                  f'{iterations:>11} {residual:>9.2e}')
+
+
+if __name__ == '__main__':
+    main()
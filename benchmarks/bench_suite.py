@@ -0,0 +1,231 @@
+"""Times the solver kernels and full steps of every backend, and keeps the results to compare runs.
+
+Each case is one of diffuse, advect, project, set_bnd or a whole Fluid.step, on one backend, dtype
+and board size. It is run a few times first so the numba kernels are compiled and the caches warm,
+then timed call by call, waiting for the gpu to finish each call. The median and 95th percentile
+of those times are reported along with how many cells a second the median works out to.
+
+Steps run with a tolerance of 0, so every solve runs all of its sweeps and the time of a step does
+not depend on how far the fluid has settled.
+
+The results are written as JSON. Given an earlier results file with --compare, every case that
+took longer than --threshold more than it did before is reported and the script exits with 1, so a
+run can be checked against a saved baseline.
+
+    python benchmarks/bench_suite.py --sizes 128 512 --output results.json
+    python benchmarks/bench_suite.py --output new.json --compare results.json
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numba
+from numba import cuda
+import numpy as np
+
+from fluid_sim.fluid import BACKENDS, DTYPES, Fluid, gaussian_brush
+
+CASES = ('diffuse', 'advect', 'project', 'set_bnd', 'step')
+
+# The sweeps each diffuse and project runs, as Fluid does by default
+ITERATIONS = 8
+
+
+def _set_bnd(backend: str) -> Callable:
+    # The cuda set_bnd is a device function, _set_bounds is what launches it
+    if backend == 'cuda':
+        return lambda side_length, side, grid: BACKENDS['cuda']._set_bounds(
+            side_length, side, grid, None)
+    return BACKENDS[backend].set_bnd
+
+
+def make_call(case: str, backend: str, dtype: np.dtype,
+              side_length: int) -> Callable[[], None]:
+    """Sets up a case and returns a function that runs it once.
+
+    The fields are smooth random ones, so advect traces back a few cells like it would in a real
+    step.
+    """
+    if case == 'step':
+        fluid = Fluid(side_length,
+                      0.05,
+                      1e-6,
+                      1e-6,
+                      backend=backend,
+                      tolerance=0,
+                      dtype=dtype)
+        centre = side_length // 2
+        fluid.add_density_many(centre, centre, 50, gaussian_brush(4))
+        fluid.add_velocity_many(centre, centre, 1, 1, gaussian_brush(4))
+        return fluid.step
+
+    module = BACKENDS[backend]
+    rng = np.random.default_rng(0)
+    fields = []
+    for _ in range(4):
+        field = rng.standard_normal((side_length, side_length))
+        for _ in range(4):
+            field[1:-1, 1:-1] = (field[:-2, 1:-1] + field[2:, 1:-1] +
+                                 field[1:-1, :-2] + field[1:-1, 2:]) / 4
+        fields.append(module.to_device(field.astype(dtype)))
+    current, prev, vel_x, vel_y = fields
+
+    if case == 'diffuse':
+        return lambda: module.diffuse(side_length, 0, current, prev, 1e-6,
+                                      0.05, ITERATIONS)
+    if case == 'advect':
+        return lambda: module.advect(side_length, 0, current, prev, vel_x,
+                                     vel_y, 0.05)
+    if case == 'project':
+        return lambda: module.project(side_length, vel_x, vel_y, current, prev,
+                                      ITERATIONS)
+    set_bnd = _set_bnd(backend)
+    return lambda: set_bnd(side_length, 0, current)
+
+
+def time_call(call: Callable[[], None], synchronize: Callable[[], None],
+              warmup: int, repeats: int) -> List[float]:
+    """The seconds each of repeats calls took, after warmup calls that are not timed."""
+    for _ in range(warmup):
+        call()
+    synchronize()
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        call()
+        synchronize()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times: List[float], side_length: int) -> Dict[str, float]:
+    median = float(np.median(times))
+    return {
+        'median_ms': median * 1e3,
+        'p95_ms': float(np.percentile(times, 95)) * 1e3,
+        'cells_per_sec': side_length**2 / median,
+    }
+
+
+def machine() -> Dict[str, str]:
+    """What the results were measured on, as runs on different machines can't be compared."""
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'numba': numba.__version__,
+        'threads': str(numba.get_num_threads()),
+    }
+
+
+def compare(results: List[Dict], baseline: List[Dict],
+            threshold: float) -> bool:
+    """Prints how the median of each case changed from the baseline.
+
+    Returns:
+        bool: Whether any case got slower by more than threshold.
+    """
+    def key(result: Dict) -> Tuple:
+        return (result['case'], result['backend'], result['dtype'],
+                result['size'])
+
+    before = {key(result): result for result in baseline}
+    regressed = False
+    print(f'\n{"case":>8} {"backend":>10} {"dtype":>8} {"size":>6} '
+          f'{"before ms":>10} {"after ms":>10} {"change":>8}')
+    for result in results:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        change = result['median_ms'] / old['median_ms'] - 1
+        flag = ''
+        if change > threshold:
+            flag = ' slower'
+            regressed = True
+        print(f'{result["case"]:>8} {result["backend"]:>10} '
+              f'{result["dtype"]:>8} {result["size"]:>6} '
+              f'{old["median_ms"]:>10.3f} {result["median_ms"]:>10.3f} '
+              f'{change:>+8.1%}{flag}')
+    return regressed
+
+
+def main() -> None:
+    default_backends = ['numpy', 'numba-cpu']
+    if cuda.is_available():
+        default_backends.append('cuda')
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes',
+                        type=int,
+                        nargs='+',
+                        default=[128, 256, 512])
+    parser.add_argument('--backends',
+                        choices=list(BACKENDS),
+                        nargs='+',
+                        default=default_backends)
+    parser.add_argument('--dtypes',
+                        choices=[np.dtype(dtype).name for dtype in DTYPES],
+                        nargs='+',
+                        default=[np.dtype(dtype).name for dtype in DTYPES])
+    parser.add_argument('--cases', choices=CASES, nargs='+', default=CASES)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--output', help='Where to write the JSON results')
+    parser.add_argument('--compare',
+                        help='An earlier JSON results file to compare with')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.1,
+        help='How much slower than before a case can get before it fails')
+    args = parser.parse_args()
+
+    # Read before anything is written, so the baseline can be the file the results replace
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+
+    results = []
+    print(f'{"case":>8} {"backend":>10} {"dtype":>8} {"size":>6} '
+          f'{"median ms":>10} {"p95 ms":>10} {"cells/sec":>10}')
+    for backend in args.backends:
+        synchronize = BACKENDS[backend].synchronize
+        for dtype in args.dtypes:
+            for side_length in args.sizes:
+                for case in args.cases:
+                    call = make_call(case, backend, np.dtype(dtype),
+                                     side_length)
+                    times = time_call(call, synchronize, args.warmup,
+                                      args.repeats)
+                    result = {
+                        'case': case,
+                        'backend': backend,
+                        'dtype': dtype,
+                        'size': side_length,
+                        'repeats': args.repeats,
+                        **summarize(times, side_length)
+                    }
+                    results.append(result)
+                    print(f'{case:>8} {backend:>10} {dtype:>8} '
+                          f'{side_length:>6} {result["median_ms"]:>10.3f} '
+                          f'{result["p95_ms"]:>10.3f} '
+                          f'{result["cells_per_sec"]:>10.3e}')
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            report = {'machine': machine(), 'results': results}
+            json.dump(report, file, indent=2)
+
+    if baseline is not None and compare(results, baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
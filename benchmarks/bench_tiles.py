@@ -0,0 +1,68 @@
+"""Measures how long a tiled Fluid takes a step as the fluid covers more of the board.
+
+Density and velocity are added across a square in the corner of the board that grows with each
+run. With the board stepped a tile at a time the cost should follow the fraction of the board the
+step covers, while the untiled step costs the same however little of the board holds fluid.
+
+    python benchmarks/bench_tiles.py --size 1024 --tile-size 32 --covered 0.05 0.25 1
+"""
+
+import argparse
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+from fluid_sim.fluid import Fluid
+
+
+def seconds_per_step(side_length: int, tile_size: Optional[int],
+                     covered: float, steps: int) -> Tuple[float, float]:
+    fluid = Fluid(side_length,
+                  0.01,
+                  1e-6,
+                  1e-6,
+                  backend='numba-cpu',
+                  tile_size=tile_size)
+    width = max(int(side_length * covered**0.5) - 2, 1)
+    x, y = np.meshgrid(np.arange(1, width + 1, 8), np.arange(1, width + 1, 8))
+
+    def add_sources() -> None:
+        fluid.add_density_many(x.ravel(), y.ravel(), 100)
+        fluid.add_velocity_many(x.ravel(), y.ravel(), 1, 1)
+
+    # The first step compiles the numba kernels
+    add_sources()
+    fluid.step()
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        add_sources()
+        fluid.step()
+    seconds = (time.perf_counter() - start) / steps
+    fraction = 1.0 if fluid.tiles is None else fluid.tiles.fraction
+    return seconds, fraction
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--tile-size', type=int, default=32)
+    parser.add_argument('--covered',
+                        type=float,
+                        nargs='+',
+                        default=[0.05, 0.25, 1])
+    parser.add_argument('--steps', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f'{"covered":>8} {"stepped":>8} {"tiled ms":>9} {"full ms":>9}')
+    for covered in args.covered:
+        tiled, fraction = seconds_per_step(args.size, args.tile_size, covered,
+                                           args.steps)
+        full, _ = seconds_per_step(args.size, None, covered, args.steps)
+        print(f'{covered:>8.2f} {fraction:>8.2f} {tiled * 1e3:>9.2f} '
+              f'{full * 1e3:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Steps many independent fluids of the same size at once, for parameter sweeps and ensembles.
+
+Stepping hundreds of small Fluids one after another spends most of its time going back and forth
+between python and the solver for every diffuse, advect and project. FluidBatch keeps all of its
+fluids in (batch, side_length, side_length) stacks instead, and each stage of a step is a single
+call that covers the whole stack, so that overhead is paid once per step rather than once per
+fluid.
+"""
+
+from typing import Optional, Sequence, Union
+
+import numpy as np
+
+from fluid_sim import numba_utils, numpy_utils
+
+BATCH_BACKENDS = {
+    'numpy': numpy_utils,
+    'numba-cpu': numba_utils,
+}
+
+
+def _per_member(name: str, value: Union[float, Sequence[float]],
+                batch_size: int) -> np.ndarray:
+    """Spreads a parameter out to one value per fluid of the batch.
+
+    Raises:
+        ValueError: If value is a sequence that does not have a value for every fluid.
+    """
+    values = np.array(value, dtype=np.float64)
+    if values.ndim == 0:
+        return np.full(batch_size, values)
+    if values.shape != (batch_size, ):
+        raise ValueError(f'Expected {name} to be one value or {batch_size} '
+                         f'values, got shape {values.shape}')
+    return values
+
+
+class FluidBatch:
+    def __init__(self,
+                 batch_size: int,
+                 grid_size: int,
+                 dt: Union[float, Sequence[float]],
+                 diffusion_rate: Union[float, Sequence[float]],
+                 viscosity: Union[float, Sequence[float]],
+                 backend: str = 'numba-cpu',
+                 num_threads: Optional[int] = None,
+                 iterations: int = 8,
+                 dtype: Union[type, np.dtype] = np.float64):
+        """Initializes batch_size fluid boards that are all grid_size long on each side. Each one
+        runs the same simulation as a gauss-seidel Fluid, but can be given its own dt, diffusion
+        rate and viscosity.
+
+        The boards are FluidBatch.density, vel_x and vel_y, each shaped
+        (batch_size, grid_size, grid_size) and indexed [fluid, x, y].
+
+        The numpy backend steps the stack with the same whole array operations as a single field.
+        The numba-cpu backend splits the stack across cores a fluid at a time, which keeps every
+        core busy however small the boards are. A few big boards are better off as separate Fluids
+        that split each board across cores instead.
+
+        Args:
+            batch_size: How many fluids are simulated.
+            grid_size: The length of each side of every board.
+            dt: How long each timestep is, either for every fluid or a sequence with one per fluid.
+            diffusion_rate: The rate at which the fluid dissolves into lesser occupied space,
+                either for every fluid or a sequence with one per fluid.
+            viscosity: How thick the fluid is, either for every fluid or a sequence with one per
+                fluid.
+            backend: Which solver to run the simulation with, one of the keys of BATCH_BACKENDS.
+            num_threads: How many cores the numba-cpu backend splits the batch across. Defaults to
+                every core numba can see.
+            iterations: How many red-black Gauss-Seidel sweeps each diffuse and project solves
+                with.
+            dtype: The precision every board is stored and solved in, float32 or float64.
+
+        Raises:
+            ValueError: If the backend is not one of the keys of BATCH_BACKENDS, num_threads is
+                given for a backend that does not use it or a parameter does not have a value for
+                every fluid.
+        """
+        if backend not in BATCH_BACKENDS:
+            raise ValueError(f'Unknown backend {backend!r}, expected one of '
+                             f'{list(BATCH_BACKENDS)}')
+        if num_threads is not None and backend != 'numba-cpu':
+            raise ValueError(
+                f'num_threads is only used by the numba-cpu backend, not {backend!r}'
+            )
+        self.backend = backend
+        self._backend = BATCH_BACKENDS[backend]
+        self.num_threads = num_threads
+
+        self.batch_size = batch_size
+        self.N = grid_size
+        self.dt = _per_member('dt', dt, batch_size)
+        self.diffusion_rate = _per_member('diffusion_rate', diffusion_rate,
+                                          batch_size)
+        self.viscosity = _per_member('viscosity', viscosity, batch_size)
+        self.iterations = iterations
+        self.dtype = np.dtype(dtype)
+
+        shape = (batch_size, grid_size, grid_size)
+        self.density: np.ndarray = np.zeros(shape, self.dtype)
+        self.vel_x: np.ndarray = np.zeros(shape, self.dtype)
+        self.vel_y: np.ndarray = np.zeros(shape, self.dtype)
+
+        self._prev_density: np.ndarray = np.zeros(shape, self.dtype)
+        self._prev_vel_x: np.ndarray = np.zeros(shape, self.dtype)
+        self._prev_vel_y: np.ndarray = np.zeros(shape, self.dtype)
+
+    def add_density(self, member: int, x: int, y: int, amount: float) -> None:
+        """Adds density to the (x, y) position on one of the fluid boards.
+
+        Args:
+            member: Which fluid of the batch to add to.
+            x: The x position.
+            y: The y position.
+            amount: The amount of fluid that will be added.
+        """
+        self.density[member, x, y] += amount
+
+    def add_velocity(self, member: int, x: int, y: int, amount_x: float,
+                     amount_y: float) -> None:
+        """Adds velocity to the (x, y) position on one of the fluid boards.
+
+        Args:
+            member: Which fluid of the batch to add to.
+            x: The x position.
+            y: The y position.
+            amount_x: The amount of velocity in the x direction.
+            amount_y: The amount of velocity in the y direction.
+        """
+        self.vel_x[member, x, y] += amount_x
+        self.vel_y[member, x, y] += amount_y
+
+    def step(self) -> None:
+        """A total step of every simulation in the batch. First simulates the velocity of each
+        fluid, then the effect of that velocity on its density.
+        """
+        if self.num_threads is not None:
+            self._backend.set_num_threads(self.num_threads)
+        self._vel_step()
+        self._density_step()
+
+    def _vel_step(self) -> None:
+        self._backend.diffuse(self.N, 1, self._prev_vel_x, self.vel_x,
+                              self.viscosity, self.dt, self.iterations)
+        self._backend.diffuse(self.N, 2, self._prev_vel_y, self.vel_y,
+                              self.viscosity, self.dt, self.iterations)
+
+        self._backend.project(self.N, self._prev_vel_x, self._prev_vel_y,
+                              self.vel_x, self.vel_y, self.iterations)
+
+        self._backend.advect(self.N, 1, self.vel_x, self._prev_vel_x,
+                             self._prev_vel_x, self._prev_vel_y, self.dt)
+        self._backend.advect(self.N, 2, self.vel_y, self._prev_vel_y,
+                             self._prev_vel_x, self._prev_vel_y, self.dt)
+
+        self._backend.project(self.N, self.vel_x, self.vel_y, self._prev_vel_x,
+                              self._prev_vel_y, self.iterations)
+
+    def _density_step(self) -> None:
+        self._backend.diffuse(self.N, 0, self._prev_density, self.density,
+                              self.diffusion_rate, self.dt, self.iterations)
+        self._backend.advect(self.N, 0, self.density, self._prev_density,
+                             self.vel_x, self.vel_y, self.dt)
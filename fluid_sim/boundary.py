@@ -0,0 +1,110 @@
+"""The cells set_bnd writes when there are solid obstacles inside the board, worked out once as
+index arrays so that setting the bounds only touches those cells.
+
+Every cell that is solid, the border of the board or an obstacle, is set from its neighbours the
+same way the border is. A solid cell next to the fluid takes the average of its fluid neighbours,
+with the velocity into or out of the solid negated, which is exactly what set_bnd does along the
+border. Solid cells that do not touch the fluid, like the corners of the board, take the average of
+their neighbours from the first group afterwards, and those that touch neither are zeroed.
+
+So setting the bounds costs the number of solid cells rather than every cell of the board, and
+without any obstacles it is the border and 4 corners set_bnd already writes.
+"""
+
+import copy
+from typing import Callable, Union
+
+import numpy as np
+
+# The 4 neighbours of a cell, the first two across the x axis from it and the last two across y
+_OFFSETS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+
+class Boundary:
+    """Which solid cells set_bnd writes and which of their neighbours each is set from.
+
+    Attributes:
+        obstacles: The (side_length, side_length) mask the boundary was made from, true where the
+            cell is solid.
+        fluid: True for the cells the solvers solve for, the interior cells that are not obstacles.
+        cells: The (2, count) x and y positions of every solid cell that is set, those next to the
+            fluid first.
+        sources: The (2, count, 4) x and y positions of the 4 neighbours of each cell.
+        weights: The (3, count, 4) weight of each neighbour for each side set_bnd is given, 0 for a
+            density field, 1 for x velocity and 2 for y velocity.
+        split: How many of the cells are next to the fluid. They are set before the rest, which
+            are set from them.
+    """
+    def __init__(self,
+                 side_length: int,
+                 obstacles: np.ndarray,
+                 dtype: Union[type, np.dtype] = np.float64):
+        """Works out which cells are set from which, for a board with the given obstacles.
+
+        Args:
+            side_length: The length of each side of the board.
+            obstacles: A (side_length, side_length) mask that is true where the board is solid.
+            dtype: The dtype of the fields the boundary is set on.
+
+        Raises:
+            ValueError: If obstacles is not shaped like the board.
+        """
+        obstacles = np.array(obstacles, dtype=bool)
+        if obstacles.shape != (side_length, side_length):
+            raise ValueError(
+                f'Expected obstacles to be shaped {(side_length, side_length)}, '
+                f'got {obstacles.shape}')
+        obstacles.flags.writeable = False
+        self.side_length = side_length
+        self.obstacles = obstacles
+
+        solid = obstacles.copy()
+        solid[[0, -1], :] = True
+        solid[:, [0, -1]] = True
+        self.fluid = ~solid
+
+        x, y = np.nonzero(solid)
+        sources = np.stack([
+            np.stack([x + dx for dx, _ in _OFFSETS], axis=-1),
+            np.stack([y + dy for _, dy in _OFFSETS], axis=-1)
+        ])
+        outside = ((sources < 0) | (sources >= side_length)).any(axis=0)
+        # Neighbours off the board are never read, they are pointed at the cell itself
+        sources[0][outside] = np.broadcast_to(x[:, None],
+                                              outside.shape)[outside]
+        sources[1][outside] = np.broadcast_to(y[:, None],
+                                              outside.shape)[outside]
+
+        touches_fluid = self.fluid[sources[0], sources[1]] & ~outside
+        near = touches_fluid.any(axis=1)
+        first = np.zeros_like(solid)
+        first[x[near], y[near]] = True
+        touches_first = first[sources[0], sources[1]] & ~outside
+        used = np.where(near[:, None], touches_fluid, touches_first)
+
+        # Across the x axis the x velocity is negated, and across the y axis the y velocity, but
+        # only for cells set from the fluid
+        across_x = np.array([True, True, False, False])
+        signs = np.ones((3, ) + used.shape)
+        signs[1][near[:, None] & across_x] = -1
+        signs[2][near[:, None] & ~across_x] = -1
+        count = np.maximum(used.sum(axis=1, keepdims=True), 1)
+        weights = np.where(used, signs / count, 0)
+
+        # Contiguous so the backends can copy them to the device in one go
+        order = np.argsort(~near, kind='stable')
+        self.cells = np.ascontiguousarray(np.stack([x, y])[:, order])
+        self.sources = np.ascontiguousarray(sources[:, order])
+        self.weights = np.ascontiguousarray(weights[:, order], dtype=dtype)
+        self.split = int(near.sum())
+
+    def on_device(self, to_device: Callable[[np.ndarray],
+                                            np.ndarray]) -> 'Boundary':
+        """A copy of the boundary with its index arrays moved by to_device, for a backend to use.
+        """
+        moved = copy.copy(self)
+        moved.fluid = to_device(self.fluid)
+        moved.cells = to_device(self.cells)
+        moved.sources = to_device(self.sources)
+        moved.weights = to_device(self.weights)
+        return moved
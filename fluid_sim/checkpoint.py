@@ -0,0 +1,225 @@
+"""Saves every array of a fluid's state to a single raw binary file that is memory mapped back.
+
+A checkpoint starts with a short header, the magic bytes, a version and the length of a JSON
+description of the parameters and of where each array is. Each array follows as raw C ordered
+bytes starting on a page boundary, so restoring one is a memory map of the file at its offset.
+Nothing is parsed or copied up front, pages are read from disk as the solver first touches them,
+and the maps are copy on write so stepping the restored fluid never changes the checkpoint.
+
+An incremental checkpoint is made against a full one, its base. The board is split into square
+tiles and only the tiles of each array that differ from the base are stored, as (count, 2) tile
+positions followed by the (count, size, size) tiles, with those on the far edges padded out to the
+whole size. An array whose changed tiles would take more room than it does is stored whole
+instead. Restoring one maps the base and writes the stored tiles over it.
+"""
+
+import json
+import os
+import struct
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b'FLUIDCKP'
+VERSION = 1
+
+# Every array starts on a multiple of this, so it can be mapped straight from its offset
+ALIGNMENT = 4096
+
+# The magic bytes, the version and the length of the JSON description
+_PREAMBLE = struct.Struct('<8sIQ')
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _changed_tiles(current: np.ndarray, base: np.ndarray,
+                   size: int) -> np.ndarray:
+    """A (tiles, tiles) mask of the tiles where current differs from base, a strip of tiles at a
+    time so no more than a strip of the comparison is held at once.
+    """
+    side_length = current.shape[0]
+    count = -(-side_length // size)
+    starts = np.arange(0, side_length, size)
+    changed = np.zeros((count, count), dtype=bool)
+    for x in range(count):
+        rows = slice(x * size, (x + 1) * size)
+        differs = (current[rows] != base[rows]).any(axis=0)
+        changed[x] = np.logical_or.reduceat(differs, starts)
+    return changed
+
+
+def write(path: str,
+          arrays: Dict[str, np.ndarray],
+          parameters: Dict,
+          base: Optional[str] = None,
+          tile_size: int = 64) -> None:
+    """Writes a checkpoint of the arrays and the parameters they were made with.
+
+    The checkpoint is written to a temporary file next to path and only moved over it once it is
+    complete. The arrays of a loaded checkpoint are maps of its file, so saving over the checkpoint
+    a fluid was loaded from, or over the base, would otherwise cut the file they are read from
+    short before they were written.
+
+    Args:
+        path: Where to write the checkpoint.
+        arrays: The host arrays to save, by name.
+        parameters: Anything else to save that json can dump.
+        base: A full checkpoint of the same arrays to only store the tiles that differ from, or
+            None to store every array whole.
+        tile_size: The length of each side of the tiles an incremental checkpoint compares.
+
+    Raises:
+        ValueError: If base is path, is itself incremental, or its arrays are not shaped like
+            these.
+    """
+    base_arrays = None
+    if base is not None:
+        if os.path.abspath(base) == os.path.abspath(path):
+            raise ValueError(f'An incremental checkpoint cannot replace its '
+                             f'own base {base!r}')
+        base_arrays, _, base_of_base = _map(base)
+        if base_of_base is not None:
+            raise ValueError(
+                f'{base!r} is incremental, incremental checkpoints '
+                f'are made against a full one')
+        if set(base_arrays) != set(arrays):
+            raise ValueError(f'{base!r} holds {sorted(base_arrays)}, not '
+                             f'{sorted(arrays)}')
+        for name, array in arrays.items():
+            old = base_arrays[name]
+            if old.shape != array.shape or old.dtype != array.dtype:
+                raise ValueError(f'{name!r} in {base!r} is not shaped and '
+                                 f'typed like the one being saved')
+        # Stored relative to the checkpoint, so the two can be moved together
+        base = os.path.relpath(base, os.path.dirname(os.path.abspath(path)))
+
+    # Work out where everything goes before writing the description of it
+    layout: Dict[str, Dict] = {}
+    blocks: List[Tuple[int, np.ndarray]] = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        entry = {'dtype': array.dtype.str, 'shape': list(array.shape)}
+        positions: Optional[np.ndarray] = None
+        if base_arrays is not None:
+            changed = _changed_tiles(array, base_arrays[name], tile_size)
+            positions = np.argwhere(changed).astype(np.int64)
+            # Tiles on the far edges are padded out, so on a small board or one that is not a
+            # multiple of tile_size the tiles can take more room than the whole array
+            tile_bytes = 2 * 8 + tile_size**2 * array.dtype.itemsize
+            if len(positions) * tile_bytes >= array.nbytes:
+                positions = None
+        if positions is None:
+            entry['offset'] = offset
+            blocks.append((offset, array))
+            offset = _aligned(offset + array.nbytes)
+        else:
+            tiles = np.zeros((len(positions), tile_size, tile_size),
+                             array.dtype)
+            for tile, (x, y) in zip(tiles, positions * tile_size):
+                cells = array[x:x + tile_size, y:y + tile_size]
+                tile[:cells.shape[0], :cells.shape[1]] = cells
+            entry['tiles'] = len(positions)
+            entry['offset'] = offset
+            blocks.append((offset, positions))
+            offset = _aligned(offset + positions.nbytes)
+            entry['tiles_offset'] = offset
+            blocks.append((offset, tiles))
+            offset = _aligned(offset + tiles.nbytes)
+        layout[name] = entry
+
+    description = json.dumps({
+        'parameters': parameters,
+        'arrays': layout,
+        'base': base,
+        'tile_size': tile_size,
+    }).encode()
+    start = _aligned(_PREAMBLE.size + len(description))
+    descriptor, temporary = tempfile.mkstemp(
+        prefix=os.path.basename(path) + '.',
+        suffix='.tmp',
+        dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(_PREAMBLE.pack(MAGIC, VERSION, len(description)))
+            file.write(description)
+            for block_offset, block in blocks:
+                file.seek(start + block_offset)
+                block.tofile(file)
+            file.truncate(start + offset)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def read(path: str) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """Maps a checkpoint back, applying it over its base if it is incremental.
+
+    Args:
+        path: Where the checkpoint was written.
+
+    Returns:
+        Tuple[Dict[str, np.ndarray], Dict]: The arrays by name, copy on write maps of the file, and
+            the parameters that were saved with them.
+
+    Raises:
+        ValueError: If the file is not a checkpoint or was written by another version.
+    """
+    arrays, parameters, base = _map(path)
+    if base is None:
+        return arrays, parameters
+
+    base_arrays, _, _ = _map(
+        os.path.join(os.path.dirname(os.path.abspath(path)), base))
+    for name, stored in arrays.items():
+        if not isinstance(stored, tuple):
+            base_arrays[name] = stored
+            continue
+        positions, tiles = stored
+        array = base_arrays[name]
+        size = tiles.shape[1]
+        for tile, (x, y) in zip(tiles, positions * size):
+            cells = array[x:x + size, y:y + size]
+            cells[...] = tile[:cells.shape[0], :cells.shape[1]]
+    return base_arrays, parameters
+
+
+def _map(path: str) -> Tuple[Dict, Dict, Optional[str]]:
+    """Maps every array of a checkpoint, as (positions, tiles) pairs for those stored as the tiles
+    that differ from the base.
+    """
+    with open(path, 'rb') as file:
+        magic, version, length = _PREAMBLE.unpack(file.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path!r} is not a checkpoint')
+        if version != VERSION:
+            raise ValueError(
+                f'{path!r} is version {version} of the checkpoint '
+                f'format, expected {VERSION}')
+        description = json.loads(file.read(length))
+    start = _aligned(_PREAMBLE.size + length)
+
+    def mapped(offset: int, dtype: np.dtype, shape: tuple) -> np.ndarray:
+        if 0 in shape:
+            return np.zeros(shape, dtype)
+        # A plain array over the map rather than a np.memmap, which the numba kernels take
+        return np.asarray(np.memmap(path, dtype, 'c', start + offset, shape))
+
+    arrays: Dict = {}
+    size = description['tile_size']
+    for name, entry in description['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        if 'tiles' not in entry:
+            arrays[name] = mapped(entry['offset'], dtype,
+                                  tuple(entry['shape']))
+            continue
+        count = entry['tiles']
+        arrays[name] = (mapped(entry['offset'], np.dtype(np.int64),
+                               (count, 2)),
+                        mapped(entry['tiles_offset'], dtype,
+                               (count, size, size)))
+    return arrays, description['parameters'], description['base']
@@ -0,0 +1,414 @@
+"""Steps one board split across worker processes, for boards too big for one process to step fast
+enough.
+
+The fields live in a single block of shared memory that every worker maps, shaped
+(fields, side_length, side_length). The interior rows of the board are split into one strip per
+worker, and each worker only writes the rows of its strip, along with the border cells at the ends
+of those rows. The first and last workers also own the top and bottom border rows and the corners.
+
+Since every worker maps the whole board, the halo of a strip, the row either side of it that its
+stencils read, is simply the neighbouring worker's edge row. Exchanging halos is a barrier that all
+the workers wait at before reading them, so they only ever read rows their neighbours have
+finished. The workers meet at a barrier between each half of every red-black sweep and after each
+stage of the step:
+
+- A red-black half only reads cells of the other colour, which were finished before the last
+  barrier, so the strips relax their halves at the same time and get exactly the sweep the numpy
+  backend does over the whole board.
+- advect reads the previous field anywhere along a cell's trace back, so it starts once that
+  field is finished everywhere.
+- divergence and subtract_gradient read a row either side of the strip.
+
+The result is the same, bit for bit, as a FluidBatch of one numpy fluid with the same parameters,
+however many workers there are. Like FluidBatch, every solve runs a fixed number of sweeps and
+there are no obstacles, warm starts or tolerances, since those need sums over the whole board at
+every check.
+
+multiprocessing.shared_memory needs python 3.8 or later.
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import queue
+import threading
+import traceback
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from fluid_sim.fluid import _splat
+
+# The order the fields are stored in the shared block
+_FIELDS = ('density', 'vel_x', 'vel_y', 'prev_density', 'prev_vel_x',
+           'prev_vel_y')
+
+# What the workers are told to do at each start
+_STEP = 0
+_STOP = 1
+
+
+def strips(side_length: int, workers: int) -> List[Tuple[int, int]]:
+    """Splits the interior rows of a board as evenly as possible between the workers.
+
+    Returns:
+        List[Tuple[int, int]]: The first row of each strip and the row after its last.
+
+    Raises:
+        ValueError: If there are more workers than interior rows.
+    """
+    interior = side_length - 2
+    if not 1 <= workers <= interior:
+        raise ValueError(f'Expected between 1 and {interior} workers for a '
+                         f'board {side_length} long, got {workers}')
+    bounds: np.ndarray = 1 + np.arange(workers + 1) * interior // workers
+    return [(int(start), int(stop))
+            for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def _set_bnd(grid: np.ndarray, side: int, start: int, stop: int) -> None:
+    """set_bnd for the border cells a strip of rows owns."""
+    x_sign = -1 if side == 1 else 1
+    y_sign = -1 if side == 2 else 1
+    first = start == 1
+    last = stop == grid.shape[0] - 1
+
+    if first:
+        grid[0, 1:-1] = x_sign * grid[1, 1:-1]
+    if last:
+        grid[-1, 1:-1] = x_sign * grid[-2, 1:-1]
+    grid[start:stop, 0] = y_sign * grid[start:stop, 1]
+    grid[start:stop, -1] = y_sign * grid[start:stop, -2]
+
+    if first:
+        grid[0, 0] = 0.5 * (grid[1, 0] + grid[0, 1])
+        grid[0, -1] = 0.5 * (grid[1, -1] + grid[0, -2])
+    if last:
+        grid[-1, 0] = 0.5 * (grid[-2, 0] + grid[-1, 1])
+        grid[-1, -1] = 0.5 * (grid[-2, -1] + grid[-1, -2])
+
+
+def _relax(current: np.ndarray, prev: np.ndarray, a: np.floating,
+           c: np.floating, parity: int, start: int, stop: int) -> None:
+    """numpy_utils._relax over the rows of a strip. Which cells are red or black follows their
+    place on the whole board, not in the strip.
+    """
+    n = current.shape[1]
+    for i in (start, start + 1):
+        j = 1 if (i + 1) % 2 == parity else 2
+        rows = slice(i, stop, 2)
+        cols = slice(j, n - 1, 2)
+
+        neighbours = (current[i - 1:stop - 1:2, cols] +
+                      current[i + 1:stop + 1:2, cols] +
+                      current[rows, j - 1:n - 2:2] + current[rows, j + 1:n:2])
+        current[rows, cols] = (prev[rows, cols] + a * neighbours) / c
+
+
+class _Worker:
+    """What a worker process runs, on the strip of rows from start to stop."""
+    def __init__(self, fields: Dict[str, np.ndarray], start: int, stop: int,
+                 barrier: Any, parameters: Dict[str, float]):
+        self.fields = fields
+        self.start = start
+        self.stop = stop
+        self.barrier = barrier
+        self.n = fields['density'].shape[0]
+        self.dtype = fields['density'].dtype
+        self.dt = parameters['dt']
+        self.diffusion_rate = parameters['diffusion_rate']
+        self.viscosity = parameters['viscosity']
+        self.iterations = int(parameters['iterations'])
+
+    def step(self) -> None:
+        """FluidBatch.step, a strip at a time."""
+        f = self.fields
+        self.diffuse(1, f['prev_vel_x'], f['vel_x'], self.viscosity)
+        self.diffuse(2, f['prev_vel_y'], f['vel_y'], self.viscosity)
+        self.project(f['prev_vel_x'], f['prev_vel_y'], f['vel_x'], f['vel_y'])
+        self.advect(1, f['vel_x'], f['prev_vel_x'], f['prev_vel_x'],
+                    f['prev_vel_y'])
+        self.advect(2, f['vel_y'], f['prev_vel_y'], f['prev_vel_x'],
+                    f['prev_vel_y'])
+        self.project(f['vel_x'], f['vel_y'], f['prev_vel_x'], f['prev_vel_y'])
+
+        self.diffuse(0, f['prev_density'], f['density'], self.diffusion_rate)
+        self.advect(0, f['density'], f['prev_density'], f['vel_x'], f['vel_y'])
+
+    def diffuse(self, side: int, current: np.ndarray, prev: np.ndarray,
+                rate: float) -> None:
+        a = np.multiply(self.dt, rate) * ((self.n - 2)**2)
+        self.lin_solve(side, current, prev, a, 1 + (4 * a))
+
+    def lin_solve(self, side: int, current: np.ndarray, prev: np.ndarray,
+                  a: float, c: float) -> None:
+        weight = self.dtype.type(a)
+        divisor = self.dtype.type(c)
+        for _ in range(self.iterations):
+            _relax(current, prev, weight, divisor, 0, self.start, self.stop)
+            self.barrier.wait()
+            _relax(current, prev, weight, divisor, 1, self.start, self.stop)
+            _set_bnd(current, side, self.start, self.stop)
+            self.barrier.wait()
+
+    def advect(self, side: int, current: np.ndarray, prev: np.ndarray,
+               vel_x: np.ndarray, vel_y: np.ndarray) -> None:
+        n, rows = self.n, slice(self.start, self.stop)
+        dt0 = self.dtype.type(np.multiply(self.dt, n - 2))
+        i = np.arange(self.start, self.stop, dtype=self.dtype).reshape(-1, 1)
+        j = np.arange(1, n - 1, dtype=self.dtype).reshape(1, -1)
+
+        x = np.clip(i - dt0 * vel_x[rows, 1:-1], 0.5, n - 1.5)
+        y = np.clip(j - dt0 * vel_y[rows, 1:-1], 0.5, n - 1.5)
+
+        x0 = np.floor(x)
+        y0 = np.floor(y)
+        i0 = x0.astype(np.intp)
+        j0 = y0.astype(np.intp)
+
+        s1 = x - x0
+        s0 = 1 - s1
+        t1 = y - y0
+        t0 = 1 - t1
+
+        left = t0 * prev[i0, j0] + t1 * prev[i0, j0 + 1]
+        right = t0 * prev[i0 + 1, j0] + t1 * prev[i0 + 1, j0 + 1]
+        current[rows, 1:-1] = s0 * left + s1 * right
+        _set_bnd(current, side, self.start, self.stop)
+        self.barrier.wait()
+
+    def project(self, vel_x: np.ndarray, vel_y: np.ndarray, p: np.ndarray,
+                div: np.ndarray) -> None:
+        start, stop = self.start, self.stop
+        rows = slice(start, stop)
+        h = 1 / self.n
+
+        div[rows, 1:-1] = -0.5 * h * (vel_x[start + 1:stop + 1, 1:-1] -
+                                      vel_x[start - 1:stop - 1, 1:-1] +
+                                      vel_y[rows, 2:] - vel_y[rows, :-2])
+        p[rows, 1:-1] = 0
+        _set_bnd(div, 0, start, stop)
+        _set_bnd(p, 0, start, stop)
+        self.barrier.wait()
+
+        self.lin_solve(0, p, div, 1, 4)
+
+        vel_x[rows, 1:-1] -= 0.5 * (p[start + 1:stop + 1, 1:-1] -
+                                    p[start - 1:stop - 1, 1:-1]) / h
+        vel_y[rows, 1:-1] -= 0.5 * (p[rows, 2:] - p[rows, :-2]) / h
+        _set_bnd(vel_x, 1, start, stop)
+        _set_bnd(vel_y, 2, start, stop)
+        self.barrier.wait()
+
+
+def _work(name: str, shape: Tuple[int, ...], dtype: np.dtype, start: int,
+          stop: int, parameters: Dict[str, float], barrier: Any, begin: Any,
+          end: Any, command: Any, errors: Any) -> None:
+    """The loop of a worker process, which steps its strip each time the fluid steps."""
+    memory = shared_memory.SharedMemory(name)
+    try:
+        # The views of the memory are gone once this returns, so it can be closed
+        _serve(np.ndarray(shape, dtype, buffer=memory.buf), start, stop,
+               parameters, barrier, begin, end, command, errors)
+    finally:
+        memory.close()
+
+
+def _serve(block: np.ndarray, start: int, stop: int,
+           parameters: Dict[str, float], barrier: Any, begin: Any, end: Any,
+           command: Any, errors: Any) -> None:
+    try:
+        worker = _Worker(dict(zip(_FIELDS, block)), start, stop, barrier,
+                         parameters)
+        while True:
+            begin.wait()
+            if command.value == _STOP:
+                return
+            worker.step()
+            end.wait()
+    except threading.BrokenBarrierError:
+        # Another worker failed, or the fluid is closing after one did
+        return
+    except Exception:
+        errors.put(traceback.format_exc())
+        # Wakes the other workers and the fluid from whichever barrier they are waiting at
+        for waiting in (barrier, begin, end):
+            waiting.abort()
+
+
+class DistributedFluid:
+    def __init__(self,
+                 grid_size: int,
+                 dt: float,
+                 diffusion_rate: float,
+                 viscosity: float,
+                 workers: Optional[int] = None,
+                 iterations: int = 8,
+                 dtype: Union[type, np.dtype] = np.float64):
+        """Initializes a fluid board that is stepped by workers processes, each owning a strip of
+        its rows. It runs the same simulation as a FluidBatch, see the module docstring.
+
+        The board is DistributedFluid.density, vel_x and vel_y, which are views of the shared
+        memory the workers step, so they can be read and edited between steps without copying.
+        The workers are started here and run until close is called, which the fluid can also be
+        used as a context manager for.
+
+        Args:
+            grid_size: The length of each side of the board.
+            dt: How long each timestep is.
+            diffusion_rate: The rate at which the fluid dissolves into lesser occupied space.
+            viscosity: How thick the fluid is.
+            workers: How many processes to split the board between. Defaults to one per core.
+            iterations: How many red-black Gauss-Seidel sweeps each diffuse and project solves
+                with.
+            dtype: The precision every field is stored and solved in, float32 or float64.
+
+        Raises:
+            ValueError: If there are more workers than interior rows of the board.
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.N = grid_size
+        self.dt = dt
+        self.diffusion_rate = diffusion_rate
+        self.viscosity = viscosity
+        self.iterations = iterations
+        self.dtype = np.dtype(dtype)
+        self.strips = strips(grid_size, workers)
+
+        shape = (len(_FIELDS), grid_size, grid_size)
+        self._memory = shared_memory.SharedMemory(create=True,
+                                                  size=int(np.prod(shape)) *
+                                                  self.dtype.itemsize)
+        self._block: np.ndarray = np.ndarray(shape,
+                                             self.dtype,
+                                             buffer=self._memory.buf)
+        self._block[...] = 0
+        self._fields = dict(zip(_FIELDS, self._block))
+
+        parameters = {
+            'dt': dt,
+            'diffusion_rate': diffusion_rate,
+            'viscosity': viscosity,
+            'iterations': iterations,
+        }
+        context = multiprocessing.get_context('spawn')
+        self._barrier = context.Barrier(workers)
+        # The fluid waits at these along with the workers, to start a step and to wait for it
+        self._begin = context.Barrier(workers + 1)
+        self._end = context.Barrier(workers + 1)
+        self._command = context.Value('i', _STEP, lock=False)
+        self._errors = context.Queue()
+        self._processes = [
+            context.Process(target=_work,
+                            args=(self._memory.name, shape, self.dtype, start,
+                                  stop, parameters, self._barrier, self._begin,
+                                  self._end, self._command, self._errors),
+                            daemon=True) for start, stop in self.strips
+        ]
+        for process in self._processes:
+            process.start()
+        self.closed = False
+
+    @property
+    def density(self) -> np.ndarray:
+        """The density of the whole board, indexed [x, y].
+
+        It is a view of the shared memory the workers step their strips in, not a copy, so it
+        changes with every step and writing to it between steps edits the fluid.
+        """
+        return self._fields['density']
+
+    @property
+    def vel_x(self) -> np.ndarray:
+        """The velocity in the x direction of every cell on the board."""
+        return self._fields['vel_x']
+
+    @property
+    def vel_y(self) -> np.ndarray:
+        """The velocity in the y direction of every cell on the board."""
+        return self._fields['vel_y']
+
+    def add_density(self, x: int, y: int, amount: float) -> None:
+        """Adds density to the (x, y) position on the fluid board."""
+        self.density[x, y] += amount
+
+    def add_velocity(self, x: int, y: int, amount_x: float,
+                     amount_y: float) -> None:
+        """Adds velocity to the (x, y) position on the fluid board."""
+        self.vel_x[x, y] += amount_x
+        self.vel_y[x, y] += amount_y
+
+    def add_density_many(self,
+                         x: np.ndarray,
+                         y: np.ndarray,
+                         amounts: np.ndarray,
+                         brush: Optional[np.ndarray] = None) -> None:
+        """Adds density at many (x, y) positions at once, see Fluid.add_density_many."""
+        indices, (amounts, ) = _splat(self.N, x, y, (amounts, ), brush)
+        np.add.at(self.density, indices, amounts)
+
+    def add_velocity_many(self,
+                          x: np.ndarray,
+                          y: np.ndarray,
+                          amounts_x: np.ndarray,
+                          amounts_y: np.ndarray,
+                          brush: Optional[np.ndarray] = None) -> None:
+        """Adds velocity at many (x, y) positions at once, see Fluid.add_velocity_many."""
+        indices, (amounts_x, amounts_y) = _splat(self.N, x, y,
+                                                 (amounts_x, amounts_y), brush)
+        np.add.at(self.vel_x, indices, amounts_x)
+        np.add.at(self.vel_y, indices, amounts_y)
+
+    def step(self) -> None:
+        """A total step of the simulation, with every worker stepping its strip. Returns once they
+        all have.
+
+        Raises:
+            ValueError: If the fluid has been closed.
+            RuntimeError: If a worker failed, with its traceback. The fluid is closed.
+        """
+        if self.closed:
+            raise ValueError('The fluid has been closed')
+        try:
+            self._begin.wait()
+            self._end.wait()
+        except threading.BrokenBarrierError:
+            self._failed()
+
+    def close(self) -> None:
+        """Stops the workers and frees the shared memory. The fields can't be used afterwards."""
+        if self.closed:
+            return
+        self.closed = True
+        self._command.value = _STOP
+        try:
+            self._begin.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            pass
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._fields.clear()
+        del self._block
+        self._memory.unlink()
+        try:
+            self._memory.close()
+        except BufferError:
+            # Something still holds a view of a field, the memory is freed along with it
+            pass
+
+    def __enter__(self) -> 'DistributedFluid':
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def _failed(self) -> None:
+        try:
+            message = self._errors.get(timeout=10)
+        except queue.Empty:
+            message = 'A worker stopped without a traceback'
+        self.close()
+        raise RuntimeError(f'A worker failed while stepping:\n{message}')
@@ -1,11 +1,124 @@
+import math
+from typing import (Any, Callable, ContextManager, Dict, List, NamedTuple,
+                    Optional, Sequence, Set, Tuple, Union)
 import numpy as np
-from numba import cuda
-from fluid_sim.fluid_utils import IX_cpu, diffuse, advect, project
+from fluid_sim import (checkpoint, fluid_utils, numba_utils, numpy_utils,
+                       resample)
+from fluid_sim.boundary import Boundary
+from fluid_sim.recorder import FrameRecorder
+from fluid_sim.solvers import (ConjugateGradientSolver, MultigridSolver,
+                               SolveResult)
+from fluid_sim.stats import StepStats, untimed
+from fluid_sim.tiles import ActiveTiles
+
+BACKENDS = {
+    'cuda': fluid_utils,
+    'numpy': numpy_utils,
+    'numba-cpu': numba_utils,
+}
+
+PRESSURE_SOLVERS = ('gauss-seidel', 'multigrid', 'cg')
+DIFFUSION_SOLVERS = ('gauss-seidel', 'cg')
+DISSIPATIONS = ('exponential', 'linear')
+
+# How many gauss-seidel sweeps project runs between checks of the residual
+RESIDUAL_CHECK_INTERVAL = 4
+
+# The fields the user sees and edits
+FIELDS = ('density', 'vel_x', 'vel_y')
+
+# The scratch fields a step carries over to the next, which a checkpoint saves along with FIELDS
+_STATE = ('_prev_density', '_prev_vel_x', '_prev_vel_y')
+
+DTYPES = (np.float32, np.float64)
+
+
+class AdvanceResult(NamedTuple):
+    """How Fluid.advance split an interval into steps.
+
+    Attributes:
+        dt: The timestep of each step.
+        substeps: How many steps it took.
+        max_speed: The fastest speed on the board at the start, which dt was picked from.
+    """
+    dt: float
+    substeps: int
+    max_speed: float
+
+
+def gaussian_brush(radius: int, sigma: Optional[float] = None) -> np.ndarray:
+    """A round brush for add_density_many and add_velocity_many that fades out from its centre.
+
+    Args:
+        radius: How many cells the brush reaches out from its centre, so it is 2 * radius + 1 wide.
+        sigma: The standard deviation of the gaussian in cells. Defaults to half the radius.
+
+    Returns:
+        np.ndarray: The (2 * radius + 1, 2 * radius + 1) brush, with its centre cell at 1.
+    """
+    if sigma is None:
+        sigma = max(radius / 2, 0.5)
+    offsets = np.arange(-radius, radius + 1)
+    squared = offsets.reshape(-1, 1)**2 + offsets.reshape(1, -1)**2
+    return np.exp(-squared / (2 * sigma**2))
+
+
+def _splat(
+    side_length: int, x: np.ndarray, y: np.ndarray,
+    amounts: Tuple[np.ndarray, ...], brush: Optional[np.ndarray]
+) -> Tuple[Tuple[np.ndarray, np.ndarray], Tuple[np.ndarray, ...]]:
+    """Works out which (x, y) positions each of the amounts is added to, stamping the brush centred
+    on every (x, y) and dropping whatever lands outside the board.
+    """
+    x = np.asarray(x, dtype=np.intp).ravel()
+    y = np.asarray(y, dtype=np.intp).ravel()
+    amounts = tuple(
+        np.broadcast_to(np.asarray(amount, dtype=np.float64).ravel(), x.shape)
+        for amount in amounts)
+
+    if brush is not None:
+        brush = np.asarray(brush, dtype=np.float64)
+        offsets = np.indices(brush.shape)
+        offset_x = offsets[0] - brush.shape[0] // 2
+        offset_y = offsets[1] - brush.shape[1] // 2
+        x = (x.reshape(-1, 1) + offset_x.ravel()).ravel()
+        y = (y.reshape(-1, 1) + offset_y.ravel()).ravel()
+        amounts = tuple((amount.reshape(-1, 1) * brush.ravel()).ravel()
+                        for amount in amounts)
+
+    inside = (x >= 0) & (x < side_length) & (y >= 0) & (y < side_length)
+    return (x[inside], y[inside]), tuple(amount[inside] for amount in amounts)
 
 
 class Fluid:
-    def __init__(self, grid_size: int, dt: float, diffusion_rate: float,
-                 viscosity: float):
+    def __init__(self,
+                 grid_size: int,
+                 dt: float,
+                 diffusion_rate: float,
+                 viscosity: float,
+                 backend: str = 'cuda',
+                 num_threads: Optional[int] = None,
+                 iterations: int = 8,
+                 pressure_solver: str = 'gauss-seidel',
+                 diffusion_solver: str = 'gauss-seidel',
+                 tolerance: float = 1e-3,
+                 max_cycles: int = 20,
+                 max_iterations: int = 200,
+                 warm_start: bool = True,
+                 resident: bool = False,
+                 dtype: Union[type, np.dtype] = np.float64,
+                 obstacles: Optional[np.ndarray] = None,
+                 tile_size: Optional[int] = None,
+                 tile_threshold: float = 1e-4,
+                 fused: bool = False,
+                 stats: bool = False,
+                 stats_window: int = 100,
+                 output_size: Optional[int] = None,
+                 density_dissipation: float = 0,
+                 velocity_dissipation: float = 0,
+                 dissipation: str = 'exponential',
+                 cfl: float = 1,
+                 max_substeps: int = 32):
         """Initializes a fluid board, where the grid size is the square root of the total number of
         simulatenously simulated grid squares of fluid.
 
@@ -19,26 +132,238 @@ class Fluid:
         public variable (Fluid.density/x_vel/y_vel). They will always have the most up to date
         instance of the values.
 
+        On machines without a cuda gpu, pass backend='numpy' to run the same solver as whole array
+        NumPy operations on the cpu. The private matrices are then plain arrays and nothing is
+        copied each step. backend='numba-cpu' does the same with compiled kernels that are split
+        across num_threads cores.
+
         Args:
             grid_size: The length of each side of the simulated board.
             dt: How long each timestep is.
             diffusion_rate: The rate at which the fluid dissolves into lesser occupied space.
             viscosity: How thick the fluid is.
+            backend: Which solver to run the simulation with, one of the keys of BACKENDS.
+            num_threads: How many cores the numba-cpu backend splits each step across. Defaults to
+                every core numba can see.
+            iterations: How many red-black Gauss-Seidel sweeps each diffuse solves with, and the
+                most project solves with. More is more accurate but slower.
+            pressure_solver: How project solves for the pressure, one of PRESSURE_SOLVERS.
+                'gauss-seidel' runs sweeps until the residual is below tolerance or it has run
+                iterations of them, 'multigrid' runs V-cycles and 'cg' preconditioned conjugate
+                gradients until the residual is below tolerance, which keeps big grids
+                incompressible. Only the cpu backends support those two.
+            diffusion_solver: How diffuse solves, one of DIFFUSION_SOLVERS. 'cg' needs far fewer
+                iterations than 'gauss-seidel' at high viscosities and diffusion rates.
+            tolerance: The residual, relative to the divergence or the diffused field, that the
+                solvers stop at. A solve that runs the most sweeps, cycles or iterations it may
+                first stops there instead, with the residual it got to in Fluid.solve_results.
+            max_cycles: The most V-cycles a 'multigrid' pressure solve runs.
+            max_iterations: The most iterations a 'cg' diffusion or pressure solve runs.
+            warm_start: Whether project starts from the pressure it solved for last step instead
+                of from 0. The pressure changes little between steps in a steady flow, so the
+                residual is often below tolerance before a single sweep.
+            resident: Whether density and the velocities stay on the device between steps instead
+                of being copied over and back every step. They are then only copied back when
+                read, into the same host array each time, and are read only; assign a whole field
+                to replace it. Edits made with the add methods are queued and added on the device
+                in one go before the next step or read.
+            dtype: The precision every field is stored and solved in, one of DTYPES. float32 halves
+                the memory each step moves, which is where most of its time goes.
+            obstacles: A (grid_size, grid_size) mask that is true where the board is solid. The
+                fluid flows around those cells the way it does along the border. See
+                Fluid.obstacles.
+            tile_size: If given, the board is split into tiles this many cells wide and a step
+                only covers the tiles holding fluid, plus a tile around each of them for the fluid
+                to move into. Steps then cost the area the fluid covers instead of the whole
+                board. Fluid.tiles holds which tiles the next step covers. Only the numba-cpu
+                backend with the gauss-seidel solvers steps tiles.
+            tile_threshold: The largest density or speed a tile can hold and still be skipped.
+                Whatever is left in a tile once it is skipped is zeroed.
+            fused: Whether the numba-cpu backend runs the gauss-seidel sweeps of each solve a few
+                at a time in one pass over the board, which keeps the rows they work on in cache.
+                It pays off once the board is too big for the caches. The result is the same to
+                rounding. See numba_utils.
+            stats: Whether to time every stage of each step and count the solver iterations and
+                bytes copied to and from the device, into Fluid.stats. Each stage waits for the gpu
+                to finish it before it is timed, so with the cuda backend the stages no longer
+                overlap. Without stats nothing is measured.
+            stats_window: How many of the latest samples of each timing and counter Fluid.stats
+                keeps.
+            output_size: The length of each side of what the board is shown at, if not one pixel
+                per cell. Fluid.render scales a field up or down to it, and add_density_many and
+                add_velocity_many take positions on it with output_space=True, so a small board
+                can be simulated and shown on a big display.
+            density_dissipation: How fast the density fades away by itself, see dissipation.
+            velocity_dissipation: How fast the velocity fades away by itself, see dissipation.
+            dissipation: How the density and velocity fade, one of DISSIPATIONS. 'exponential'
+                loses that fraction of what is left each unit of time, and 'linear' that much of
+                it each unit of time until it is gone. Either way it is done as each field is
+                advected, without another pass over the board.
+            cfl: The most cells Fluid.advance lets the fastest fluid move in one step. Advection
+                stays stable past 1, but is less accurate.
+            max_substeps: The most steps Fluid.advance splits an interval into, however fast the
+                fluid is, so one violent moment cannot stall it.
+
+        Raises:
+            ValueError: If the backend is not one of the keys of BACKENDS, num_threads, tile_size
+                or fused is given for a backend or solver that does not use it, the pressure solver
+                is not available, the dtype is not one of DTYPES, the obstacles are not supported,
+                output_size is less than 2, the dissipation is not one of DISSIPATIONS, either
+                rate of it is negative, cfl is not positive or max_substeps, max_cycles or
+                max_iterations is less than 1.
         """
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown backend {backend!r}, expected one of '
+                             f'{list(BACKENDS)}')
+        if num_threads is not None and backend != 'numba-cpu':
+            raise ValueError(
+                f'num_threads is only used by the numba-cpu backend, not {backend!r}'
+            )
+        if tile_size is not None and backend != 'numba-cpu':
+            raise ValueError(
+                f'tile_size is only used by the numba-cpu backend, not {backend!r}'
+            )
+        if fused and backend != 'numba-cpu':
+            raise ValueError(
+                f'fused is only used by the numba-cpu backend, not {backend!r}'
+            )
+        if fused and tile_size is not None:
+            raise ValueError('Tiles cannot be stepped with fused sweeps')
+        if pressure_solver not in PRESSURE_SOLVERS:
+            raise ValueError(
+                f'Unknown pressure solver {pressure_solver!r}, expected one of '
+                f'{list(PRESSURE_SOLVERS)}')
+        if diffusion_solver not in DIFFUSION_SOLVERS:
+            raise ValueError(
+                f'Unknown diffusion solver {diffusion_solver!r}, expected one of '
+                f'{list(DIFFUSION_SOLVERS)}')
+        for solver in (pressure_solver, diffusion_solver):
+            if solver != 'gauss-seidel' and backend == 'cuda':
+                raise ValueError(f'The {solver!r} solver needs a cpu backend')
+            # A gauss-seidel sweep only moves values a cell or two, but the other solvers reach
+            # across the whole board in one solve so cannot be kept to the stepped tiles
+            if solver != 'gauss-seidel' and tile_size is not None:
+                raise ValueError(
+                    f'The {solver!r} solver cannot be stepped a tile at a time'
+                )
+        if output_size is not None and output_size < 2:
+            raise ValueError(
+                f'Expected output_size to be at least 2, got {output_size}')
+        if dissipation not in DISSIPATIONS:
+            raise ValueError(f'Unknown dissipation {dissipation!r}, expected '
+                             f'one of {list(DISSIPATIONS)}')
+        if min(density_dissipation, velocity_dissipation) < 0:
+            raise ValueError('The dissipation rates cannot be negative')
+        if cfl <= 0:
+            raise ValueError(f'cfl must be positive, got {cfl}')
+        if max_substeps < 1:
+            raise ValueError(
+                f'max_substeps must be at least 1, got {max_substeps}')
+        if max_cycles < 1:
+            raise ValueError(
+                f'max_cycles must be at least 1, got {max_cycles}')
+        if max_iterations < 1:
+            raise ValueError(
+                f'max_iterations must be at least 1, got {max_iterations}')
+        if np.dtype(dtype) not in DTYPES:
+            raise ValueError(f'Unknown dtype {dtype!r}, expected one of '
+                             f'{[np.dtype(d).name for d in DTYPES]}')
+        self.dtype = np.dtype(dtype)
+        self.backend = backend
+        self._backend = BACKENDS[backend]
+        self.num_threads = num_threads
+
         self.N = grid_size
         self.grid_space = (grid_size)**2
+        self.shape = (grid_size, grid_size)
         self.dt = dt
         self.diffusion_rate = diffusion_rate
         self.viscosity = viscosity
+        self.iterations = iterations
+        self.tolerance = tolerance
+        self.max_cycles = max_cycles
+        self.max_iterations = max_iterations
+        self.warm_start = warm_start
+        self.pressure_solver = pressure_solver
+        self.diffusion_solver = diffusion_solver
+        self.density_dissipation = density_dissipation
+        self.velocity_dissipation = velocity_dissipation
+        self.dissipation = dissipation
+        self.cfl = cfl
+        self.max_substeps = max_substeps
+        # How the last call to advance went
+        self.advance_result: Optional[AdvanceResult] = None
+        self._multigrid: Optional[MultigridSolver] = None
+        if pressure_solver == 'multigrid':
+            self._multigrid = MultigridSolver(grid_size,
+                                              tolerance,
+                                              max_cycles=max_cycles,
+                                              dtype=self.dtype)
+        cg = None
+        if 'cg' in (pressure_solver, diffusion_solver):
+            cg = ConjugateGradientSolver(grid_size,
+                                         tolerance,
+                                         max_iterations=max_iterations,
+                                         dtype=self.dtype)
+        self._diffusion_cg = cg if diffusion_solver == 'cg' else None
+        self._pressure_cg = cg if pressure_solver == 'cg' else None
+
+        # How every solve of the last step went. Gauss-seidel diffusion always runs the same
+        # number of sweeps so it is not in here
+        self.solve_results: Dict[str, SolveResult] = {}
+
+        # The pressure each of the two projects in a velocity step solved for last, to start the
+        # next solve from
+        self._pressure = {
+            name: self._backend.zeros(self.shape, self.dtype)
+            for name in ('project_diffused', 'project_advected')
+        }
+
+        # The user's fields, on the host unless resident in which case they are on the device and
+        # the host only holds copies of them that are updated when read
+        self.resident = resident
+        self._fields: Dict[str, np.ndarray] = {}
+        self._mirrors: Dict[str, np.ndarray] = {}
+        self._stale: Set[str] = set()
+        self._edits: Dict[str, List[Tuple[Tuple[np.ndarray, np.ndarray],
+                                          np.ndarray]]] = {
+                                              name: []
+                                              for name in FIELDS
+                                          }
+        for name in FIELDS:
+            setattr(self, name, np.zeros(self.shape, self.dtype))
 
-        self.density = np.zeros(self.grid_space)
-        self._prev_density = cuda.to_device(np.zeros(self.grid_space))
+        self._prev_density = self._backend.zeros(self.shape, self.dtype)
+        self._prev_vel_x = self._backend.zeros(self.shape, self.dtype)
+        self._prev_vel_y = self._backend.zeros(self.shape, self.dtype)
 
-        self.vel_x = np.zeros(self.grid_space)
-        self.vel_y = np.zeros(self.grid_space)
+        # Which tiles each step covers, if it does not cover the whole board. They are passed to
+        # the backend as a keyword only the numba-cpu backend has
+        self.tiles: Optional[ActiveTiles] = None
+        self._tiling: Dict[str, ActiveTiles] = {}
+        if tile_size is not None:
+            self.tiles = ActiveTiles(grid_size, tile_size, tile_threshold)
+        # Likewise for fusing the sweeps of the gauss-seidel solves
+        self.fused = fused
+        self._fusing: Dict[str, bool] = {'fused': True} if fused else {}
 
-        self._prev_vel_x = cuda.to_device(np.zeros(self.grid_space))
-        self._prev_vel_y = cuda.to_device(np.zeros(self.grid_space))
+        self._boundary: Optional[Boundary] = None
+        self.obstacles = obstacles
+
+        # Every stage is wrapped in self._timed, which measures nothing without stats
+        self.stats: Optional[StepStats] = None
+        self._timed: Callable[[str], ContextManager[None]] = untimed
+        if stats:
+            self.stats = StepStats(stats_window, self._backend.synchronize)
+            self._timed = self.stats.timed
+        # Only the cuda backend has a device that the fields are copied to
+        self._copies = backend == 'cuda'
+
+        self.recorder: Optional[FrameRecorder] = None
+
+        self.output_size = grid_size if output_size is None else output_size
+        # Only made once something is rendered, as it holds a few output sized scratch arrays
+        self._resampler: Optional[resample.Bilinear] = None
 
     def add_density(self, x: int, y: int, amount: float) -> None:
         """Adds density to the (x, y) position on the fluid board.
@@ -48,8 +373,8 @@ class Fluid:
             y: The y position.
             amount: The amount of fluid that will be added.
         """
-        index = IX_cpu(x, y, self.N)
-        self.density[index] += amount
+        self._add('density', (np.array([x]), np.array([y])),
+                  np.array([amount]))
 
     def add_velocity(self, x: int, y: int, amount_x: float,
                      amount_y: float) -> None:
@@ -61,51 +386,575 @@ class Fluid:
             amount_x: The amount of velocity in the x direction.
             amount_y: The amount of velocity in the y direction.
         """
-        index = IX_cpu(x, y, self.N)
-        self.vel_x[index] += amount_x
-        self.vel_y[index] += amount_y
+        position = (np.array([x]), np.array([y]))
+        self._add('vel_x', position, np.array([amount_x]))
+        self._add('vel_y', position, np.array([amount_y]))
+
+    def add_density_many(self,
+                         x: np.ndarray,
+                         y: np.ndarray,
+                         amounts: np.ndarray,
+                         brush: Optional[np.ndarray] = None,
+                         output_space: bool = False) -> None:
+        """Adds density at many (x, y) positions at once. Positions that are repeated add up, and
+        anything that lands outside the board is dropped.
+
+        Args:
+            x: The x positions.
+            y: The y positions, the same length as x.
+            amounts: The amount of fluid added at each position, or one amount for all of them.
+            brush: A 2d array of weights stamped centred on every position, with each weight
+                multiplied by the position's amount. See gaussian_brush. Defaults to just the
+                position itself.
+            output_space: Whether the positions are pixels of the output_size output rather than
+                cells of the board, in which case each lands on the cell nearest to it. The brush
+                is still in cells.
+        """
+        x, y = self._positions(x, y, output_space)
+        indices, (amounts, ) = _splat(self.N, x, y, (amounts, ), brush)
+        self._add('density', indices, amounts)
+
+    def add_velocity_many(self,
+                          x: np.ndarray,
+                          y: np.ndarray,
+                          amounts_x: np.ndarray,
+                          amounts_y: np.ndarray,
+                          brush: Optional[np.ndarray] = None,
+                          output_space: bool = False) -> None:
+        """Adds velocity at many (x, y) positions at once. Positions that are repeated add up, and
+        anything that lands outside the board is dropped.
+
+        Args:
+            x: The x positions.
+            y: The y positions, the same length as x.
+            amounts_x: The velocity added in the x direction at each position, or one for all of
+                them.
+            amounts_y: The velocity added in the y direction at each position, or one for all of
+                them.
+            brush: A 2d array of weights stamped centred on every position, with each weight
+                multiplied by the position's amounts. See gaussian_brush. Defaults to just the
+                position itself.
+            output_space: Whether the positions are pixels of the output_size output rather than
+                cells of the board, in which case each lands on the cell nearest to it. The brush
+                is still in cells, and the velocities are unchanged as they do not depend on the
+                size of the board.
+        """
+        x, y = self._positions(x, y, output_space)
+        indices, (amounts_x, amounts_y) = _splat(self.N, x, y,
+                                                 (amounts_x, amounts_y), brush)
+        self._add('vel_x', indices, amounts_x)
+        self._add('vel_y', indices, amounts_y)
+
+    def render(self,
+               name: str = 'density',
+               out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Scales one of the fields to output_size with bilinear interpolation, for showing it.
+
+        Args:
+            name: Which field to render, one of FIELDS.
+            out: An (output_size, output_size) array of the fluid's dtype to render into, which is
+                best reused from frame to frame rather than allocating a new one each time.
+
+        Returns:
+            np.ndarray: The field at output_size, indexed [x, y], which is out if it was given.
+
+        Raises:
+            ValueError: If name is not one of FIELDS, or out is not shaped and typed as above.
+        """
+        if name not in FIELDS:
+            raise ValueError(f'Unknown field {name!r}, expected one of '
+                             f'{list(FIELDS)}')
+        field = self._read(name)
+        if self.output_size == self.N:
+            if out is None:
+                return field.copy()
+            np.copyto(out, field)
+            return out
+        if self._resampler is None:
+            self._resampler = resample.Bilinear(self.N, self.output_size,
+                                                self.dtype)
+        with self._timed('render'):
+            return self._resampler(field, out)
+
+    def _positions(self, x: np.ndarray, y: np.ndarray,
+                   output_space: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """The cells of the board at the positions, which are pixels of the output if
+        output_space.
+        """
+        if not output_space or self.output_size == self.N:
+            return x, y
+        return (resample.nearest(x, self.N, self.output_size),
+                resample.nearest(y, self.N, self.output_size))
+
+    def record(self,
+               path: str,
+               frames: int,
+               fields: Sequence[str] = ('density', ),
+               every: int = 1,
+               quantize: Optional[str] = None,
+               limits: Optional[Dict[str, Tuple[float, float]]] = None,
+               buffers: int = 4,
+               colormap: Optional[str] = None) -> FrameRecorder:
+        """Starts recording fields to a memory mapped .npy file after every few steps.
+
+        The fields are copied into one of a few buffers at the end of a step and written to disk
+        on a background thread, so a step only waits on the disk once every buffer is waiting to
+        be written. Only step records, not vel_step or density_step. See fluid_sim.recorder.
+
+        Args:
+            path: Where to write the recording, which should end in .npy.
+            frames: How many frames to make room for, later ones are dropped.
+            fields: Which of FIELDS to record.
+            every: Record a frame every this many steps.
+            quantize: How to store the fields, one of recorder.QUANTIZATIONS, or None to keep them
+                in the fluid's dtype.
+            limits: The (low, high) of each field for uint8, which are stored as 0 and 255, or for
+                the colormap.
+            buffers: How many frames can be waiting to be written before a step waits.
+            colormap: The name of one of render.COLORMAPS to record the fields as uint8 RGB pixels
+                of instead.
+
+        Returns:
+            FrameRecorder: The recorder, which is also Fluid.recorder until stop_recording.
+
+        Raises:
+            ValueError: If the fluid is already recording, a field is not one of FIELDS or the
+                recorder's arguments are not valid.
+        """
+        if self.recorder is not None:
+            raise ValueError('The fluid is already recording, stop_recording '
+                             'first')
+        unknown = [name for name in fields if name not in FIELDS]
+        if unknown:
+            raise ValueError(f'Unknown fields {unknown}, expected some of '
+                             f'{list(FIELDS)}')
+        self.recorder = FrameRecorder(path, self.N, frames, fields, every,
+                                      quantize, limits, buffers, self.dtype,
+                                      colormap)
+        return self.recorder
+
+    def stop_recording(self) -> None:
+        """Waits for the recorded frames to be written and stops recording."""
+        if self.recorder is None:
+            return
+        recorder, self.recorder = self.recorder, None
+        recorder.close()
+
+    def save_checkpoint(self,
+                        path: str,
+                        base: Optional[str] = None,
+                        tile_size: int = 64) -> None:
+        """Saves the fields, the scratch fields and pressures a step carries over and the
+        parameters to a raw binary file, which load_checkpoint maps straight back.
+
+        num_threads, stats and any recording are not saved. See fluid_sim.checkpoint.
+
+        Args:
+            path: Where to write the checkpoint.
+            base: A full checkpoint of this fluid to only save the tiles that have changed since,
+                or None to save everything.
+            tile_size: The length of each side of the tiles compared with the base.
+
+        Raises:
+            ValueError: If base is path, is incremental itself or is not a checkpoint of a fluid
+                like this.
+        """
+        arrays = {name: self._read(name) for name in FIELDS}
+        for name in _STATE:
+            arrays[name] = self._backend.to_host(getattr(self, name))
+        for name, pressure in self._pressure.items():
+            arrays[f'_pressure.{name}'] = self._backend.to_host(pressure)
+        if self.obstacles is not None:
+            arrays['obstacles'] = self.obstacles
+
+        parameters = {
+            'grid_size': self.N,
+            'dt': self.dt,
+            'diffusion_rate': self.diffusion_rate,
+            'viscosity': self.viscosity,
+            'backend': self.backend,
+            'iterations': self.iterations,
+            'pressure_solver': self.pressure_solver,
+            'diffusion_solver': self.diffusion_solver,
+            'tolerance': self.tolerance,
+            'max_cycles': self.max_cycles,
+            'max_iterations': self.max_iterations,
+            'warm_start': self.warm_start,
+            'resident': self.resident,
+            'dtype': self.dtype.name,
+            'fused': self.fused,
+            'output_size': self.output_size,
+            'density_dissipation': self.density_dissipation,
+            'velocity_dissipation': self.velocity_dissipation,
+            'dissipation': self.dissipation,
+            'cfl': self.cfl,
+            'max_substeps': self.max_substeps,
+        }
+        if self.tiles is not None:
+            parameters['tile_size'] = self.tiles.size
+            parameters['tile_threshold'] = self.tiles.threshold
+        checkpoint.write(path, arrays, parameters, base, tile_size)
+
+    @classmethod
+    def load_checkpoint(cls, path: str, **overrides: Any) -> 'Fluid':
+        """Makes a fluid from a checkpoint written by save_checkpoint, in the state it was saved.
+
+        The fields are memory mapped copy on write from the checkpoint rather than read into
+        memory, so a big checkpoint loads at once and stepping the fluid never changes it. On the
+        cuda backend, or given another dtype, they are copied over as the fluid is made.
+
+        Args:
+            path: Where the checkpoint was written.
+            overrides: Arguments of Fluid to make it with instead of the saved ones, such as
+                backend or num_threads.
+
+        Returns:
+            Fluid: The restored fluid.
+
+        Raises:
+            ValueError: If the file is not a checkpoint, or any of the reasons Fluid raises for.
+        """
+        arrays, parameters = checkpoint.read(path)
+        parameters.setdefault('obstacles', arrays.get('obstacles'))
+        fluid = cls(**{**parameters, **overrides})
+        for name in FIELDS:
+            setattr(fluid, name, arrays[name])
+
+        def restored(array: np.ndarray) -> np.ndarray:
+            return fluid._backend.to_device(np.asarray(array, fluid.dtype))
+
+        for name in _STATE:
+            setattr(fluid, name, restored(arrays[name]))
+        for name in fluid._pressure:
+            fluid._pressure[name] = restored(arrays[f'_pressure.{name}'])
+        return fluid
+
+    @property
+    def obstacles(self) -> Optional[np.ndarray]:
+        """A (grid_size, grid_size) mask that is true where the board is solid, or None if only
+        the border is.
+
+        Which cells the bounds are set on, and from which of their neighbours, is only worked out
+        when this is assigned, so setting the bounds each step costs the solid cells rather than
+        the whole board. The mask is read only, assign a new one to change it.
+
+        Raises:
+            ValueError: If the mask is not shaped like the board, or the fluid solves with a
+                solver that does not support obstacles, a tile at a time or with fused sweeps.
+        """
+        if self._boundary is None:
+            return None
+        return self._boundary.obstacles
+
+    @obstacles.setter
+    def obstacles(self, value: Optional[np.ndarray]) -> None:
+        if value is None:
+            self._boundary = None
+            return
+        for solver in (self.pressure_solver, self.diffusion_solver):
+            if solver != 'gauss-seidel':
+                raise ValueError(
+                    f'Obstacles are only supported by the gauss-seidel solver, '
+                    f'not {solver!r}')
+        if self.tiles is not None:
+            raise ValueError('Obstacles cannot be stepped a tile at a time')
+        if self.fused:
+            raise ValueError('Obstacles cannot be solved with fused sweeps')
+        self._boundary = Boundary(self.N, value, self.dtype).on_device(
+            self._backend.to_device)
+
+    @property
+    def density(self) -> np.ndarray:
+        """The density of every cell on the board, as a (grid_size, grid_size) array indexed
+        [x, y].
+        """
+        return self._read('density')
+
+    @density.setter
+    def density(self, value: np.ndarray) -> None:
+        self._write('density', value)
+
+    @property
+    def vel_x(self) -> np.ndarray:
+        """The velocity in the x direction of every cell on the board."""
+        return self._read('vel_x')
+
+    @vel_x.setter
+    def vel_x(self, value: np.ndarray) -> None:
+        self._write('vel_x', value)
+
+    @property
+    def vel_y(self) -> np.ndarray:
+        """The velocity in the y direction of every cell on the board."""
+        return self._read('vel_y')
+
+    @vel_y.setter
+    def vel_y(self, value: np.ndarray) -> None:
+        self._write('vel_y', value)
+
+    def _read(self, name: str) -> np.ndarray:
+        if not self.resident:
+            return self._fields[name]
+
+        self._flush(name)
+        if name in self._stale:
+            with self._timed('to_host'):
+                self._mirrors[name] = self._backend.to_host(
+                    self._fields[name], self._mirrors.get(name))
+            self._count_bytes('to_host', (self._mirrors[name], ))
+            self._stale.discard(name)
+        # Editing the copy would not change the field on the device, so stop it being edited
+        mirror = self._mirrors[name].view()
+        mirror.flags.writeable = False
+        return mirror
+
+    def _write(self, name: str, value: np.ndarray) -> None:
+        if not self.resident:
+            # Kept in the fluid's dtype so a step never mixes precisions, and 2d so a flat field
+            # from older code still lines up with the kernels
+            self._fields[name] = np.asarray(value, dtype=self.dtype).reshape(
+                self.shape)
+            return
+
+        # The new field replaces anything that was queued for the old one
+        self._edits[name].clear()
+        self._fields[name] = self._backend.to_device(
+            np.array(value, dtype=self.dtype).reshape(self.shape))
+        self._stale.add(name)
+
+    def _add(self, name: str, indices: Tuple[np.ndarray, np.ndarray],
+             amounts: np.ndarray) -> None:
+        if self.resident:
+            self._edits[name].append((indices, amounts))
+        else:
+            np.add.at(self._fields[name], indices, amounts)
+
+    def _flush(self, name: str) -> None:
+        """Adds every queued edit to a resident field with a single scatter on the device."""
+        edits = self._edits[name]
+        if not edits:
+            return
+        indices = (np.concatenate([x for (x, _), _ in edits]),
+                   np.concatenate([y for (_, y), _ in edits]))
+        amounts = np.concatenate([amount for _, amount in edits])
+        edits.clear()
+        with self._timed('to_device'):
+            self._backend.scatter_add(self._fields[name], indices, amounts)
+        self._count_bytes('to_device', (*indices, amounts))
+        self._stale.add(name)
+
+    def _to_device(self, names: Sequence[str]) -> Tuple[np.ndarray, ...]:
+        if self.resident:
+            for name in names:
+                self._flush(name)
+            return tuple(self._fields[name] for name in names)
+        with self._timed('to_device'):
+            device_arrays = tuple(
+                self._backend.to_device(self._fields[name]) for name in names)
+        self._count_bytes('to_device', device_arrays)
+        return device_arrays
+
+    def _to_host(self, names: Sequence[str],
+                 device_arrays: Sequence[np.ndarray]) -> None:
+        if self.resident:
+            self._stale.update(names)
+            return
+        with self._timed('to_host'):
+            for name, device_array in zip(names, device_arrays):
+                self._fields[name] = self._backend.to_host(device_array)
+        self._count_bytes('to_host',
+                          tuple(self._fields[name] for name in names))
+
+    def _count_bytes(self, direction: str,
+                     arrays: Sequence[np.ndarray]) -> None:
+        """Records how many bytes were copied to_device or to_host, 0 on the cpu backends."""
+        if self.stats is None:
+            return
+        copied = sum(array.nbytes for array in arrays) if self._copies else 0
+        self.stats.record(f'{direction}_bytes', copied)
+
+    def _count_iterations(self, name: str, iterations: int) -> None:
+        if self.stats is not None:
+            self.stats.record(f'{name}_iterations', iterations)
+
+    def _set_num_threads(self) -> None:
+        # numba's thread count is per calling thread, so it is set before every step in case
+        # another Fluid has changed it since
+        if self.num_threads is not None:
+            self._backend.set_num_threads(self.num_threads)
+
+    def _update_tiles(self) -> None:
+        """Works out which tiles the next step covers, and zeroes the tiles it no longer does in
+        every field the step uses.
+        """
+        if self.tiles is None:
+            return
+        with self._timed('update_tiles'):
+            self._find_tiles(self.tiles)
+
+    def _find_tiles(self, tiles: ActiveTiles) -> None:
+        fields = self._to_device(FIELDS)
+        released = tiles.update(
+            self._backend.tile_maxima(self.N, tiles.size, fields))
+        # Stepping every tile costs more than stepping the whole board in one go
+        self._tiling = {} if tiles.stepped.all() else {'tiles': tiles}
+        if not released.any():
+            return
+        arrays = (*fields, self._prev_density, self._prev_vel_x,
+                  self._prev_vel_y, *self._pressure.values())
+        for cells in tiles.slices(released):
+            for array in arrays:
+                array[cells] = 0
+        self._to_host(FIELDS, fields)
 
     def _density_step(self, density, vel_x, vel_y) -> None:
-        diffuse(self.N, 0, self._prev_density, density, self.diffusion_rate,
-                self.dt)
-        advect(self.N, 0, density, self._prev_density, vel_x, vel_y, self.dt)
+        with self._timed('density_step'):
+            self._diffuse('diffuse_density', 0, self._prev_density, density,
+                          self.diffusion_rate)
+            with self._timed('advect_density'):
+                self._backend.advect(
+                    self.N, 0, density, self._prev_density, vel_x, vel_y,
+                    self.dt, self._boundary,
+                    **self._dissipating(self.density_dissipation),
+                    **self._tiling)
 
     def density_step(self) -> None:
         """An 'optimised' density step that only copies the things to device that are truly needed
         for a density step. This should NOT be used if doing density and velocity steps together
         (which you should be if you are trying to simulate correctly). User step() instead.
         """
-        density_device = cuda.to_device(self.density)
-        vel_x_device = cuda.to_device(self.vel_x)
-        vel_y_device = cuda.to_device(self.vel_y)
-        self._density_step(density_device, vel_x_device, vel_y_device)
-        cuda.synchronize()
-        self.density = density_device.copy_to_host()
+        with self._timed('step'):
+            self._set_num_threads()
+            self._update_tiles()
+            density_device, vel_x_device, vel_y_device = self._to_device(
+                FIELDS)
+            self._density_step(density_device, vel_x_device, vel_y_device)
+            self._backend.synchronize()
+            self._to_host(('density', ), (density_device, ))
+        self._count_step()
 
     def vel_step(self) -> None:
         """An 'optimised' velocity step that only copies the things to device that are truly needed
         for a velocity step. This should NOT be used if doing density and velocity steps together
         (which you should be if you are trying to simulate correctly). Use step() instead.
         """
-        vel_x_device = cuda.to_device(self.vel_x)
-        vel_y_device = cuda.to_device(self.vel_y)
-        self._vel_step(vel_x_device, vel_y_device)
+        with self._timed('step'):
+            self._set_num_threads()
+            self._update_tiles()
+            vel_x_device, vel_y_device = self._to_device(('vel_x', 'vel_y'))
+            self._vel_step(vel_x_device, vel_y_device)
 
-        self.vel_x = vel_x_device.copy_to_host()
-        self.vel_y = vel_y_device.copy_to_host()
+            self._to_host(('vel_x', 'vel_y'), (vel_x_device, vel_y_device))
+        self._count_step()
 
     def _vel_step(self, vel_x, vel_y) -> None:
-        diffuse(self.N, 1, self._prev_vel_x, vel_x, self.viscosity, self.dt)
-        diffuse(self.N, 2, self._prev_vel_y, vel_y, self.viscosity, self.dt)
+        with self._timed('vel_step'):
+            self._diffuse('diffuse_vel_x', 1, self._prev_vel_x, vel_x,
+                          self.viscosity)
+            self._diffuse('diffuse_vel_y', 2, self._prev_vel_y, vel_y,
+                          self.viscosity)
 
-        project(self.N, self._prev_vel_x, self._prev_vel_y, vel_x, vel_y)
+            self._project('project_diffused', self._prev_vel_x,
+                          self._prev_vel_y, vel_x, vel_y)
+
+            dissipating = self._dissipating(self.velocity_dissipation)
+            with self._timed('advect_vel_x'):
+                self._backend.advect(self.N, 1, vel_x, self._prev_vel_x,
+                                     self._prev_vel_x, self._prev_vel_y,
+                                     self.dt, self._boundary, **dissipating,
+                                     **self._tiling)
+            with self._timed('advect_vel_y'):
+                self._backend.advect(self.N, 2, vel_y, self._prev_vel_y,
+                                     self._prev_vel_x, self._prev_vel_y,
+                                     self.dt, self._boundary, **dissipating,
+                                     **self._tiling)
+
+            self._project('project_advected', vel_x, vel_y, self._prev_vel_x,
+                          self._prev_vel_y)
+
+    def _dissipating(self, rate: float) -> Dict[str, float]:
+        """The keywords that make advect dissipate a field at rate over a step, which are none
+        without a rate so advect takes the same path it did before there was dissipation.
+        """
+        if not rate:
+            return {}
+        if self.dissipation == 'linear':
+            return {'decay': rate * self.dt}
+        return {'scale': math.exp(-rate * self.dt)}
 
-        advect(self.N, 1, vel_x, self._prev_vel_x, self._prev_vel_x,
-               self._prev_vel_y, self.dt)
-        advect(self.N, 2, vel_y, self._prev_vel_y, self._prev_vel_x,
-               self._prev_vel_y, self.dt)
+    def _diffuse(self, name: str, side: int, current: np.ndarray,
+                 prev: np.ndarray, rate: float) -> None:
+        with self._timed(name):
+            self._solve_diffusion(name, side, current, prev, rate)
 
-        project(self.N, vel_x, vel_y, self._prev_vel_x, self._prev_vel_y)
+    def _solve_diffusion(self, name: str, side: int, current: np.ndarray,
+                         prev: np.ndarray, rate: float) -> None:
+        if self._diffusion_cg is None:
+            self._backend.diffuse(self.N, side, current, prev, rate, self.dt,
+                                  self.iterations, self._boundary,
+                                  **self._tiling, **self._fusing)
+            self._count_iterations(name, self.iterations)
+            return
+
+        a = self.dt * rate * ((self.N - 2)**2)
+        result = self._diffusion_cg.solve(side, current, prev, a, 1 + (4 * a))
+        self.solve_results[name] = result
+        self._count_iterations(name, result.iterations)
+
+    def _project(self, name: str, vel_x: np.ndarray, vel_y: np.ndarray,
+                 p: np.ndarray, div: np.ndarray) -> None:
+        with self._timed(name):
+            self._solve_pressure(name, vel_x, vel_y, p, div)
+
+    def _solve_pressure(self, name: str, vel_x: np.ndarray, vel_y: np.ndarray,
+                        p: np.ndarray, div: np.ndarray) -> None:
+        # Zeroes p, which is used as the pressure when not warm starting
+        self._backend.divergence(self.N, vel_x, vel_y, p, div, self._boundary,
+                                 **self._tiling)
+        if self.warm_start:
+            p = self._pressure[name]
+
+        if self._multigrid is not None:
+            result = self._multigrid.solve(p, div)
+        elif self._pressure_cg is not None:
+            result = self._pressure_cg.solve(0, p, div, 1, 4)
+        else:
+            result = self._relax(0, p, div, 1, 4)
+        self.solve_results[name] = result
+        self._count_iterations(name, result.iterations)
+
+        self._backend.subtract_gradient(self.N, vel_x, vel_y, p,
+                                        self._boundary, **self._tiling)
+
+    def _relax(self, side: int, current: np.ndarray, prev: np.ndarray,
+               a: float, c: float) -> SolveResult:
+        """Runs gauss-seidel sweeps until the residual is below tolerance, checking it every
+        RESIDUAL_CHECK_INTERVAL sweeps, or until self.iterations sweeps have run.
+        """
+        norm = self._backend.interior_norm(self.N, prev, self._boundary)
+        if norm == 0:
+            norm = 1
+
+        sweeps = 0
+        residual = self._backend.residual_norm(
+            self.N, current, prev, a, c, self._boundary, **self._tiling) / norm
+        while residual > self.tolerance and sweeps < self.iterations:
+            batch = min(RESIDUAL_CHECK_INTERVAL, self.iterations - sweeps)
+            self._backend.lin_solve(self.N,
+                                    side,
+                                    current,
+                                    prev,
+                                    a,
+                                    c,
+                                    self._boundary,
+                                    sweeps=batch,
+                                    **self._tiling,
+                                    **self._fusing)
+            sweeps += batch
+            residual = self._backend.residual_norm(self.N, current, prev, a, c,
+                                                   self._boundary, **
+                                                   self._tiling) / norm
+        return SolveResult(sweeps, residual)
 
     def step(self) -> None:
         """A total step of the simulation. First simulates the velocity of the fluid environment,
@@ -117,14 +966,83 @@ class Fluid:
 
         If there is a better way, please please tell me. While I still get 25x more frames on gpu
         over cpu, it'd be cool to reduce this problem as without it I could hit much higher fps.
+
+        Creating the fluid with resident=True avoids this, the fields stay on the gpu and are only
+        copied back when they are read.
+        """
+        with self._timed('step'):
+            self._set_num_threads()
+            self._update_tiles()
+            density_device, vel_x_device, vel_y_device = self._to_device(
+                FIELDS)
+
+            self._vel_step(vel_x_device, vel_y_device)
+            self._density_step(density_device, vel_x_device, vel_y_device)
+
+            self._to_host(FIELDS, (density_device, vel_x_device, vel_y_device))
+            self._record()
+        self._count_step()
+
+    def advance(self, interval: float) -> AdvanceResult:
+        """Moves the simulation on by interval in as few steps as the speed of the fluid allows,
+        instead of in steps of dt.
+
+        The fastest speed on the board picks how many steps are taken, enough that the fastest
+        fluid moves at most cfl cells in each of them, up to max_substeps. Calm fluid is moved the
+        whole interval in one step, and fast fluid in as many short ones as it needs. Fluid.dt is
+        left as it was.
+
+        Args:
+            interval: How much simulated time to move on by.
+
+        Returns:
+            AdvanceResult: The timestep and number of steps taken, which are also kept in
+                Fluid.advance_result and recorded in Fluid.stats as advance_dt and
+                advance_substeps.
+
+        Raises:
+            ValueError: If interval is not positive.
         """
-        vel_x_device = cuda.to_device(self.vel_x)
-        vel_y_device = cuda.to_device(self.vel_y)
-        density_device = cuda.to_device(self.density)
+        if interval <= 0:
+            raise ValueError(f'interval must be positive, got {interval}')
+        with self._timed('max_speed'):
+            speed = self._max_speed()
+        # How many cells the fastest fluid would cross in a single step of the whole interval
+        crossed = interval * (self.N - 2) * speed
+        substeps = min(max(math.ceil(crossed / self.cfl), 1),
+                       self.max_substeps)
+
+        fixed, self.dt = self.dt, interval / substeps
+        try:
+            for _ in range(substeps):
+                self.step()
+        finally:
+            self.dt = fixed
+
+        self.advance_result = AdvanceResult(interval / substeps, substeps,
+                                            speed)
+        if self.stats is not None:
+            self.stats.record('advance_dt', self.advance_result.dt)
+            self.stats.record('advance_substeps', substeps)
+        return self.advance_result
+
+    def _max_speed(self) -> float:
+        for name in ('vel_x', 'vel_y'):
+            self._flush(name)
+        # Fields that are not resident are on the host, even with the cuda backend
+        backend = self._backend
+        if self._copies and not self.resident:
+            backend = numpy_utils
+        return backend.max_speed(self.N, self._fields['vel_x'],
+                                 self._fields['vel_y'])
 
-        self._vel_step(vel_x_device, vel_y_device)
-        self._density_step(density_device, vel_x_device, vel_y_device)
+    def _record(self) -> None:
+        if self.recorder is None or not self.recorder.count_step():
+            return
+        with self._timed('record'):
+            self.recorder.capture(
+                [self._read(name) for name in self.recorder.fields])
 
-        self.density = density_device.copy_to_host()
-        self.vel_x = vel_x_device.copy_to_host()
-        self.vel_y = vel_y_device.copy_to_host()
+    def _count_step(self) -> None:
+        if self.stats is not None:
+            self.stats.steps += 1
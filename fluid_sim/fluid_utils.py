@@ -6,16 +6,119 @@ This implementation is identical to the one found in that paper, except it is de
 to increase performance. The cpu version faced extreme issues on even small grid sizes, whereas
 this version's performance is a huge boost on even a reasonable gpu (Im running a 3080, that is not
 what I would consider reasonable though).
+
+The fields are (side_length, side_length) arrays indexed [x, y]. Each stencil kernel is launched
+over a 2d grid with one thread per cell, so every thread reads its x and y straight off cuda.grid
+instead of dividing a flat index back into them. set_bnd only needs a thread per border cell, so it
+is launched over a 1d grid as long as a side. Flat fields of side_length**2 are still accepted and
+viewed as 2d, and IX and IX_rev are only kept for code written against the flat layout.
 """
 
-from typing import Tuple
+from typing import Any, Optional, Tuple, Union
 import numpy as np
 from numba import cuda
 import math
 
+from fluid_sim.boundary import Boundary
+from fluid_sim.numpy_utils import _grid
+
+# Threads per block along each axis of a 2d launch, and per block of a 1d one
+_TILE = 16
+_THREADS = 128
+
+
+def _cells(side_length: int) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """The blocks and threads per block of a launch with one thread per cell."""
+    blocks = math.ceil(side_length / _TILE)
+    return (blocks, blocks), (_TILE, _TILE)
+
+
+def _border(side_length: int) -> Tuple[int, int]:
+    """The blocks and threads per block of a launch with one thread per cell along a side."""
+    return math.ceil(side_length / _THREADS), _THREADS
+
+
+def _set_bounds(side_length: int, side: int, grid: np.ndarray,
+                boundary: Optional[Boundary]) -> None:
+    """Launches set_bnd on a field, or sets the cells of the boundary instead if there is one.
+    The cells next to the fluid are a launch of their own, as the rest are set from them.
+    """
+    if boundary is None:
+        _set_bnd[_border(side_length)](side_length, side, grid)
+        return
+    count = boundary.cells.shape[1]
+    for start, stop in ((0, boundary.split), (boundary.split, count)):
+        if stop > start:
+            _set_cells[math.ceil((stop - start) / _THREADS),
+                       _THREADS](grid, side, boundary.cells, boundary.sources,
+                                 boundary.weights, start, stop)
+
+
+def to_device(array: np.ndarray) -> np.ndarray:
+    """Copies a host array onto the gpu so the kernels can work on it.
+    """
+    return cuda.to_device(array)
+
+
+def to_host(device_array: Any, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Copies a device array back to the host, into out if it is given instead of a new array.
+    device_array is one of numba's device arrays, whose type depends on whether the cuda simulator
+    is in use.
+    """
+    return device_array.copy_to_host(out)
+
+
+def zeros(shape: Union[int, Tuple[int, ...]],
+          dtype: Union[type, np.dtype] = np.float64) -> np.ndarray:
+    """Allocates a zeroed field of the given shape and dtype on the gpu for the solver to use as
+    scratch space.
+    """
+    return cuda.to_device(np.zeros(shape, dtype))
+
+
+def synchronize() -> None:
+    """Waits for every kernel launched so far to finish.
+    """
+    cuda.synchronize()
+
+
+def scatter_add(device_array: np.ndarray, indices: Tuple[np.ndarray,
+                                                         np.ndarray],
+                amounts: np.ndarray) -> None:
+    """Adds each of the amounts to the device array at its (x, y) position. Only the positions and
+    amounts are copied over, and positions that are repeated add up.
 
-def diffuse(side_length: int, side: int, current_list: np.ndarray,
-            prev_list: np.ndarray, diffusion_rate: float, dt: float):
+    Args:
+        device_array: The 2d field on the gpu to add to
+        indices: The x positions and the y positions to add at
+        amounts: The amount to add at each position
+    """
+    x, y = indices
+    if len(x) == 0:
+        return
+    blocks = math.ceil(len(x) / _THREADS)
+    _scatter_add[blocks,
+                 _THREADS](device_array, cuda.to_device(x.astype(np.int64)),
+                           cuda.to_device(y.astype(np.int64)),
+                           cuda.to_device(amounts.astype(device_array.dtype)))
+
+
+@cuda.jit
+def _scatter_add(device_array: np.ndarray, x: np.ndarray, y: np.ndarray,
+                 amounts: np.ndarray) -> None:
+    k = cuda.grid(1)
+    if k < x.shape[0]:
+        cuda.atomic.add(device_array, (x[k], y[k]), amounts[k])
+
+
+def diffuse(side_length: int,
+            side: int,
+            current_list: np.ndarray,
+            prev_list: np.ndarray,
+            diffusion_rate: float,
+            dt: float,
+            iterations: int = 8,
+            boundary: Optional[Boundary] = None):
     """**Diffuses** the values of the current_list outwards by moving the previous list towards the
     values adjacent to each index in the current list
 
@@ -25,23 +128,35 @@ def diffuse(side_length: int, side: int, current_list: np.ndarray,
         prev_list: The same list but last iteration
         diffusion_rate: How fast the array diffuses
         dt: The timestep taken
+        iterations: How many red-black sweeps to relax the list with
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
 
     Returns:
         np.ndarray: An updated current_list
     """
     a = dt * diffusion_rate * ((side_length - 2)**2)
-    threads_per_block = 32 * 4
-    blocks_per_grid = 100
-    for i in range(16):
-        lin_solve[threads_per_block,
-                  blocks_per_grid](side_length, side, current_list, prev_list,
-                                   a, 1 + (4 * a))
-
-
-@cuda.jit
-def lin_solve(side_length: int, side: int, current_list: np.ndarray,
-              prev_list: np.ndarray, a: float, c: float):
-    """Linear solver that works on gpu for Gauss-Seidel relaxation
+    for i in range(iterations):
+        lin_solve(side_length, side, current_list, prev_list, a, 1 + (4 * a),
+                  boundary)
+
+
+def lin_solve(side_length: int,
+              side: int,
+              current_list: np.ndarray,
+              prev_list: np.ndarray,
+              a: float,
+              c: float,
+              boundary: Optional[Boundary] = None,
+              sweeps: int = 1):
+    """Red-black Gauss-Seidel sweeps, each followed by set_bnd.
+
+    Every thread used to update its cells in place while the others were reading them, so how far
+    a sweep got depended on the order the threads happened to run in. Colouring the cells like a
+    checkerboard fixes that, every neighbour of a red cell is black so one launch can update all
+    the red cells from the black ones, and the next launch the black cells from the red ones.
+    Obstacles are relaxed along with the rest of the interior, so their bounds are set again
+    between the two launches.
 
     Args:
         side_length: A Fluid specific side length, specifying the length of each side of the
@@ -49,62 +164,167 @@ def lin_solve(side_length: int, side: int, current_list: np.ndarray,
         side: The side of the simulated field as an integer
         current_list: The current iteration of the list to be solved
         prev_list: The previous iteration of the list to be solved
-        a: No idea what this refers to
-        c: No idea what this refers to
+        a: The weight of the neighbouring cells
+        c: What the weighted sum is divided by
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+        sweeps: How many sweeps to run
     """
-    start = cuda.grid(1)
-    stride = cuda.gridsize(1)
+    current = _grid(current_list, side_length)
+    prev = _grid(prev_list, side_length)
+    # Passed in the dtype of the field, or a float32 field would be relaxed in double precision
+    dtype = current.dtype.type
+    a = dtype(a)
+    c = dtype(c)
+    for _ in range(sweeps):
+        for parity in range(2):
+            _lin_solve[_cells(side_length)](current, prev, a, c, parity)
+            if boundary is not None and parity == 0:
+                _set_bounds(side_length, side, current, boundary)
+        _set_bounds(side_length, side, current, boundary)
+
+
+def residual_norm(side_length: int,
+                  current_list: np.ndarray,
+                  prev_list: np.ndarray,
+                  a: float,
+                  c: float,
+                  boundary: Optional[Boundary] = None) -> float:
+    """How far current_list is from what lin_solve converges to, as the norm of
+    prev + a * neighbours - c * current over the interior.
 
-    # for _ in range(10):
-    for index in range(start, current_list.shape[0], stride):
-        x, y = IX_rev(index, side_length)
+    Args:
+        side_length: A Fluid specific side length, specifying the length of each side of the
+            simulated field
+        current_list: The current iteration of the list being solved, with its border set
+        prev_list: The previous iteration of the list being solved
+        a: The weight of the neighbouring cells
+        c: What the weighted sum is divided by
+        boundary: The obstacles the list is solved around, whose cells are left out of the norm.
+            Defaults to none.
 
-        if x < 1 or x >= side_length - 1 or y < 1 or y >= side_length - 1:
-            continue
+    Returns:
+        float: The norm of the residual
+    """
+    current = _grid(current_list, side_length)
+    # The squares are added up in double precision, so the norm of a big float32 field is still
+    # accurate
+    squares = cuda.device_array((side_length, side_length))
+    dtype = current.dtype.type
+    a = dtype(a)
+    c = dtype(c)
+    _residual_squares[_cells(side_length)](current,
+                                           _grid(prev_list, side_length), a, c,
+                                           squares)
+    if boundary is not None:
+        _mask[_cells(side_length)](squares, boundary.fluid)
+    return math.sqrt(_sum(squares.reshape(side_length * side_length)))
+
+
+def interior_norm(side_length: int,
+                  array: np.ndarray,
+                  boundary: Optional[Boundary] = None) -> float:
+    """The norm of the interior of a field, which residual_norm is measured relative to. The cells
+    of any obstacles in boundary are left out.
+    """
+    # With no weight on the cell or its neighbours, all that is left of the residual is the field
+    return residual_norm(side_length, array, array, 0, 0, boundary)
 
-        current_list[IX(
-            x, y,
-            side_length)] = (prev_list[IX(x, y, side_length)] +
-                             (a *
-                              (current_list[IX(x - 1, y, side_length)] +
-                               current_list[IX(x + 1, y, side_length)] +
-                               current_list[IX(x, y - 1, side_length)] +
-                               current_list[IX(x, y + 1, side_length)]))) / c
-    set_bnd(side_length, side, current_list)
 
+_sum = cuda.reduce(lambda a, b: a + b)
 
-@cuda.jit(device=True)
-def device_lin_solve(side_length: int, side: int, current_list: np.ndarray,
-                     prev_list: np.ndarray, a: float, c: float):
-    """The same as above except it runs as a device function so I can use it in kernels.
-    No idea if its a good idea, seems to work.
+_max = cuda.reduce(lambda a, b: max(a, b))
+
+
+def max_speed(side_length: int, x_velocity: np.ndarray,
+              y_velocity: np.ndarray) -> float:
+    """The fastest speed anywhere on the board, which adaptive steps pick their timestep from.
+    Only the answer is copied back from the device.
     """
-    start = cuda.grid(1)
-    stride = cuda.gridsize(1)
+    vel_x = _grid(x_velocity, side_length)
+    squares = cuda.device_array((side_length, side_length), vel_x.dtype)
+    _speed_squares[_cells(side_length)](vel_x, _grid(y_velocity, side_length),
+                                        squares)
+    return math.sqrt(_max(squares.reshape(side_length * side_length)))
+
+
+@cuda.jit
+def _speed_squares(x_velocity: np.ndarray, y_velocity: np.ndarray,
+                   squares: np.ndarray) -> None:
+    x, y = cuda.grid(2)
+    if x < squares.shape[0] and y < squares.shape[1]:
+        squares[x, y] = x_velocity[x, y]**2 + y_velocity[x, y]**2
+
 
-    for index in range(start, current_list.shape[0], stride):
-        x, y = IX_rev(index, side_length)
+@cuda.jit
+def _residual_squares(current_list: np.ndarray, prev_list: np.ndarray,
+                      a: float, c: float, squares: np.ndarray) -> None:
+    x, y = cuda.grid(2)
+    side_length = current_list.shape[0]
+    if x >= side_length or y >= side_length:
+        return
+
+    if x < 1 or x >= side_length - 1 or y < 1 or y >= side_length - 1:
+        squares[x, y] = 0
+        return
+
+    residual = (prev_list[x, y] - c * current_list[x, y] + a *
+                (current_list[x - 1, y] + current_list[x + 1, y] +
+                 current_list[x, y - 1] + current_list[x, y + 1]))
+    squares[x, y] = residual * residual
 
-        if x < 1 or x >= side_length - 1 or y < 1 or y >= side_length - 1:
-            continue
 
-        current_list[IX(
-            x, y,
-            side_length)] = (prev_list[IX(x, y, side_length)] +
-                             (a *
-                              (current_list[IX(x - 1, y, side_length)] +
-                               current_list[IX(x + 1, y, side_length)] +
-                               current_list[IX(x, y - 1, side_length)] +
-                               current_list[IX(x, y + 1, side_length)]))) / c
-    set_bnd(side_length, side, current_list)
+@cuda.jit
+def _mask(squares: np.ndarray, fluid: np.ndarray) -> None:
+    x, y = cuda.grid(2)
+    if x < squares.shape[0] and y < squares.shape[1] and not fluid[x, y]:
+        squares[x, y] = 0
 
 
-def advect(side_length: int, side: int, current_list: np.ndarray,
-           prev_list: np.ndarray, x_velocity: np.ndarray,
-           y_velocity: np.ndarray, timestep: float):
+@cuda.jit
+def _lin_solve(current_list: np.ndarray, prev_list: np.ndarray, a: float,
+               c: float, parity: int) -> None:
+    """Linear solver that works on gpu for Gauss-Seidel relaxation, only updating the cells where
+    (x + y) % 2 == parity.
+    """
+    x, y = cuda.grid(2)
+    side_length = current_list.shape[0]
+    if x < 1 or x >= side_length - 1 or y < 1 or y >= side_length - 1:
+        return
+    if (x + y) % 2 != parity:
+        return
+
+    current_list[x,
+                 y] = (prev_list[x, y] +
+                       (a *
+                        (current_list[x - 1, y] + current_list[x + 1, y] +
+                         current_list[x, y - 1] + current_list[x, y + 1]))) / c
+
+
+@cuda.jit
+def _set_bnd(side_length: int, side: int, bounded_array: np.ndarray) -> None:
+    """Runs set_bnd as its own kernel, so that nothing else is writing to the interior while the
+    borders are copied from it.
+    """
+    set_bnd(side_length, side, bounded_array)
+
+
+def advect(side_length: int,
+           side: int,
+           current_list: np.ndarray,
+           prev_list: np.ndarray,
+           x_velocity: np.ndarray,
+           y_velocity: np.ndarray,
+           timestep: float,
+           boundary: Optional[Boundary] = None,
+           scale: float = 1,
+           decay: float = 0):
     """A nice entry point into the advect function such that the threads per block and blocks per
     grid is hidden
 
+    The advected values can also be dissipated in the same kernel, each multiplied by scale and
+    then moved decay closer to 0 without passing it.
+
     Args:
         side_length: A Fluid specific side length, specifying the length of each side of the
             simulated field
@@ -114,68 +334,87 @@ def advect(side_length: int, side: int, current_list: np.ndarray,
         x_velocity: Current x velocity
         y_velocity: Current y velocity
         timestep: How long each timestep is. Lower results in a better simulation
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+        scale: What every advected value is multiplied by, for exponential decay.
+        decay: How much closer to 0 every advected value is moved, for linear decay.
     """
-    _advect[32 * 8, 100](side_length, side, current_list, prev_list,
-                         x_velocity, y_velocity, timestep)
-
-
-@cuda.jit
-def _advect(side_length: int, side: int, current_list: np.ndarray,
-            prev_list: np.ndarray, x_velocity: np.ndarray,
-            y_velocity: np.ndarray, dt: float):
-    start = cuda.grid(1)
-    stride = cuda.gridsize(1)
-
-    dt0 = dt * (side_length - 2)
-    for index in range(start, current_list.shape[0], stride):
-        i, j = IX_rev(index, side_length)
-
-        if i < 1 or j < 1 or i >= side_length - 1 or j >= side_length - 1:
-            continue
-
-        x = i - dt0 * x_velocity[IX(i, j, side_length)]
-        y = j - dt0 * y_velocity[IX(i, j, side_length)]
-
-        if x < 0.5:
-            x = 0.5
-        if x > side_length + 0.5:
-            x = side_length + 0.5
-
-        if y < 0.5:
-            y = 0.5
-        if y > side_length + 0.5:
-            y = side_length + 0.5
-
-        i0 = math.floor(x)
-        i1 = i0 + 1
-
-        j0 = math.floor(y)
-        j1 = j0 + 1
-
-        s1 = x - i0
-        s0 = 1.0 - s1
-
-        t1 = y - j0
-        t0 = 1 - t1
-        current_list[IX(
-            i, j, side_length
-        )] = s0 * (t0 * prev_list[int(IX(i0, j0, side_length))] +
-                   t1 * prev_list[int(IX(i0, j1, side_length))]) + s1 * (
-                       t0 * prev_list[int(IX(i1, j0, side_length))] +
-                       t1 * prev_list[int(IX(i1, j1, side_length))])
-    set_bnd(side_length, side, current_list)
-
-
-def project(side_length: int, x_velocity: np.ndarray, y_velocity: np.ndarray,
-            p: np.ndarray, div: np.ndarray):
-    _project[32 * 4, 100](side_length, x_velocity, y_velocity, p, div)
+    current = _grid(current_list, side_length)
+    dtype = current.dtype.type
+    _advect[_cells(side_length)](current, _grid(prev_list, side_length),
+                                 _grid(x_velocity, side_length),
+                                 _grid(y_velocity, side_length),
+                                 dtype(timestep), dtype(scale), dtype(decay))
+    _set_bounds(side_length, side, current, boundary)
 
 
 @cuda.jit
-def _project(side_length: int, x_velocity: np.ndarray, y_velocity: np.ndarray,
-             p: np.ndarray, div: np.ndarray):
-    """Used to conserve mass in the velocity field. I dont know what p and div actually refer to. Theoretically will
-    perform conservation on any input ndarrays
+def _advect(current_list: np.ndarray, prev_list: np.ndarray,
+            x_velocity: np.ndarray, y_velocity: np.ndarray, dt: float,
+            scale: float, decay: float):
+    i, j = cuda.grid(2)
+    side_length = current_list.shape[0]
+    if i < 1 or j < 1 or i >= side_length - 1 or j >= side_length - 1:
+        return
+
+    # Every constant is made in the dtype of the field, a bare 0.5 is a double and would turn all
+    # the arithmetic on a float32 field into double precision
+    dtype = current_list.dtype.type
+    dt0 = dt * dtype(side_length - 2)
+    low = dtype(0.5)
+    high = dtype(side_length - 1.5)
+    one = dtype(1)
+
+    x = dtype(i) - dt0 * x_velocity[i, j]
+    y = dtype(j) - dt0 * y_velocity[i, j]
+
+    # Clamped so that i1 and j1 are still inside the field
+    if x < low:
+        x = low
+    if x > high:
+        x = high
+
+    if y < low:
+        y = low
+    if y > high:
+        y = high
+
+    i0 = int(math.floor(x))
+    i1 = i0 + 1
+
+    j0 = int(math.floor(y))
+    j1 = j0 + 1
+
+    s1 = x - dtype(i0)
+    s0 = one - s1
+
+    t1 = y - dtype(j0)
+    t0 = one - t1
+    value = (s0 * (t0 * prev_list[i0, j0] + t1 * prev_list[i0, j1]) + s1 *
+             (t0 * prev_list[i1, j0] + t1 * prev_list[i1, j1])) * scale
+
+    # Moved decay closer to 0, stopping at 0
+    if value > decay:
+        value -= decay
+    elif value < -decay:
+        value += decay
+    else:
+        value = dtype(0)
+    current_list[i, j] = value
+
+
+def project(side_length: int,
+            x_velocity: np.ndarray,
+            y_velocity: np.ndarray,
+            p: np.ndarray,
+            div: np.ndarray,
+            iterations: int = 8,
+            boundary: Optional[Boundary] = None):
+    """Used to conserve mass in the velocity field. I dont know what p and div actually refer to.
+    Theoretically will perform conservation on any input ndarrays
+
+    This used to be one kernel, but nothing makes every block finish computing the divergence
+    before another block starts solving with it, so each stage is now its own launch.
 
     Args:
         side_length: The length of each side if the ndarray was 2d
@@ -183,52 +422,84 @@ def _project(side_length: int, x_velocity: np.ndarray, y_velocity: np.ndarray,
         y_velocity: The current y velocities of the particles
         p (np.ndarray): [description]
         div (np.ndarray): [description]
+        iterations: How many red-black sweeps to solve the pressure with
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
     """
-    start = cuda.grid(1)
-    stride = cuda.gridsize(1)
-
-    h = 1 / side_length
-    for index in range(start, x_velocity.shape[0], stride):
-        i, j = IX_rev(index, side_length)
-
-        if i < 1 or j < 1 or i >= side_length - 1 or j >= side_length - 1:
-            continue
-
-        div[IX(
-            i, j,
-            side_length)] = -0.5 * h * (x_velocity[IX(i + 1, j, side_length)] -
-                                        x_velocity[IX(i - 1, j, side_length)] +
-                                        y_velocity[IX(i, j + 1, side_length)] -
-                                        y_velocity[IX(i, j - 1, side_length)])
-
-        p[IX(i, j, side_length)] = 0
+    divergence(side_length, x_velocity, y_velocity, p, div, boundary)
+    for i in range(iterations):
+        lin_solve(side_length, 0, p, div, 1, 4, boundary)
+    subtract_gradient(side_length, x_velocity, y_velocity, p, boundary)
+
+
+def divergence(side_length: int,
+               x_velocity: np.ndarray,
+               y_velocity: np.ndarray,
+               p: np.ndarray,
+               div: np.ndarray,
+               boundary: Optional[Boundary] = None) -> None:
+    """The first stage of project. Stores the divergence of the velocity field in div and zeroes
+    p, ready for the pressure to be solved into it.
+    """
+    p = _grid(p, side_length)
+    div = _grid(div, side_length)
+    _divergence[_cells(side_length)](_grid(x_velocity, side_length),
+                                     _grid(y_velocity, side_length), p, div)
+    _set_bounds(side_length, 0, div, boundary)
+    _set_bounds(side_length, 0, p, boundary)
+
+
+def subtract_gradient(side_length: int,
+                      x_velocity: np.ndarray,
+                      y_velocity: np.ndarray,
+                      p: np.ndarray,
+                      boundary: Optional[Boundary] = None) -> None:
+    """The last stage of project. Takes the gradient of the solved pressure away from the velocity
+    field, which leaves it divergence free.
+    """
+    x_velocity = _grid(x_velocity, side_length)
+    y_velocity = _grid(y_velocity, side_length)
+    _subtract_gradient[_cells(side_length)](x_velocity, y_velocity,
+                                            _grid(p, side_length))
+    _set_bounds(side_length, 1, x_velocity, boundary)
+    _set_bounds(side_length, 2, y_velocity, boundary)
 
-    set_bnd(side_length, 0, div)
-    set_bnd(side_length, 0, p)
 
-    for i in range(16):
-        device_lin_solve(side_length, 0, p, div, 1, 4)
+@cuda.jit
+def _divergence(x_velocity: np.ndarray, y_velocity: np.ndarray, p: np.ndarray,
+                div: np.ndarray) -> None:
+    i, j = cuda.grid(2)
+    side_length = div.shape[0]
+    if i < 1 or j < 1 or i >= side_length - 1 or j >= side_length - 1:
+        return
 
-    for index in range(start, x_velocity.shape[0], stride):
-        i, j = IX_rev(index, side_length)
+    dtype = div.dtype.type
+    h = dtype(1 / side_length)
+    scale = dtype(-0.5) * h
+    div[i, j] = scale * (x_velocity[i + 1, j] - x_velocity[i - 1, j] +
+                         y_velocity[i, j + 1] - y_velocity[i, j - 1])
+    p[i, j] = 0
 
-        if i < 1 or j < 1 or i >= side_length - 1 or j >= side_length - 1:
-            continue
 
-        x_velocity[IX(i, j,
-                      side_length)] -= 0.5 * (p[IX(i + 1, j, side_length)] -
-                                              p[IX(i - 1, j, side_length)]) / h
-        y_velocity[IX(i, j,
-                      side_length)] -= 0.5 * (p[IX(i, j + 1, side_length)] -
-                                              p[IX(i, j - 1, side_length)]) / h
+@cuda.jit
+def _subtract_gradient(x_velocity: np.ndarray, y_velocity: np.ndarray,
+                       p: np.ndarray) -> None:
+    i, j = cuda.grid(2)
+    side_length = p.shape[0]
+    if i < 1 or j < 1 or i >= side_length - 1 or j >= side_length - 1:
+        return
 
-    set_bnd(side_length, 1, x_velocity)
-    set_bnd(side_length, 2, y_velocity)
+    dtype = x_velocity.dtype.type
+    h = dtype(1 / side_length)
+    half = dtype(0.5)
+    x_velocity[i, j] -= half * (p[i + 1, j] - p[i - 1, j]) / h
+    y_velocity[i, j] -= half * (p[i, j + 1] - p[i, j - 1]) / h
 
 
 @cuda.jit(device=True)
 def IX(x: int, y: int, N: int) -> int:
-    """Converts an x and y position to a 1d index
+    """Converts an x and y position to a 1d index. Only kept for code written against flat fields,
+    the kernels here index the 2d fields directly.
 
     Args:
         x: The x pos
@@ -243,7 +514,7 @@ def IX(x: int, y: int, N: int) -> int:
 
 @cuda.jit(device=True)
 def IX_rev(index: int, N: int) -> Tuple[int, int]:
-    """Performs the IX function in reverse
+    """Performs the IX function in reverse. Only kept for code written against flat fields.
     """
     y = math.floor(index / N)
     x = index % N
@@ -256,42 +527,51 @@ def set_bnd(side_length: int, side: int, bounded_array: np.ndarray) -> None:
     """Sets the bounds of an array by setting the borders to a certain value (in this case the
     exact opposite value of the adjacent spot point inwards)
 
+    Each thread sets the four border cells at its position along the sides, so it wants a 1d
+    launch with at least side_length threads.
+
     Args:
         side_length: The length of each side of the square matrix
         side: Which side to set the bound for
-        bounded_array: The array to bound
+        bounded_array: The 2d array to bound
+    """
+    k = cuda.grid(1)
+
+    one = bounded_array.dtype.type(1)
+    x_sign = -one if side == 1 else one
+    y_sign = -one if side == 2 else one
+    last = side_length - 1
+
+    if k > 0 and k < last:
+        bounded_array[k, 0] = y_sign * bounded_array[k, 1]
+        bounded_array[k, last] = y_sign * bounded_array[k, last - 1]
+        bounded_array[0, k] = x_sign * bounded_array[1, k]
+        bounded_array[last, k] = x_sign * bounded_array[last - 1, k]
+
+    # 4 corners. Each is the average of the two border cells next to it, but those are being
+    # written by other threads, so they are worked out from the interior cell they were copied from
+    if k == 0:
+        corner = bounded_array.dtype.type(0.5) * (x_sign + y_sign)
+        bounded_array[0, 0] = corner * bounded_array[1, 1]
+        bounded_array[0, last] = corner * bounded_array[1, last - 1]
+        bounded_array[last, 0] = corner * bounded_array[last - 1, 1]
+        bounded_array[last, last] = corner * bounded_array[last - 1, last - 1]
+
+
+@cuda.jit
+def _set_cells(grid: np.ndarray, side: int, cells: np.ndarray,
+               sources: np.ndarray, weights: np.ndarray, start: int,
+               stop: int) -> None:
+    """Sets the cells of a Boundary from start to stop to the weighted sum of their neighbours,
+    one thread per cell.
     """
-    start = cuda.grid(1)
-    stride = cuda.gridsize(1)
-
-    for index in range(start, bounded_array.shape[0], stride):
-        i, j = IX_rev(index, side_length)
-        bounded_array[IX(i, 0, side_length)] = -bounded_array[IX(
-            i, 1, side_length)] if side == 2 else bounded_array[IX(
-                i, 1, side_length)]
-        bounded_array[IX(i, side_length - 1, side_length)] = -bounded_array[IX(
-            i, side_length - 2, side_length)] if side == 2 else bounded_array[
-                IX(i, side_length - 2, side_length)]
-        bounded_array[IX(0, j, side_length)] = -bounded_array[IX(
-            1, j, side_length)] if side == 1 else bounded_array[IX(
-                1, j, side_length)]
-        bounded_array[IX(side_length - 1, j, side_length)] = -bounded_array[IX(
-            side_length - 2, j, side_length)] if side == 1 else bounded_array[
-                IX(side_length - 2, j, side_length)]
-
-    # 4 corners
-    bounded_array[IX(
-        0, 0, side_length)] = 0.5 * (bounded_array[IX(1, 0, side_length)] +
-                                     bounded_array[IX(0, 1, side_length)])
-    bounded_array[IX(0, side_length - 1, side_length)] = 0.5 * (
-        bounded_array[IX(1, side_length - 1, side_length)] +
-        bounded_array[IX(0, side_length - 2, side_length)])
-    bounded_array[IX(side_length - 1, 0, side_length)] = 0.5 * (
-        bounded_array[IX(side_length - 2, 0, side_length)] +
-        bounded_array[IX(side_length - 1, 1, side_length)])
-    bounded_array[IX(side_length - 1, side_length - 1, side_length)] = 0.5 * (
-        bounded_array[IX(side_length - 2, side_length - 1, side_length)] +
-        bounded_array[IX(side_length - 1, side_length - 2, side_length)])
+    k = start + cuda.grid(1)
+    if k >= stop:
+        return
+    total = grid.dtype.type(0)
+    for n in range(4):
+        total += weights[side, k, n] * grid[sources[0, k, n], sources[1, k, n]]
+    grid[cells[0, k], cells[1, k]] = total
 
 
 def IX_rev_cpu(index: int, N: int) -> Tuple[int, int]:
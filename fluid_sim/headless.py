@@ -0,0 +1,154 @@
+"""Runs the simulation without a window, as fast as it will go, and reports how fast that was.
+
+The fluid is driven by a scripted scenario in place of the mouse, so the same run can be repeated
+on a server with no display for batch jobs or to measure throughput. Every scenario is a function
+of the fluid and the step it is on that adds density and velocity through the same add methods
+the window does, scaled to the size of the board.
+
+    fluid-sim --headless --size 512 --steps 1000 --scenario jet --backend numba-cpu
+"""
+
+import json
+import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from fluid_sim.fluid import BACKENDS, Fluid, gaussian_brush
+
+
+def _emit(fluid: Fluid, x: float, y: float, vel_x: float,
+          vel_y: float) -> None:
+    """Adds density and velocity with a round brush at (x, y), the brush growing with the board."""
+    brush = gaussian_brush(max(fluid.N // 64, 1))
+    position = (np.array([int(x)]), np.array([int(y)]))
+    fluid.add_density_many(*position, np.array([50.0]), brush)
+    fluid.add_velocity_many(*position, np.array([vel_x]), np.array([vel_y]),
+                            brush)
+
+
+def _jet(fluid: Fluid, step: int) -> None:
+    """A steady stream from the middle of the left edge towards the right."""
+    _emit(fluid, fluid.N / 8, fluid.N / 2, fluid.N / 32, 0)
+
+
+def _plume(fluid: Fluid, step: int) -> None:
+    """A rising plume from the bottom middle of the board, that wavers from side to side."""
+    sway = np.sin(step / 20) * fluid.N / 256
+    _emit(fluid, fluid.N / 2, fluid.N * 7 / 8, sway, -fluid.N / 64)
+
+
+def _collide(fluid: Fluid, step: int) -> None:
+    """Two jets from opposite edges that meet a little off centre, so the fluid curls up."""
+    offset = fluid.N / 16
+    _emit(fluid, fluid.N / 8, fluid.N / 2 - offset, fluid.N / 32, 0)
+    _emit(fluid, fluid.N * 7 / 8, fluid.N / 2 + offset, -fluid.N / 32, 0)
+
+
+def _orbit(fluid: Fluid, step: int) -> None:
+    """An emitter that circles the middle of the board, pushing the fluid along its path."""
+    angle = step / 30
+    radius = fluid.N / 4
+    speed = fluid.N / 64
+    _emit(fluid, fluid.N / 2 + radius * np.cos(angle),
+          fluid.N / 2 + radius * np.sin(angle), -speed * np.sin(angle),
+          speed * np.cos(angle))
+
+
+# What each step of a scenario adds to the fluid, given the step it is on
+SCENARIOS: Dict[str, Callable[[Fluid, int], None]] = {
+    'jet': _jet,
+    'plume': _plume,
+    'collide': _collide,
+    'orbit': _orbit,
+}
+
+
+def run(fluid: Fluid,
+        scenario: str,
+        steps: int,
+        warmup: int = 1) -> Dict[str, float]:
+    """Steps the fluid with the scenario adding to it before every step, timing each step.
+
+    The warmup steps are run first and not timed, since the first step of the numba backends
+    compiles their kernels. Each step waits for the backend to finish before it is timed, which
+    matters for a resident fluid on the gpu where nothing else waits for it.
+
+    Args:
+        fluid: The fluid to step.
+        scenario: Which of SCENARIOS adds to the fluid.
+        steps: How many steps to time.
+        warmup: How many steps to run before timing any.
+
+    Returns:
+        Dict[str, float]: How many steps were timed, how long they took in all, the steps and grid
+            cells a second that works out to, and the median, 95th percentile and longest time of
+            a single step in milliseconds.
+
+    Raises:
+        ValueError: If the scenario is not one of the keys of SCENARIOS or steps is not positive.
+    """
+    if scenario not in SCENARIOS:
+        raise ValueError(f'Unknown scenario {scenario!r}, expected one of '
+                         f'{list(SCENARIOS)}')
+    if steps < 1:
+        raise ValueError(f'steps must be positive, got {steps}')
+    add = SCENARIOS[scenario]
+    synchronize = BACKENDS[fluid.backend].synchronize
+
+    for step in range(warmup):
+        add(fluid, step)
+        fluid.step()
+    synchronize()
+
+    times = np.empty(steps)
+    for step in range(steps):
+        add(fluid, warmup + step)
+        start = time.perf_counter()
+        fluid.step()
+        synchronize()
+        times[step] = time.perf_counter() - start
+
+    seconds = float(times.sum())
+    return {
+        'steps': steps,
+        'seconds': seconds,
+        'steps_per_sec': steps / seconds,
+        'cells_per_sec': fluid.grid_space * steps / seconds,
+        'median_ms': float(np.median(times)) * 1e3,
+        'p95_ms': float(np.percentile(times, 95)) * 1e3,
+        'max_ms': float(times.max()) * 1e3,
+    }
+
+
+def report(fluid: Fluid,
+           results: Dict[str, float],
+           output: Optional[str] = None) -> None:
+    """Prints the results of a run, along with fluid.stats if the fluid kept any, and writes them
+    as JSON to output if it is given.
+    """
+    print(f'{fluid.backend} {fluid.dtype.name} {fluid.N}x{fluid.N}, '
+          f'{results["steps"]} steps in {results["seconds"]:.3f}s')
+    print(f'{results["steps_per_sec"]:.1f} steps/sec, '
+          f'{results["cells_per_sec"]:.3e} cells/sec')
+    print(f'step ms: median {results["median_ms"]:.3f}, '
+          f'p95 {results["p95_ms"]:.3f}, max {results["max_ms"]:.3f}')
+
+    exported = {
+        'backend': fluid.backend,
+        'dtype': fluid.dtype.name,
+        'size': fluid.N,
+        **results
+    }
+    if fluid.stats is not None:
+        print(f'\n{"stage":>28} {"median ms":>10} {"p95 ms":>10}')
+        for name, summary in fluid.stats.summary().items():
+            if name.endswith(('_iterations', '_bytes')):
+                continue
+            print(f'{name:>28} {summary["median"] * 1e3:>10.3f} '
+                  f'{summary["p95"] * 1e3:>10.3f}')
+        exported['stats'] = fluid.stats.export()
+
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(exported, file, indent=2)
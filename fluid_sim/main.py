@@ -1,33 +1,165 @@
 """A very rushed and simple interface that shows what the fluid sim does
+
+The fluid is stepped on a thread of its own and the window shows whichever step finished last, so
+the frame rate of the window and the steps a second of the simulation are set separately with --fps
+and --sim-rate and neither holds the other back.
+
+With --headless there is no window, the fluid is stepped as fast as it will go by one of the
+scenarios in headless.py and the throughput is printed instead. pygame is only imported for the
+window, so headless runs work on servers without it or a display.
+
+--grid-size simulates a board of another size to the window, which each frame is scaled to, so a
+small board can fill a big window without the cost of one cell per pixel.
 """
 
-from fluid_sim.fluid import Fluid
-import os
+import argparse
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
 from numba import cuda
-import random
+import numpy as np
+
+from fluid_sim import headless
+from fluid_sim.fluid import BACKENDS, DTYPES, Fluid
+from fluid_sim.render import COLORMAPS, Colormap
+
+# What the window can show, and the (low, high) values the colormap spans for each
+_SHOWN = {'density': (0, 200), 'speed': (0, 2)}
+
+
+class _Frames:
+    """Hands the latest pixels from the simulation thread to the render thread.
+
+    Each thread has a buffer of its own, and the latest finished frame waits in a third. Handing a
+    frame over swaps the buffer that was written with the waiting one, and taking it swaps the
+    buffer that was shown with it, so neither thread waits for the other and a frame is never
+    written while it is shown.
+    """
+    def __init__(self, shape: Tuple[int, ...], dtype: np.dtype):
+        self._lock = threading.Lock()
+        self._latest = np.zeros(shape, dtype)
+        self._fresh = False
+
+    def publish(self, frame: np.ndarray) -> np.ndarray:
+        """Makes frame the latest, and returns the buffer to write the next one into."""
+        with self._lock:
+            self._latest, frame = frame, self._latest
+            self._fresh = True
+        return frame
+
+    def take(self, shown: np.ndarray) -> np.ndarray:
+        """Returns the latest frame if there is one that has not been taken, otherwise shown."""
+        with self._lock:
+            if not self._fresh:
+                return shown
+            self._latest, shown = shown, self._latest
+            self._fresh = False
+        return shown
+
+
+class _Simulation(threading.Thread):
+    """Steps the fluid on its own thread, so the window keeps drawing while a step runs. NumPy and
+    the numba kernels let go of the GIL while they work, so the two run side by side.
 
-from pygame import surfarray
-import pygame
+    Sources from the window are queued and added in one go before each step, and what is shown is
+    coloured and handed to the window through a _Frames after it.
+    """
+    def __init__(self, fluid: Fluid, rate: float, colormap: Colormap,
+                 shown: str):
+        super().__init__(daemon=True)
+        self.fluid = fluid
+        self.rate = rate
+        self.colormap = colormap
+        self.shown = shown
+        self.shape = (fluid.output_size, fluid.output_size)
+        self.frames = _Frames((*self.shape, 3), np.dtype(np.uint8))
+        # The fields scaled to the window, if they are not already its size
+        self._scaled: Dict[str, np.ndarray] = {}
+        self.steps = 0
+        self.running = True
+        self._lock = threading.Lock()
+        self._sources: List[Tuple[int, int, float, float]] = []
 
-# So that pygame dopesnt initialize sound (only useful on wsl systems i think)
-os.environ['SDL_AUDIODRIVER'] = 'dsp'
+    def add_sources(self, sources: List[Tuple[int, int, float,
+                                              float]]) -> None:
+        """Queues (x, y, velocity x, velocity y) sources to be added before the next step, with x
+        and y in pixels of the window.
+        """
+        with self._lock:
+            self._sources.extend(sources)
 
+    def run(self) -> None:
+        frame: np.ndarray = np.zeros((*self.shape, 3), np.uint8)
+        next_step = time.perf_counter()
+        while self.running:
+            with self._lock:
+                sources, self._sources = self._sources, []
+            if sources:
+                x, y, change_x, change_y = np.array(sources).T
+                self.fluid.add_density_many(x,
+                                            y,
+                                            np.ones(len(x)),
+                                            brush=np.random.randint(
+                                                100, 201, (3, 3)),
+                                            output_space=True)
+                self.fluid.add_velocity_many(x,
+                                             y,
+                                             change_x * 2,
+                                             change_y * 2,
+                                             brush=np.ones((3, 3)),
+                                             output_space=True)
 
-def main():
-    DIMENSION = 600
+            self.fluid.step()
+            self._draw(frame)
+            frame = self.frames.publish(frame)
+            self.steps += 1
 
-    WIDTH = HEIGHT = DIMENSION
+            if self.rate > 0:
+                next_step = max(next_step + 1 / self.rate, time.perf_counter())
+                time.sleep(max(next_step - time.perf_counter(), 0))
+
+    def _draw(self, frame: np.ndarray) -> None:
+        if self.shown == 'speed':
+            self.colormap.speed(self._field('vel_x'), self._field('vel_y'),
+                                frame)
+        else:
+            self.colormap(self._field('density'), frame)
+
+    def _field(self, name: str) -> np.ndarray:
+        if self.fluid.output_size == self.fluid.N:
+            return getattr(self.fluid, name)
+        if name not in self._scaled:
+            self._scaled[name] = np.empty(self.shape, self.fluid.dtype)
+        return self.fluid.render(name, self._scaled[name])
+
+
+def _window(fluid: Fluid, sim_rate: float, fps: int, colormap: str,
+            shown: str) -> None:
+    import os
+    from pygame import surfarray
+    import pygame
+
+    # So that pygame dopesnt initialize sound (only useful on wsl systems i think)
+    os.environ['SDL_AUDIODRIVER'] = 'dsp'
+
+    WIDTH = HEIGHT = fluid.output_size
 
     pygame.init()
     screen = pygame.display.set_mode([WIDTH, HEIGHT])
     clock = pygame.time.Clock()
     font = pygame.font.Font(None, 30)
 
-    fluid = Fluid(WIDTH, 0.05, 0.0000001, 0.0000001)
+    simulation = _Simulation(fluid, sim_rate, Colormap(colormap,
+                                                       _SHOWN[shown]), shown)
+    simulation.start()
+    pixels: np.ndarray = np.zeros((WIDTH, HEIGHT, 3), np.uint8)
+    last_steps, last_time, steps_per_sec = 0, time.perf_counter(), 0.0
 
     prev_x, prev_y = pygame.mouse.get_pos()
     running = True
     while running:
+        sources = []
         # Did the user click the window close button?
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -35,28 +167,114 @@ def main():
 
             if event.type == pygame.MOUSEMOTION:
                 x, y = pygame.mouse.get_pos()
-                change_x = x - prev_x
-                change_y = y - prev_y
-                for i in range(-1, 2):
-                    for j in range(-1, 2):
-                        fluid.add_density(x + i, y + j,
-                                          random.randint(100, 200))
-                        fluid.add_velocity(x, y, change_x * 2, change_y * 2)
-
+                sources.append((x, y, x - prev_x, y - prev_y))
                 prev_x, prev_y = x, y
+        if sources:
+            simulation.add_sources(sources)
 
-        fluid.density[fluid.density > 0] -= 0.5
-
-        fluid.step()
-        density = fluid.density.reshape(WIDTH, HEIGHT).copy()
-        surfarray.blit_array(screen, density)
+        # The pixels are a (WIDTH, HEIGHT, 3) array indexed [x, y], as blit_array wants them
+        pixels = simulation.frames.take(pixels)
+        surfarray.blit_array(screen, pixels)
 
-        fps = font.render(str(int(clock.get_fps())), True,
-                          pygame.Color('White'))
-        screen.blit(fps, (50, 50))
+        now = time.perf_counter()
+        if now - last_time >= 1:
+            steps_per_sec = (simulation.steps - last_steps) / (now - last_time)
+            last_steps, last_time = simulation.steps, now
+        rates = font.render(
+            f'{int(clock.get_fps())} fps, {int(steps_per_sec)} steps/sec',
+            True, pygame.Color('White'))
+        screen.blit(rates, (50, 50))
 
         # Flip the display
         pygame.display.flip()
-        clock.tick(144)
+        clock.tick(fps)
 
+    simulation.running = False
+    simulation.join()
     pygame.quit()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--headless',
+                        action='store_true',
+                        help='Step a scripted scenario without a window and '
+                        'print how fast it ran')
+    parser.add_argument('--size',
+                        type=int,
+                        default=600,
+                        help='The length of each side of the window, and of '
+                        'the board unless --grid-size is given')
+    parser.add_argument('--grid-size',
+                        type=int,
+                        help='The length of each side of the board, which '
+                        'the window scales up or down to --size')
+    parser.add_argument(
+        '--backend',
+        choices=list(BACKENDS),
+        default='cuda' if cuda.is_available() else 'numba-cpu',
+        help='Defaults to cuda if there is a gpu, otherwise numba-cpu')
+    parser.add_argument('--dtype',
+                        choices=[np.dtype(dtype).name for dtype in DTYPES],
+                        default='float64')
+    parser.add_argument('--resident',
+                        action='store_true',
+                        help='Keep the fields on the gpu between steps')
+    parser.add_argument('--fps',
+                        type=int,
+                        default=144,
+                        help='The most frames a second the window draws')
+    parser.add_argument('--sim-rate',
+                        type=float,
+                        default=0,
+                        help='The most steps a second the window simulates, '
+                        '0 for as many as it can')
+    parser.add_argument('--colormap',
+                        choices=list(COLORMAPS),
+                        default='fire',
+                        help='The colours the window shows the fluid in')
+    parser.add_argument('--show',
+                        choices=list(_SHOWN),
+                        default='density',
+                        help='Whether the window shows the density or how '
+                        'fast the fluid is moving')
+    parser.add_argument('--steps',
+                        type=int,
+                        default=1000,
+                        help='How many steps a headless run times')
+    parser.add_argument('--warmup',
+                        type=int,
+                        default=1,
+                        help='How many steps a headless run takes before '
+                        'timing any')
+    parser.add_argument('--scenario',
+                        choices=list(headless.SCENARIOS),
+                        default='jet',
+                        help='What a headless run adds to the fluid each step')
+    parser.add_argument('--stats',
+                        action='store_true',
+                        help='Also print how long each stage of a headless '
+                        'step took')
+    parser.add_argument('--output',
+                        help='Where to write the results of a headless run as '
+                        'JSON')
+    args = parser.parse_args(argv)
+
+    # The window's density fades by 0.5 a step, so the board does not fill up as the mouse moves
+    fluid = Fluid(args.size if args.grid_size is None else args.grid_size,
+                  0.05,
+                  0.0000001,
+                  0.0000001,
+                  backend=args.backend,
+                  resident=args.resident,
+                  dtype=args.dtype,
+                  stats=args.stats,
+                  output_size=args.size,
+                  density_dissipation=0 if args.headless else 10,
+                  dissipation='linear')
+    if not args.headless:
+        _window(fluid, args.sim_rate, args.fps, args.colormap, args.show)
+        return
+
+    results = headless.run(fluid, args.scenario, args.steps, args.warmup)
+    headless.report(fluid, results, args.output)
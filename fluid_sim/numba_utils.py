@@ -0,0 +1,915 @@
+"""A multi-core cpu version of the solver in fluid_utils, compiled with numba.
+
+The kernels are the same stencils as the gpu ones, but written as plain loops over the 2d field and
+split across cores by handing each thread a block of rows through prange. Every public function
+takes the same arguments as its counterpart in fluid_utils so Fluid can swap between them.
+
+How many cores the kernels use is set with set_num_threads, which Fluid calls before each step so
+that every instance can run with its own thread count.
+
+Fields can be float32 or float64, and the kernels are compiled for each. Parameters are cast to the
+dtype of the fields on the way in and constants are made with field.dtype.type, because numba
+would otherwise do all the arithmetic on a float32 field in double precision.
+
+Stacks of fields shaped (batch, side_length, side_length), as FluidBatch steps, are split across
+cores a grid at a time instead. Each grid of the stack is then solved by a serial copy of the
+kernels, so a single call steps the whole stack however small its grids are.
+
+Every gauss-seidel sweep streams the whole field through memory twice, once for each colour, which
+on a big board is more than the caches hold. A fused solve runs FUSED_SWEEPS sweeps in one pass
+down the rows instead. A row is relaxed red then black as soon as the rows either side of it are
+ready, its border is set straight after, and each sweep follows two rows behind the one before it,
+so all of them work on the same few rows while those are still in cache. Every cell is updated
+from the same neighbours in the same order as the separate sweeps would, so the result only differs
+in the last bit or so, where fastmath lets the compiler round the two kernels' arithmetic apart.
+Each thread takes a strip of columns with a halo of 2 columns for each sweep around it, plus
+one for the corners of the board, which are set from the cells next to them along the border.
+"""
+
+from typing import Optional, Sequence, Union
+
+import numba
+from numba import njit, prange
+import numpy as np
+
+from fluid_sim.boundary import Boundary
+from fluid_sim.tiles import ActiveTiles
+from fluid_sim.numpy_utils import (_grid, interior_norm, scatter_add,
+                                   to_device, to_host, zeros, synchronize)
+
+# How many sweeps a fused solve runs in each pass down the rows
+FUSED_SWEEPS = 4
+
+__all__ = [
+    'to_device', 'to_host', 'zeros', 'synchronize', 'scatter_add',
+    'set_num_threads', 'diffuse', 'lin_solve', 'residual_norm',
+    'interior_norm', 'max_speed', 'advect', 'project', 'divergence',
+    'subtract_gradient', 'set_bnd', 'tile_maxima'
+]
+
+
+def set_num_threads(threads: int) -> None:
+    """Sets how many threads the next kernels are split across.
+
+    Args:
+        threads: The number of threads, at most numba.config.NUMBA_NUM_THREADS.
+    """
+    numba.set_num_threads(threads)
+
+
+def _per_grid(value: Union[float, np.ndarray],
+              stack: np.ndarray) -> np.ndarray:
+    """One parameter per grid of a stack in the dtype of the stack, from either a single value or
+    an array of them.
+    """
+    return np.array(np.broadcast_to(value, (len(stack), )), dtype=stack.dtype)
+
+
+def _solve(current: np.ndarray,
+           prev: np.ndarray,
+           side: int,
+           a: Union[float, np.ndarray],
+           c: Union[float, np.ndarray],
+           iterations: int,
+           boundary: Optional[Boundary] = None,
+           tiles: Optional[ActiveTiles] = None,
+           fused: bool = False) -> None:
+    if current.ndim == 3:
+        _lin_solve_batch(current, prev, side, _per_grid(a, current),
+                         _per_grid(c, current), iterations)
+        return
+    dtype = current.dtype.type
+    if tiles is not None:
+        if boundary is not None:
+            raise ValueError('Obstacles cannot be stepped a tile at a time')
+        _lin_solve_tiles(current, prev, side, dtype(a), dtype(c), iterations,
+                         tiles.origins, tiles.size)
+    elif fused:
+        if boundary is not None:
+            raise ValueError('Obstacles cannot be solved with fused sweeps')
+        _lin_solve_fused(current, prev, side, dtype(a), dtype(c), iterations)
+    elif boundary is None:
+        _lin_solve(current, prev, side, dtype(a), dtype(c), iterations)
+    else:
+        _lin_solve_cells(current, prev, side, dtype(a), dtype(c), iterations,
+                         boundary.cells, boundary.sources, boundary.weights)
+
+
+def _set_bounds(grid: np.ndarray, side: int,
+                boundary: Optional[Boundary]) -> None:
+    """Sets the bounds around the obstacles of a field a kernel has just set the border of."""
+    if boundary is not None:
+        _set_cells(grid, side, boundary.cells, boundary.sources,
+                   boundary.weights)
+
+
+def diffuse(side_length: int,
+            side: int,
+            current_list: np.ndarray,
+            prev_list: np.ndarray,
+            diffusion_rate: Union[float, np.ndarray],
+            dt: Union[float, np.ndarray],
+            iterations: int = 8,
+            boundary: Optional[Boundary] = None,
+            tiles: Optional[ActiveTiles] = None,
+            fused: bool = False) -> None:
+    """**Diffuses** the values of the current_list outwards by moving the previous list towards the
+    values adjacent to each index in the current list
+
+    Args:
+        side_length: The length of each side, assuming the lists are square and equal length
+        side: The side of the simulated field as an integer
+        current_list: The current list
+        prev_list: The same list but last iteration
+        diffusion_rate: How fast the array diffuses, or an array with a rate per grid of a stack
+        dt: The timestep taken, or an array with a timestep per grid of a stack
+        iterations: How many red-black sweeps to relax the list with
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+        tiles: Which tiles of the board to step, see ActiveTiles. Defaults to all of them.
+        fused: Whether to run the sweeps a few at a time in one pass over the board, see the
+            module docstring.
+    """
+    a = np.multiply(dt, diffusion_rate) * ((side_length - 2)**2)
+    _solve(_grid(current_list, side_length), _grid(prev_list, side_length),
+           side, a, 1 + (4 * a), iterations, boundary, tiles, fused)
+
+
+def lin_solve(side_length: int,
+              side: int,
+              current_list: np.ndarray,
+              prev_list: np.ndarray,
+              a: Union[float, np.ndarray],
+              c: Union[float, np.ndarray],
+              boundary: Optional[Boundary] = None,
+              sweeps: int = 1,
+              tiles: Optional[ActiveTiles] = None,
+              fused: bool = False) -> None:
+    """Red-black Gauss-Seidel sweeps over the interior of current_list, each followed by
+    set_bnd. See numpy_utils.lin_solve for why the cells are split by colour.
+
+    Args:
+        side_length: The length of each side of the simulated field
+        side: The side of the simulated field as an integer
+        current_list: The current iteration of the list to be solved
+        prev_list: The previous iteration of the list to be solved
+        a: The weight of the neighbouring cells, either one value or one per grid of a stack
+        c: What the weighted sum is divided by, either one value or one per grid of a stack
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+        sweeps: How many sweeps to run
+        tiles: Which tiles of the board to step, see ActiveTiles. Defaults to all of them.
+        fused: Whether to run the sweeps a few at a time in one pass over the board, see the
+            module docstring.
+    """
+    _solve(_grid(current_list, side_length), _grid(prev_list, side_length),
+           side, a, c, sweeps, boundary, tiles, fused)
+
+
+def residual_norm(side_length: int,
+                  current_list: np.ndarray,
+                  prev_list: np.ndarray,
+                  a: float,
+                  c: float,
+                  boundary: Optional[Boundary] = None,
+                  tiles: Optional[ActiveTiles] = None) -> float:
+    """How far current_list is from what lin_solve converges to, as the norm of
+    prev + a * neighbours - c * current over the interior.
+
+    Args:
+        side_length: The length of each side of the simulated field
+        current_list: The current iteration of the list being solved, with its border set
+        prev_list: The previous iteration of the list being solved
+        a: The weight of the neighbouring cells
+        c: What the weighted sum is divided by
+        boundary: The obstacles the list is solved around, whose cells are left out of the norm.
+            Defaults to none.
+        tiles: Which tiles of the board the norm is over, see ActiveTiles. Defaults to all of
+            them.
+
+    Returns:
+        float: The norm of the residual
+    """
+    current = _grid(current_list, side_length)
+    prev = _grid(prev_list, side_length)
+    dtype = current.dtype.type
+    if tiles is not None:
+        return _residual_norm_tiles(current, prev, dtype(a), dtype(c),
+                                    tiles.origins, tiles.size)
+    if boundary is not None:
+        return _fluid_residual_norm(current, prev, dtype(a), dtype(c),
+                                    boundary.fluid)
+    return _residual_norm(current, prev, dtype(a), dtype(c))
+
+
+@njit(parallel=True, fastmath=True)
+def _residual_norm(current: np.ndarray, prev: np.ndarray, a: float,
+                   c: float) -> float:
+    side_length = current.shape[0]
+    # Added up in double precision, so the norm of a big float32 field is still accurate
+    total = 0.0
+    for i in prange(1, side_length - 1):
+        for j in range(1, side_length - 1):
+            residual = (prev[i, j] - c * current[i, j] + a *
+                        (current[i - 1, j] + current[i + 1, j] +
+                         current[i, j - 1] + current[i, j + 1]))
+            total += residual * residual
+    return np.sqrt(total)
+
+
+@njit(parallel=True, fastmath=True)
+def _fluid_residual_norm(current: np.ndarray, prev: np.ndarray, a: float,
+                         c: float, fluid: np.ndarray) -> float:
+    """_residual_norm over only the cells that are not obstacles."""
+    side_length = current.shape[0]
+    total = 0.0
+    for i in prange(1, side_length - 1):
+        for j in range(1, side_length - 1):
+            if fluid[i, j]:
+                residual = (prev[i, j] - c * current[i, j] + a *
+                            (current[i - 1, j] + current[i + 1, j] +
+                             current[i, j - 1] + current[i, j + 1]))
+                total += residual * residual
+    return np.sqrt(total)
+
+
+@njit(parallel=True, fastmath=True)
+def _residual_norm_tiles(current: np.ndarray, prev: np.ndarray, a: float,
+                         c: float, origins: np.ndarray, size: int) -> float:
+    """_residual_norm over only the cells of the given tiles."""
+    side_length = current.shape[0]
+    total = 0.0
+    for t in prange(origins.shape[0]):
+        for i in range(max(origins[t, 0], 1),
+                       min(origins[t, 0] + size, side_length - 1)):
+            for j in range(max(origins[t, 1], 1),
+                           min(origins[t, 1] + size, side_length - 1)):
+                residual = (prev[i, j] - c * current[i, j] + a *
+                            (current[i - 1, j] + current[i + 1, j] +
+                             current[i, j - 1] + current[i, j + 1]))
+                total += residual * residual
+    return np.sqrt(total)
+
+
+@njit(fastmath=True)
+def _lin_solve(current: np.ndarray, prev: np.ndarray, side: int, a: float,
+               c: float, iterations: int) -> None:
+    """Runs all the sweeps of a solve in one compiled call instead of going back to python between
+    every sweep.
+
+    Each half sweep only reads cells of the other colour, so the rows can be split between threads
+    without any of them seeing a half updated neighbour.
+    """
+    for _ in range(iterations):
+        for parity in range(2):
+            _relax(current, prev, a, c, parity)
+        _set_bnd(current, side)
+
+
+@njit(fastmath=True)
+def _lin_solve_cells(current: np.ndarray, prev: np.ndarray, side: int,
+                     a: float, c: float, iterations: int, cells: np.ndarray,
+                     sources: np.ndarray, weights: np.ndarray) -> None:
+    """_lin_solve around obstacles. Their bounds are set again after each half of a sweep, see
+    numpy_utils.lin_solve.
+    """
+    for _ in range(iterations):
+        for parity in range(2):
+            _relax(current, prev, a, c, parity)
+            _set_cells(current, side, cells, sources, weights)
+
+
+@njit(fastmath=True)
+def _lin_solve_tiles(current: np.ndarray, prev: np.ndarray, side: int,
+                     a: float, c: float, iterations: int, origins: np.ndarray,
+                     size: int) -> None:
+    """_lin_solve over only the cells of the given tiles, which are split between threads a tile
+    at a time.
+    """
+    for _ in range(iterations):
+        for parity in range(2):
+            _relax_tiles(current, prev, a, c, parity, origins, size)
+        _set_bnd(current, side)
+
+
+@njit(parallel=True, fastmath=True)
+def _relax_tiles(current: np.ndarray, prev: np.ndarray, a: float, c: float,
+                 parity: int, origins: np.ndarray, size: int) -> None:
+    side_length = current.shape[0]
+    for t in prange(origins.shape[0]):
+        low = max(origins[t, 1], 1)
+        high = min(origins[t, 1] + size, side_length - 1)
+        for i in range(max(origins[t, 0], 1),
+                       min(origins[t, 0] + size, side_length - 1)):
+            start = low if (i + low) % 2 == parity else low + 1
+            for j in range(start, high, 2):
+                current[i, j] = (prev[i, j] + a *
+                                 (current[i - 1, j] + current[i + 1, j] +
+                                  current[i, j - 1] + current[i, j + 1])) / c
+
+
+@njit(parallel=True, fastmath=True)
+def _relax(current: np.ndarray, prev: np.ndarray, a: float, c: float,
+           parity: int) -> None:
+    side_length = current.shape[0]
+    for i in prange(1, side_length - 1):
+        start = 1 if (i + 1) % 2 == parity else 2
+        for j in range(start, side_length - 1, 2):
+            current[i, j] = (prev[i, j] + a *
+                             (current[i - 1, j] + current[i + 1, j] +
+                              current[i, j - 1] + current[i, j + 1])) / c
+
+
+@njit(fastmath=True)
+def _lin_solve_fused(current: np.ndarray, prev: np.ndarray, side: int,
+                     a: float, c: float, iterations: int) -> None:
+    """_lin_solve FUSED_SWEEPS sweeps at a time, see the module docstring.
+
+    A single thread sweeps the board in place. Otherwise the strips read their halos from the
+    field the last pass left, so each pass writes into the other of current and a scratch field.
+    """
+    side_length = current.shape[0]
+    strips = min(numba.get_num_threads(), side_length)
+    done = 0
+    if strips == 1:
+        while done < iterations:
+            sweeps = min(FUSED_SWEEPS, iterations - done)
+            _wavefront(current, prev, side, a, c, sweeps, 0)
+            done += sweeps
+        return
+
+    source = current
+    target = np.empty_like(current)
+    swapped = False
+    while done < iterations:
+        sweeps = min(FUSED_SWEEPS, iterations - done)
+        _sweep_strips(source, target, prev, side, a, c, sweeps, strips)
+        source, target = target, source
+        swapped = not swapped
+        done += sweeps
+    if swapped:
+        current[:, :] = source
+
+
+@njit(parallel=True, fastmath=True)
+def _sweep_strips(source: np.ndarray, target: np.ndarray, prev: np.ndarray,
+                  side: int, a: float, c: float, sweeps: int,
+                  strips: int) -> None:
+    side_length = source.shape[0]
+    width = -(-side_length // strips)
+    halo = 2 * sweeps + 1
+    for strip in prange(strips):
+        y0 = min(strip * width, side_length)
+        y1 = min(y0 + width, side_length)
+        # The strip and its halo, cut off at the edges of the board
+        bottom = max(y0 - halo, 0)
+        top = min(y1 + halo, side_length)
+        local = source[:, bottom:top].copy()
+        _wavefront(local, prev, side, a, c, sweeps, bottom)
+        target[:, y0:y1] = local[:, y0 - bottom:y1 - bottom]
+
+
+@njit(fastmath=True)
+def _wavefront(grid: np.ndarray, prev: np.ndarray, side: int, a: float,
+               c: float, sweeps: int, bottom: int) -> None:
+    """Runs the sweeps in one pass down the rows of grid, which holds the columns of the board
+    from bottom on.
+
+    Row p - 1 is relaxed black once row p is red, which is when every red neighbour it reads is
+    done. The next sweep can relax row p red once the black of row p + 1 is done, so it follows two
+    rows behind.
+    """
+    side_length = grid.shape[0]
+    for t in range(1, side_length + 2 * (sweeps - 1)):
+        for sweep in range(sweeps):
+            p = t - 2 * sweep
+            if p < 1 or p > side_length - 1:
+                continue
+            if p < side_length - 1:
+                _relax_row(grid, prev, a, c, p, 0, bottom)
+            if p > 1:
+                _relax_row(grid, prev, a, c, p - 1, 1, bottom)
+                _set_bnd_row(grid, side, p - 1, bottom)
+
+
+@njit(fastmath=True)
+def _relax_row(grid: np.ndarray, prev: np.ndarray, a: float, c: float, i: int,
+               parity: int, bottom: int) -> None:
+    # The outermost columns of a strip's halo have no neighbours to be relaxed from, and after
+    # each half sweep the next columns in are out of date, which the halo is deep enough to absorb
+    side_length = grid.shape[0]
+    low = max(bottom + 1, 1)
+    high = min(bottom + grid.shape[1] - 1, side_length - 1)
+    start = low if (i + low) % 2 == parity else low + 1
+    for j in range(start, high, 2):
+        y = j - bottom
+        grid[i, y] = (prev[i, j] + a * (grid[i - 1, y] + grid[i + 1, y] +
+                                        grid[i, y - 1] + grid[i, y + 1])) / c
+
+
+@njit(fastmath=True)
+def _set_bnd_row(grid: np.ndarray, side: int, k: int, bottom: int) -> None:
+    """The part of _set_bnd that is set from row k, once row k has been relaxed."""
+    side_length, width = grid.shape
+    one = grid.dtype.type(1)
+    half = grid.dtype.type(0.5)
+    x_sign = -one if side == 1 else one
+    y_sign = -one if side == 2 else one
+    has_bottom = bottom == 0
+    has_top = bottom + width == side_length
+
+    if has_bottom:
+        grid[k, 0] = y_sign * grid[k, 1]
+    if has_top:
+        grid[k, width - 1] = y_sign * grid[k, width - 2]
+
+    for edge, inside in ((0, 1), (side_length - 1, side_length - 2)):
+        if k != inside:
+            continue
+        for j in range(max(bottom, 1), min(bottom + width, side_length - 1)):
+            grid[edge, j - bottom] = x_sign * grid[inside, j - bottom]
+        # 2 corners
+        if has_bottom:
+            grid[edge, 0] = half * (grid[inside, 0] + grid[edge, 1])
+        if has_top:
+            grid[edge, width -
+                 1] = half * (grid[inside, width - 1] + grid[edge, width - 2])
+
+
+def max_speed(side_length: int, x_velocity: np.ndarray,
+              y_velocity: np.ndarray) -> float:
+    """The fastest speed anywhere on the board, which adaptive steps pick their timestep from."""
+    return float(
+        _max_speed(_grid(x_velocity, side_length),
+                   _grid(y_velocity, side_length)))
+
+
+@njit(parallel=True, fastmath=True)
+def _max_speed(vel_x: np.ndarray, vel_y: np.ndarray) -> float:
+    # Each row's fastest is found on its own thread, then the fastest of those
+    rows = np.zeros(vel_x.shape[0], dtype=vel_x.dtype)
+    for i in prange(vel_x.shape[0]):
+        fastest = vel_x.dtype.type(0)
+        for j in range(vel_x.shape[1]):
+            fastest = max(fastest, vel_x[i, j]**2 + vel_y[i, j]**2)
+        rows[i] = fastest
+    return np.sqrt(rows.max())
+
+
+def advect(side_length: int,
+           side: int,
+           current_list: np.ndarray,
+           prev_list: np.ndarray,
+           x_velocity: np.ndarray,
+           y_velocity: np.ndarray,
+           timestep: Union[float, np.ndarray],
+           boundary: Optional[Boundary] = None,
+           scale: float = 1,
+           decay: float = 0,
+           tiles: Optional[ActiveTiles] = None) -> None:
+    """Moves the values of prev_list along the velocity field into current_list by tracing each
+    cell backwards through the velocity field and bilinearly interpolating where it lands.
+
+    The advected values can also be dissipated on the way, each multiplied by scale and then
+    moved decay closer to 0 without passing it, in the same pass.
+
+    Args:
+        side_length: A Fluid specific side length, specifying the length of each side of the
+            simulated field
+        side: The side of the simulated field as an integer
+        current_list: The current iteration of the list to be advected
+        prev_list: The previous iteration of the list to be advected
+        x_velocity: Current x velocity
+        y_velocity: Current y velocity
+        timestep: How long each timestep is. Lower results in a better simulation. Stacks can
+            be given an array with a timestep per grid
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+        scale: What every advected value is multiplied by, for exponential decay.
+        decay: How much closer to 0 every advected value is moved, for linear decay.
+        tiles: Which tiles of the board to step, see ActiveTiles. Defaults to all of them.
+    """
+    current = _grid(current_list, side_length)
+    dtype = current.dtype.type
+    fields = (current, _grid(prev_list, side_length),
+              _grid(x_velocity, side_length), _grid(y_velocity, side_length))
+    if current.ndim == 3:
+        _advect_batch(*fields, side, _per_grid(timestep, current),
+                      dtype(scale), dtype(decay))
+    elif tiles is not None:
+        _advect_tiles(*fields, side, dtype(timestep), dtype(scale),
+                      dtype(decay), tiles.origins, tiles.size)
+        _set_bounds(current, side, boundary)
+    else:
+        _advect(*fields, side, dtype(timestep), dtype(scale), dtype(decay))
+        _set_bounds(current, side, boundary)
+
+
+@njit(fastmath=True)
+def _dissipate(value: float, scale: float, decay: float) -> float:
+    """Multiplies value by scale and moves it decay closer to 0, stopping at 0."""
+    value *= scale
+    if value > decay:
+        return value - decay
+    if value < -decay:
+        return value + decay
+    # 0 in the dtype of value
+    return value * 0
+
+
+@njit(parallel=True, fastmath=True)
+def _advect(current: np.ndarray, prev: np.ndarray, vel_x: np.ndarray,
+            vel_y: np.ndarray, side: int, dt: float, scale: float,
+            decay: float) -> None:
+    side_length = current.shape[0]
+    dtype = current.dtype.type
+    dt0 = dt * dtype(side_length - 2)
+    low = dtype(0.5)
+    high = dtype(side_length - 1.5)
+    one = dtype(1)
+    for i in prange(1, side_length - 1):
+        for j in range(1, side_length - 1):
+            x = min(max(dtype(i) - dt0 * vel_x[i, j], low), high)
+            y = min(max(dtype(j) - dt0 * vel_y[i, j], low), high)
+
+            i0 = int(x)
+            j0 = int(y)
+
+            s1 = x - dtype(i0)
+            s0 = one - s1
+            t1 = y - dtype(j0)
+            t0 = one - t1
+
+            left = t0 * prev[i0, j0] + t1 * prev[i0, j0 + 1]
+            right = t0 * prev[i0 + 1, j0] + t1 * prev[i0 + 1, j0 + 1]
+            current[i, j] = _dissipate(s0 * left + s1 * right, scale, decay)
+    _set_bnd(current, side)
+
+
+@njit(parallel=True, fastmath=True)
+def _advect_tiles(current: np.ndarray, prev: np.ndarray, vel_x: np.ndarray,
+                  vel_y: np.ndarray, side: int, dt: float, scale: float,
+                  decay: float, origins: np.ndarray, size: int) -> None:
+    side_length = current.shape[0]
+    dtype = current.dtype.type
+    dt0 = dt * dtype(side_length - 2)
+    low = dtype(0.5)
+    high = dtype(side_length - 1.5)
+    one = dtype(1)
+    for t in prange(origins.shape[0]):
+        for i in range(max(origins[t, 0], 1),
+                       min(origins[t, 0] + size, side_length - 1)):
+            for j in range(max(origins[t, 1], 1),
+                           min(origins[t, 1] + size, side_length - 1)):
+                x = min(max(dtype(i) - dt0 * vel_x[i, j], low), high)
+                y = min(max(dtype(j) - dt0 * vel_y[i, j], low), high)
+
+                i0 = int(x)
+                j0 = int(y)
+
+                s1 = x - dtype(i0)
+                s0 = one - s1
+                t1 = y - dtype(j0)
+                t0 = one - t1
+
+                left = t0 * prev[i0, j0] + t1 * prev[i0, j0 + 1]
+                right = t0 * prev[i0 + 1, j0] + t1 * prev[i0 + 1, j0 + 1]
+                current[i, j] = _dissipate(s0 * left + s1 * right, scale,
+                                           decay)
+    _set_bnd(current, side)
+
+
+def project(side_length: int,
+            x_velocity: np.ndarray,
+            y_velocity: np.ndarray,
+            p: np.ndarray,
+            div: np.ndarray,
+            iterations: int = 8,
+            boundary: Optional[Boundary] = None,
+            tiles: Optional[ActiveTiles] = None,
+            fused: bool = False) -> None:
+    """Used to conserve mass in the velocity field. p and div are scratch fields that end up
+    holding the pressure and divergence of the velocity field.
+
+    Args:
+        side_length: The length of each side if the ndarray was 2d
+        x_velocity: The current x velocities of the particles
+        y_velocity: The current y velocities of the particles
+        p: Scratch field the pressure is solved into
+        div: Scratch field the divergence is stored in
+        iterations: How many red-black sweeps to solve the pressure with
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+        tiles: Which tiles of the board to step, see ActiveTiles. Defaults to all of them.
+        fused: Whether to run the pressure sweeps a few at a time in one pass over the board,
+            see the module docstring.
+    """
+    fields = (_grid(x_velocity, side_length), _grid(y_velocity, side_length),
+              _grid(p, side_length), _grid(div, side_length))
+    if fields[0].ndim == 3:
+        _project_batch(*fields, iterations)
+    elif boundary is None and tiles is None and not fused:
+        _project(*fields, iterations)
+    else:
+        divergence(side_length, *fields, boundary, tiles)
+        _solve(fields[2], fields[3], 0, 1, 4, iterations, boundary, tiles,
+               fused)
+        subtract_gradient(side_length, *fields[:3], boundary, tiles)
+
+
+def divergence(side_length: int,
+               x_velocity: np.ndarray,
+               y_velocity: np.ndarray,
+               p: np.ndarray,
+               div: np.ndarray,
+               boundary: Optional[Boundary] = None,
+               tiles: Optional[ActiveTiles] = None) -> None:
+    """The first stage of project. Stores the divergence of the velocity field in div and zeroes
+    p, ready for the pressure to be solved into it.
+
+    Args:
+        side_length: The length of each side if the ndarray was 2d
+        x_velocity: The current x velocities of the particles
+        y_velocity: The current y velocities of the particles
+        p: Scratch field the pressure is solved into
+        div: Scratch field the divergence is stored in
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+        tiles: Which tiles of the board to step, see ActiveTiles. Defaults to all of them.
+    """
+    fields = (_grid(x_velocity, side_length), _grid(y_velocity, side_length),
+              _grid(p, side_length), _grid(div, side_length))
+    if fields[0].ndim == 3:
+        _divergence_batch(*fields)
+    else:
+        if tiles is None:
+            _divergence(*fields)
+        else:
+            _divergence_tiles(*fields, tiles.origins, tiles.size)
+        _set_bounds(fields[3], 0, boundary)
+        _set_bounds(fields[2], 0, boundary)
+
+
+def subtract_gradient(side_length: int,
+                      x_velocity: np.ndarray,
+                      y_velocity: np.ndarray,
+                      p: np.ndarray,
+                      boundary: Optional[Boundary] = None,
+                      tiles: Optional[ActiveTiles] = None) -> None:
+    """The last stage of project. Takes the gradient of the solved pressure away from the velocity
+    field, which leaves it divergence free.
+
+    Args:
+        side_length: The length of each side if the ndarray was 2d
+        x_velocity: The current x velocities of the particles
+        y_velocity: The current y velocities of the particles
+        p: The solved pressure field
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+        tiles: Which tiles of the board to step, see ActiveTiles. Defaults to all of them.
+    """
+    fields = (_grid(x_velocity,
+                    side_length), _grid(y_velocity,
+                                        side_length), _grid(p, side_length))
+    if fields[0].ndim == 3:
+        _subtract_gradient_batch(*fields)
+    else:
+        if tiles is None:
+            _subtract_gradient(*fields)
+        else:
+            _subtract_gradient_tiles(*fields, tiles.origins, tiles.size)
+        _set_bounds(fields[0], 1, boundary)
+        _set_bounds(fields[1], 2, boundary)
+
+
+@njit(fastmath=True)
+def _project(vel_x: np.ndarray, vel_y: np.ndarray, p: np.ndarray,
+             div: np.ndarray, iterations: int) -> None:
+    _divergence(vel_x, vel_y, p, div)
+    _lin_solve(p, div, 0, p.dtype.type(1), p.dtype.type(4), iterations)
+    _subtract_gradient(vel_x, vel_y, p)
+
+
+@njit(parallel=True, fastmath=True)
+def _divergence(vel_x: np.ndarray, vel_y: np.ndarray, p: np.ndarray,
+                div: np.ndarray) -> None:
+    side_length = vel_x.shape[0]
+    dtype = div.dtype.type
+    h = dtype(1 / side_length)
+    scale = dtype(-0.5) * h
+    for i in prange(1, side_length - 1):
+        for j in range(1, side_length - 1):
+            div[i, j] = scale * (vel_x[i + 1, j] - vel_x[i - 1, j] +
+                                 vel_y[i, j + 1] - vel_y[i, j - 1])
+            p[i, j] = 0
+    _set_bnd(div, 0)
+    _set_bnd(p, 0)
+
+
+@njit(parallel=True, fastmath=True)
+def _subtract_gradient(vel_x: np.ndarray, vel_y: np.ndarray,
+                       p: np.ndarray) -> None:
+    side_length = vel_x.shape[0]
+    dtype = vel_x.dtype.type
+    h = dtype(1 / side_length)
+    half = dtype(0.5)
+    for i in prange(1, side_length - 1):
+        for j in range(1, side_length - 1):
+            vel_x[i, j] -= half * (p[i + 1, j] - p[i - 1, j]) / h
+            vel_y[i, j] -= half * (p[i, j + 1] - p[i, j - 1]) / h
+    _set_bnd(vel_x, 1)
+    _set_bnd(vel_y, 2)
+
+
+@njit(parallel=True, fastmath=True)
+def _divergence_tiles(vel_x: np.ndarray, vel_y: np.ndarray, p: np.ndarray,
+                      div: np.ndarray, origins: np.ndarray, size: int) -> None:
+    side_length = vel_x.shape[0]
+    dtype = div.dtype.type
+    h = dtype(1 / side_length)
+    scale = dtype(-0.5) * h
+    for t in prange(origins.shape[0]):
+        for i in range(max(origins[t, 0], 1),
+                       min(origins[t, 0] + size, side_length - 1)):
+            for j in range(max(origins[t, 1], 1),
+                           min(origins[t, 1] + size, side_length - 1)):
+                div[i, j] = scale * (vel_x[i + 1, j] - vel_x[i - 1, j] +
+                                     vel_y[i, j + 1] - vel_y[i, j - 1])
+                p[i, j] = 0
+    _set_bnd(div, 0)
+    _set_bnd(p, 0)
+
+
+@njit(parallel=True, fastmath=True)
+def _subtract_gradient_tiles(vel_x: np.ndarray, vel_y: np.ndarray,
+                             p: np.ndarray, origins: np.ndarray,
+                             size: int) -> None:
+    side_length = vel_x.shape[0]
+    dtype = vel_x.dtype.type
+    h = dtype(1 / side_length)
+    half = dtype(0.5)
+    for t in prange(origins.shape[0]):
+        for i in range(max(origins[t, 0], 1),
+                       min(origins[t, 0] + size, side_length - 1)):
+            for j in range(max(origins[t, 1], 1),
+                           min(origins[t, 1] + size, side_length - 1)):
+                vel_x[i, j] -= half * (p[i + 1, j] - p[i - 1, j]) / h
+                vel_y[i, j] -= half * (p[i, j + 1] - p[i, j - 1]) / h
+    _set_bnd(vel_x, 1)
+    _set_bnd(vel_y, 2)
+
+
+def tile_maxima(side_length: int, size: int,
+                fields: Sequence[np.ndarray]) -> np.ndarray:
+    """The largest absolute value any of the fields holds in each size by size tile of the board,
+    for ActiveTiles to decide which tiles to step.
+
+    Args:
+        side_length: The length of each side of the board
+        size: The length of each side of a tile
+        fields: The fields to look through
+
+    Returns:
+        np.ndarray: The largest value in each tile, indexed [x, y] by tile
+    """
+    count = -(-side_length // size)
+    maxima = np.zeros((count, count))
+    for field in fields:
+        _tile_maxima(_grid(field, side_length), size, maxima)
+    return maxima
+
+
+@njit(parallel=True, fastmath=True)
+def _tile_maxima(grid: np.ndarray, size: int, maxima: np.ndarray) -> None:
+    side_length = grid.shape[0]
+    for x in prange(maxima.shape[0]):
+        for y in range(maxima.shape[1]):
+            largest = maxima[x, y]
+            for i in range(x * size, min((x + 1) * size, side_length)):
+                for j in range(y * size, min((y + 1) * size, side_length)):
+                    largest = max(largest, abs(grid[i, j]))
+            maxima[x, y] = largest
+
+
+def set_bnd(side_length: int,
+            side: int,
+            bounded_array: np.ndarray,
+            boundary: Optional[Boundary] = None) -> None:
+    """Sets the bounds of an array by setting the borders to a certain value (in this case the
+    exact opposite value of the adjacent spot point inwards)
+
+    Args:
+        side_length: The length of each side of the square matrix
+        side: Which side to set the bound for
+        bounded_array: The array to bound
+        boundary: The obstacles to set the bounds around as well as the border. Defaults to only
+            the border.
+    """
+    grid = _grid(bounded_array, side_length)
+    if boundary is not None:
+        _set_bounds(grid, side, boundary)
+    elif grid.ndim == 3:
+        _set_bnd_batch(grid, side)
+    else:
+        _set_bnd(grid, side)
+
+
+@njit(fastmath=True)
+def _set_bnd(grid: np.ndarray, side: int) -> None:
+    """Only walks the border, which is too little work to be worth splitting across threads.
+    """
+    side_length = grid.shape[0]
+    one = grid.dtype.type(1)
+    half = grid.dtype.type(0.5)
+    x_sign = -one if side == 1 else one
+    y_sign = -one if side == 2 else one
+
+    for k in range(1, side_length - 1):
+        grid[0, k] = x_sign * grid[1, k]
+        grid[side_length - 1, k] = x_sign * grid[side_length - 2, k]
+        grid[k, 0] = y_sign * grid[k, 1]
+        grid[k, side_length - 1] = y_sign * grid[k, side_length - 2]
+
+    # 4 corners
+    last = side_length - 1
+    grid[0, 0] = half * (grid[1, 0] + grid[0, 1])
+    grid[0, last] = half * (grid[1, last] + grid[0, last - 1])
+    grid[last, 0] = half * (grid[last - 1, 0] + grid[last, 1])
+    grid[last, last] = half * (grid[last - 1, last] + grid[last, last - 1])
+
+
+@njit(fastmath=True)
+def _set_cells(grid: np.ndarray, side: int, cells: np.ndarray,
+               sources: np.ndarray, weights: np.ndarray) -> None:
+    """Sets each of a Boundary's cells to the weighted sum of its neighbours. The cells next to the
+    fluid come first, so they are set before the ones that are set from them.
+    """
+    for k in range(cells.shape[1]):
+        total = grid.dtype.type(0)
+        for n in range(4):
+            total += weights[side, k, n] * grid[sources[0, k, n], sources[1, k,
+                                                                          n]]
+        grid[cells[0, k], cells[1, k]] = total
+
+
+# Serial copies of the kernels for the stacks. Those are split across threads a grid at a time, so
+# the kernels solving each grid must not start parallel loops of their own
+_relax_serial = njit(fastmath=True)(_relax.py_func)
+_advect_serial = njit(fastmath=True)(_advect.py_func)
+_divergence_serial = njit(fastmath=True)(_divergence.py_func)
+_subtract_gradient_serial = njit(fastmath=True)(_subtract_gradient.py_func)
+
+
+@njit(fastmath=True)
+def _lin_solve_serial(current: np.ndarray, prev: np.ndarray, side: int,
+                      a: float, c: float, iterations: int) -> None:
+    for _ in range(iterations):
+        for parity in range(2):
+            _relax_serial(current, prev, a, c, parity)
+        _set_bnd(current, side)
+
+
+@njit(parallel=True, fastmath=True)
+def _lin_solve_batch(current: np.ndarray, prev: np.ndarray, side: int,
+                     a: np.ndarray, c: np.ndarray, iterations: int) -> None:
+    for b in prange(current.shape[0]):
+        _lin_solve_serial(current[b], prev[b], side, a[b], c[b], iterations)
+
+
+@njit(parallel=True, fastmath=True)
+def _advect_batch(current: np.ndarray, prev: np.ndarray, vel_x: np.ndarray,
+                  vel_y: np.ndarray, side: int, dt: np.ndarray, scale: float,
+                  decay: float) -> None:
+    for b in prange(current.shape[0]):
+        _advect_serial(current[b], prev[b], vel_x[b], vel_y[b], side, dt[b],
+                       scale, decay)
+
+
+@njit(parallel=True, fastmath=True)
+def _project_batch(vel_x: np.ndarray, vel_y: np.ndarray, p: np.ndarray,
+                   div: np.ndarray, iterations: int) -> None:
+    for b in prange(vel_x.shape[0]):
+        _divergence_serial(vel_x[b], vel_y[b], p[b], div[b])
+        _lin_solve_serial(p[b], div[b], 0, p.dtype.type(1), p.dtype.type(4),
+                          iterations)
+        _subtract_gradient_serial(vel_x[b], vel_y[b], p[b])
+
+
+@njit(parallel=True, fastmath=True)
+def _divergence_batch(vel_x: np.ndarray, vel_y: np.ndarray, p: np.ndarray,
+                      div: np.ndarray) -> None:
+    for b in prange(vel_x.shape[0]):
+        _divergence_serial(vel_x[b], vel_y[b], p[b], div[b])
+
+
+@njit(parallel=True, fastmath=True)
+def _subtract_gradient_batch(vel_x: np.ndarray, vel_y: np.ndarray,
+                             p: np.ndarray) -> None:
+    for b in prange(vel_x.shape[0]):
+        _subtract_gradient_serial(vel_x[b], vel_y[b], p[b])
+
+
+@njit(parallel=True, fastmath=True)
+def _set_bnd_batch(grid: np.ndarray, side: int) -> None:
+    for b in prange(grid.shape[0]):
+        _set_bnd(grid[b], side)
@@ -0,0 +1,436 @@
+"""A NumPy version of the solver in fluid_utils, for machines that do not have a cuda gpu.
+
+Every public function here takes the same arguments as its counterpart in fluid_utils so that Fluid
+can swap between the two. Instead of one gpu thread per cell, each stencil is written as a single
+slicing operation over the whole interior of the 2d field, so there are no python loops over cells.
+
+The fields are the (side_length, side_length) arrays Fluid stores, indexed [x, y]. Flat fields of
+side_length**2 are still accepted and viewed as 2d, with x on the slow axis as IX lays them out.
+
+Fields can be float32 or float64. Every parameter is cast to the dtype of the fields it is used with
+and the constants are python numbers, so a float32 field is never worked on in double precision.
+
+FluidBatch passes stacks of fields shaped (batch, side_length, side_length) instead. Every stencil
+only slices the last two axes, and the rates, timesteps and weights can be arrays with one value per
+grid, so a whole stack is stepped by the same operations as a single field.
+"""
+
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+from fluid_sim.boundary import Boundary
+
+
+def _grid(array: np.ndarray, side_length: int) -> np.ndarray:
+    """Views a flat field as a 2d array indexed [x, y]. Already 2d fields, and stacks of them, are
+    returned as is.
+    """
+    if array.ndim == 1:
+        return array.reshape(side_length, side_length)
+    return array
+
+
+def _per_grid(value: Union[float, np.ndarray],
+              dtype: np.dtype) -> Union[np.floating, np.ndarray]:
+    """Casts a parameter to the dtype of the fields it is used with, so it does not upcast them.
+    An array with one parameter per grid of a stack is also shaped to broadcast against the stack.
+    """
+    if np.ndim(value) == 0:
+        return dtype.type(value)
+    return np.reshape(value, (-1, 1, 1)).astype(dtype)
+
+
+def to_device(array: np.ndarray) -> np.ndarray:
+    """There is no device on the cpu, the solver works on the array it is given.
+    """
+    return array
+
+
+def to_host(array: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """The counterpart to to_device, the array is already on the host so out is never needed.
+    """
+    return array
+
+
+def zeros(shape: Union[int, Tuple[int, ...]],
+          dtype: Union[type, np.dtype] = np.float64) -> np.ndarray:
+    """Allocates a zeroed field of the given shape and dtype for the solver to use as scratch space.
+    """
+    return np.zeros(shape, dtype)
+
+
+def synchronize() -> None:
+    """Everything here runs synchronously so there is nothing to wait for.
+    """
+
+
+def scatter_add(array: np.ndarray, indices: Tuple[np.ndarray, np.ndarray],
+                amounts: np.ndarray) -> None:
+    """Adds each of the amounts to the array at its (x, y) position. Positions that are repeated
+    add up.
+
+    Args:
+        array: The 2d field to add to
+        indices: The x positions and the y positions to add at
+        amounts: The amount to add at each position
+    """
+    np.add.at(array, indices, amounts)
+
+
+def diffuse(side_length: int,
+            side: int,
+            current_list: np.ndarray,
+            prev_list: np.ndarray,
+            diffusion_rate: Union[float, np.ndarray],
+            dt: Union[float, np.ndarray],
+            iterations: int = 8,
+            boundary: Optional[Boundary] = None) -> None:
+    """**Diffuses** the values of the current_list outwards by moving the previous list towards the
+    values adjacent to each index in the current list
+
+    Args:
+        side_length: The length of each side, assuming the lists are square and equal length
+        side: The side of the simulated field as an integer
+        current_list: The current list
+        prev_list: The same list but last iteration
+        diffusion_rate: How fast the array diffuses, or an array with a rate per grid of a stack
+        dt: The timestep taken, or an array with a timestep per grid of a stack
+        iterations: How many red-black sweeps to relax the list with
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+    """
+    a = np.multiply(dt, diffusion_rate) * ((side_length - 2)**2)
+    for _ in range(iterations):
+        lin_solve(side_length, side, current_list, prev_list, a, 1 + (4 * a),
+                  boundary)
+
+
+def lin_solve(side_length: int,
+              side: int,
+              current_list: np.ndarray,
+              prev_list: np.ndarray,
+              a: Union[float, np.ndarray],
+              c: Union[float, np.ndarray],
+              boundary: Optional[Boundary] = None,
+              sweeps: int = 1) -> None:
+    """Red-black Gauss-Seidel sweeps over the interior of current_list, each followed by
+    set_bnd.
+
+    The cells are coloured like a checkerboard. Every neighbour of a red cell is black, so all the
+    red cells can be updated at once from the black ones and then the other way around. Neither
+    half reads anything it writes, which keeps every backend's sweep deterministic and identical.
+
+    Obstacles are inside the interior, so the sweep relaxes them too. Their bounds are set again
+    between the two halves, before any fluid cell of the other colour reads them.
+
+    Args:
+        side_length: The length of each side of the simulated field
+        side: The side of the simulated field as an integer
+        current_list: The current iteration of the list to be solved
+        prev_list: The previous iteration of the list to be solved
+        a: The weight of the neighbouring cells, either one value or one per grid of a stack
+        c: What the weighted sum is divided by, either one value or one per grid of a stack
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+        sweeps: How many sweeps to run
+    """
+    current = _grid(current_list, side_length)
+    prev = _grid(prev_list, side_length)
+    weight = _per_grid(a, current.dtype)
+    divisor = _per_grid(c, current.dtype)
+
+    for _ in range(sweeps):
+        for parity in (0, 1):
+            _relax(current, prev, weight, divisor, parity)
+            if boundary is not None and parity == 0:
+                set_bnd(side_length, side, current_list, boundary)
+        set_bnd(side_length, side, current_list, boundary)
+
+
+def residual_norm(side_length: int,
+                  current_list: np.ndarray,
+                  prev_list: np.ndarray,
+                  a: float,
+                  c: float,
+                  boundary: Optional[Boundary] = None) -> float:
+    """How far current_list is from what lin_solve converges to, as the norm of
+    prev + a * neighbours - c * current over the interior.
+
+    Args:
+        side_length: The length of each side of the simulated field
+        current_list: The current iteration of the list being solved, with its border set
+        prev_list: The previous iteration of the list being solved
+        a: The weight of the neighbouring cells
+        c: What the weighted sum is divided by
+        boundary: The obstacles the list is solved around, whose cells are left out of the norm.
+            Defaults to none.
+
+    Returns:
+        float: The norm of the residual
+    """
+    current = _grid(current_list, side_length)
+    prev = _grid(prev_list, side_length)
+
+    residual = (prev[1:-1, 1:-1] - c * current[1:-1, 1:-1] + a *
+                (current[:-2, 1:-1] + current[2:, 1:-1] + current[1:-1, :-2] +
+                 current[1:-1, 2:]))
+    if boundary is not None:
+        residual *= boundary.fluid[1:-1, 1:-1]
+    return float(np.linalg.norm(residual))
+
+
+def interior_norm(side_length: int,
+                  array: np.ndarray,
+                  boundary: Optional[Boundary] = None) -> float:
+    """The norm of the interior of a field, which residual_norm is measured relative to. The cells
+    of any obstacles in boundary are left out.
+    """
+    interior = _grid(array, side_length)[1:-1, 1:-1]
+    if boundary is not None:
+        interior = interior * boundary.fluid[1:-1, 1:-1]
+    return float(np.linalg.norm(interior))
+
+
+def max_speed(side_length: int, x_velocity: np.ndarray,
+              y_velocity: np.ndarray) -> float:
+    """The fastest speed anywhere on the board, which adaptive steps pick their timestep from."""
+    vel_x = _grid(x_velocity, side_length)
+    vel_y = _grid(y_velocity, side_length)
+    return float(np.sqrt(np.max(vel_x * vel_x + vel_y * vel_y)))
+
+
+def _relax(current: np.ndarray, prev: np.ndarray, a: Union[np.floating,
+                                                           np.ndarray],
+           c: Union[np.floating, np.ndarray], parity: int) -> None:
+    """Updates the interior cells where (x + y) % 2 == parity.
+
+    Those cells are every other column of every other row, so they are covered by two strided
+    slices, one starting on an odd row and one on an even row.
+    """
+    n = current.shape[-1]
+    for i in (1, 2):
+        j = 1 if (i + 1) % 2 == parity else 2
+        rows = slice(i, n - 1, 2)
+        cols = slice(j, n - 1, 2)
+
+        neighbours = (current[..., i - 1:n - 2:2, cols] +
+                      current[..., i + 1:n:2, cols] +
+                      current[..., rows, j - 1:n - 2:2] +
+                      current[..., rows, j + 1:n:2])
+        current[..., rows, cols] = (prev[..., rows, cols] + a * neighbours) / c
+
+
+def advect(side_length: int,
+           side: int,
+           current_list: np.ndarray,
+           prev_list: np.ndarray,
+           x_velocity: np.ndarray,
+           y_velocity: np.ndarray,
+           timestep: Union[float, np.ndarray],
+           boundary: Optional[Boundary] = None,
+           scale: float = 1,
+           decay: float = 0) -> None:
+    """Moves the values of prev_list along the velocity field into current_list by tracing each
+    cell backwards through the velocity field and bilinearly interpolating where it lands.
+
+    The advected values can also be dissipated on the way, each multiplied by scale and then
+    moved decay closer to 0 without passing it.
+
+    Args:
+        side_length: A Fluid specific side length, specifying the length of each side of the
+            simulated field
+        side: The side of the simulated field as an integer
+        current_list: The current iteration of the list to be advected
+        prev_list: The previous iteration of the list to be advected
+        x_velocity: Current x velocity
+        y_velocity: Current y velocity
+        timestep: How long each timestep is. Lower results in a better simulation. Stacks can
+            be given an array with a timestep per grid
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+        scale: What every advected value is multiplied by, for exponential decay.
+        decay: How much closer to 0 every advected value is moved, for linear decay.
+    """
+    current = _grid(current_list, side_length)
+    prev = _grid(prev_list, side_length)
+    vel_x = _grid(x_velocity, side_length)
+    vel_y = _grid(y_velocity, side_length)
+
+    dt0 = _per_grid(np.multiply(timestep, side_length - 2), current.dtype)
+    i = np.arange(1, side_length - 1, dtype=current.dtype).reshape(-1, 1)
+    j = np.arange(1, side_length - 1, dtype=current.dtype).reshape(1, -1)
+
+    x = np.clip(i - dt0 * vel_x[..., 1:-1, 1:-1], 0.5, side_length - 1.5)
+    y = np.clip(j - dt0 * vel_y[..., 1:-1, 1:-1], 0.5, side_length - 1.5)
+
+    x0 = np.floor(x)
+    y0 = np.floor(y)
+    i0 = x0.astype(np.intp)
+    j0 = y0.astype(np.intp)
+
+    s1 = x - x0
+    s0 = 1 - s1
+    t1 = y - y0
+    t0 = 1 - t1
+
+    left = t0 * _sample(prev, i0, j0) + t1 * _sample(prev, i0, j0 + 1)
+    right = (t0 * _sample(prev, i0 + 1, j0) +
+             t1 * _sample(prev, i0 + 1, j0 + 1))
+    interior = current[..., 1:-1, 1:-1]
+    interior[...] = s0 * left + s1 * right
+    # Left out when there is nothing to dissipate, so those steps cost no more than they did
+    if scale != 1:
+        interior *= scale
+    if decay:
+        np.copysign(np.maximum(np.abs(interior) - decay, 0),
+                    interior,
+                    out=interior)
+    set_bnd(side_length, side, current_list, boundary)
+
+
+def _sample(grid: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Reads grid[x, y] for every pair of indices, where the indices of a stack pick from the grid
+    at the same position in the stack.
+    """
+    if grid.ndim == 2:
+        return grid[x, y]
+    side_length = grid.shape[-1]
+    flat = grid.reshape(grid.shape[0], -1)
+    index = (x * side_length + y).reshape(grid.shape[0], -1)
+    return np.take_along_axis(flat, index, axis=-1).reshape(x.shape)
+
+
+def project(side_length: int,
+            x_velocity: np.ndarray,
+            y_velocity: np.ndarray,
+            p: np.ndarray,
+            div: np.ndarray,
+            iterations: int = 8,
+            boundary: Optional[Boundary] = None) -> None:
+    """Used to conserve mass in the velocity field. p and div are scratch fields that end up
+    holding the pressure and divergence of the velocity field.
+
+    Args:
+        side_length: The length of each side if the ndarray was 2d
+        x_velocity: The current x velocities of the particles
+        y_velocity: The current y velocities of the particles
+        p: Scratch field the pressure is solved into
+        div: Scratch field the divergence is stored in
+        iterations: How many red-black sweeps to solve the pressure with
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+    """
+    divergence(side_length, x_velocity, y_velocity, p, div, boundary)
+    for _ in range(iterations):
+        lin_solve(side_length, 0, p, div, 1, 4, boundary)
+    subtract_gradient(side_length, x_velocity, y_velocity, p, boundary)
+
+
+def divergence(side_length: int,
+               x_velocity: np.ndarray,
+               y_velocity: np.ndarray,
+               p: np.ndarray,
+               div: np.ndarray,
+               boundary: Optional[Boundary] = None) -> None:
+    """The first stage of project. Stores the divergence of the velocity field in div and zeroes
+    p, ready for the pressure to be solved into it.
+
+    Args:
+        side_length: The length of each side if the ndarray was 2d
+        x_velocity: The current x velocities of the particles
+        y_velocity: The current y velocities of the particles
+        p: Scratch field the pressure is solved into
+        div: Scratch field the divergence is stored in
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+    """
+    vel_x = _grid(x_velocity, side_length)
+    vel_y = _grid(y_velocity, side_length)
+
+    h = 1 / side_length
+    _grid(div, side_length)[
+        ..., 1:-1,
+        1:-1] = -0.5 * h * (vel_x[..., 2:, 1:-1] - vel_x[..., :-2, 1:-1] +
+                            vel_y[..., 1:-1, 2:] - vel_y[..., 1:-1, :-2])
+    _grid(p, side_length)[..., 1:-1, 1:-1] = 0
+
+    set_bnd(side_length, 0, div, boundary)
+    set_bnd(side_length, 0, p, boundary)
+
+
+def subtract_gradient(side_length: int,
+                      x_velocity: np.ndarray,
+                      y_velocity: np.ndarray,
+                      p: np.ndarray,
+                      boundary: Optional[Boundary] = None) -> None:
+    """The last stage of project. Takes the gradient of the solved pressure away from the velocity
+    field, which leaves it divergence free.
+
+    Args:
+        side_length: The length of each side if the ndarray was 2d
+        x_velocity: The current x velocities of the particles
+        y_velocity: The current y velocities of the particles
+        p: The solved pressure field
+        boundary: The obstacles to set the bounds around, see Boundary. Defaults to only the
+            border of the board.
+    """
+    vel_x = _grid(x_velocity, side_length)
+    vel_y = _grid(y_velocity, side_length)
+    pressure = _grid(p, side_length)
+
+    h = 1 / side_length
+    vel_x[..., 1:-1, 1:-1] -= 0.5 * (pressure[..., 2:, 1:-1] -
+                                     pressure[..., :-2, 1:-1]) / h
+    vel_y[..., 1:-1, 1:-1] -= 0.5 * (pressure[..., 1:-1, 2:] -
+                                     pressure[..., 1:-1, :-2]) / h
+
+    set_bnd(side_length, 1, x_velocity, boundary)
+    set_bnd(side_length, 2, y_velocity, boundary)
+
+
+def set_bnd(side_length: int,
+            side: int,
+            bounded_array: np.ndarray,
+            boundary: Optional[Boundary] = None) -> None:
+    """Sets the bounds of an array by setting the borders to a certain value (in this case the
+    exact opposite value of the adjacent spot point inwards)
+
+    Only the border is touched, so this costs O(side_length). With a boundary only its solid cells
+    are, see Boundary.
+
+    Args:
+        side_length: The length of each side of the square matrix
+        side: Which side to set the bound for
+        bounded_array: The array to bound
+        boundary: The obstacles to set the bounds around as well as the border. Defaults to only
+            the border.
+    """
+    grid = _grid(bounded_array, side_length)
+    if boundary is not None:
+        _set_cells(grid, side, boundary)
+        return
+    x_sign = -1 if side == 1 else 1
+    y_sign = -1 if side == 2 else 1
+
+    grid[..., 0, 1:-1] = x_sign * grid[..., 1, 1:-1]
+    grid[..., -1, 1:-1] = x_sign * grid[..., -2, 1:-1]
+    grid[..., 1:-1, 0] = y_sign * grid[..., 1:-1, 1]
+    grid[..., 1:-1, -1] = y_sign * grid[..., 1:-1, -2]
+
+    # 4 corners
+    grid[..., 0, 0] = 0.5 * (grid[..., 1, 0] + grid[..., 0, 1])
+    grid[..., 0, -1] = 0.5 * (grid[..., 1, -1] + grid[..., 0, -2])
+    grid[..., -1, 0] = 0.5 * (grid[..., -2, 0] + grid[..., -1, 1])
+    grid[..., -1, -1] = 0.5 * (grid[..., -2, -1] + grid[..., -1, -2])
+
+
+def _set_cells(grid: np.ndarray, side: int, boundary: Boundary) -> None:
+    """Sets each of the boundary's cells to the weighted sum of its neighbours, the ones next to
+    the fluid first.
+    """
+    for part in (slice(None, boundary.split), slice(boundary.split, None)):
+        x, y = boundary.cells[:, part]
+        source_x, source_y = boundary.sources[:, part]
+        weights = boundary.weights[side, part]
+        grid[..., x, y] = (weights * grid[..., source_x, source_y]).sum(-1)
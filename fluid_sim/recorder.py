@@ -0,0 +1,248 @@
+"""Records fields of a fluid to disk as it steps, without the step waiting on the disk.
+
+Frames are written into a .npy file that is allocated up front for every frame and memory mapped,
+shaped (frames, fields, side_length, side_length), so it can be opened with np.load(mmap_mode='r')
+while it is still being written and nothing is copied to read a frame back.
+
+A step only copies the fields it records into one of a fixed ring of buffers and hands it to a
+background thread, which quantizes it and writes it into the file before handing the buffer back.
+The step only waits if every buffer is still waiting to be written, which keeps memory bounded when
+the disk cannot keep up.
+
+Fields can be kept as float16, which halves a float32 recording, or as uint8 between a low and high
+limit for each field, which quarters it. With a colormap they are kept as the uint8 RGB pixels
+render.Colormap turns them into between those limits instead, ready to be shown or encoded as
+video, and the file is shaped (frames, fields, side_length, side_length, 3). A .json file next to
+the recording notes which fields it holds, how they were quantized and how many frames were
+written, which read_frames uses to read it back.
+"""
+
+import json
+import queue
+import threading
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from fluid_sim.render import Colormap
+
+QUANTIZATIONS = ('float16', 'uint8')
+
+
+class FrameRecorder:
+    """Writes every few steps of a fluid into a memory mapped .npy file on a background thread.
+
+    Attributes:
+        path: Where the recording is written. The metadata is written to path + '.json'.
+        fields: The names of the fields each frame holds, in order.
+        frames: How many frames the file has room for. Frames captured after it is full are
+            dropped.
+        every: How many steps there are between frames.
+        written: How many frames have been captured so far.
+    """
+    def __init__(self,
+                 path: str,
+                 side_length: int,
+                 frames: int,
+                 fields: Sequence[str] = ('density', ),
+                 every: int = 1,
+                 quantize: Optional[str] = None,
+                 limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 buffers: int = 4,
+                 dtype: Union[type, np.dtype] = np.float64,
+                 colormap: Optional[str] = None):
+        """Allocates the file and the buffers, and starts the thread that writes them.
+
+        Args:
+            path: Where to write the recording, which should end in .npy.
+            side_length: The length of each side of the board.
+            frames: How many frames to make room for.
+            fields: The names of the fields to record.
+            every: Record a frame every this many steps.
+            quantize: How to store the fields, one of QUANTIZATIONS, or None to keep the dtype.
+            limits: The (low, high) of each field for uint8, which are stored as 0 and 255 with
+                anything outside them clipped.
+            buffers: How many frames can be waiting to be written before a step waits.
+            dtype: The dtype of the fields that are recorded.
+            colormap: The name of one of render.COLORMAPS to store the fields as the colours of,
+                between their limits, instead of quantizing them.
+
+        Raises:
+            ValueError: If frames, every or buffers is not positive, quantize is not one of
+                QUANTIZATIONS, both quantize and colormap are given, the colormap is not one of
+                render.COLORMAPS or it is uint8 or there is a colormap and a field has no limits.
+        """
+        for name, value in (('frames', frames), ('every', every), ('buffers',
+                                                                   buffers)):
+            if value < 1:
+                raise ValueError(f'{name} must be positive, got {value}')
+        if quantize is not None and quantize not in QUANTIZATIONS:
+            raise ValueError(f'Unknown quantization {quantize!r}, expected '
+                             f'one of {list(QUANTIZATIONS)}')
+        if quantize is not None and colormap is not None:
+            raise ValueError('Fields are either quantized or coloured, not '
+                             'both')
+        limits = dict(limits or {})
+        if quantize == 'uint8' or colormap is not None:
+            missing = [name for name in fields if name not in limits]
+            if missing:
+                raise ValueError(
+                    f'{quantize or colormap} needs the (low, high) limits of '
+                    f'{missing}')
+
+        self.path = path
+        self.fields = list(fields)
+        self.frames = frames
+        self.every = every
+        self.quantize = quantize
+        self.limits = {name: limits[name] for name in fields if name in limits}
+        self.colormap = colormap
+        self._colormaps = []
+        if colormap is not None:
+            self._colormaps = [
+                Colormap(colormap, self.limits[name]) for name in self.fields
+            ]
+        self.written = 0
+        self._steps = 0
+
+        shape = (len(self.fields), side_length, side_length)
+        stored = shape + (3, ) if colormap is not None else shape
+        self._file = np.lib.format.open_memmap(
+            path,
+            mode='w+',
+            dtype=np.uint8 if colormap is not None else quantize or dtype,
+            shape=(frames, *stored))
+        # Buffers go round from free, to filled by a step, to written by the thread and back
+        self._free: 'queue.Queue[np.ndarray]' = queue.Queue()
+        for _ in range(buffers):
+            self._free.put(np.empty(shape, dtype))
+        # None tells the thread to stop
+        self._filled: 'queue.Queue[Optional[Tuple[int, np.ndarray]]]'
+        self._filled = queue.Queue()
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+        self._write_metadata()
+
+    def count_step(self) -> bool:
+        """Counts a step of the fluid, and returns whether a frame should be captured after it."""
+        due = self._steps % self.every == 0
+        self._steps += 1
+        return due and self.written < self.frames
+
+    def capture(self, fields: Sequence[np.ndarray]) -> None:
+        """Copies the fields into a free buffer for the thread to write as the next frame, waiting
+        for a buffer to be free if every one is still being written.
+
+        Args:
+            fields: A (side_length, side_length) array for each of self.fields, in the same order.
+
+        Raises:
+            ValueError: If the recorder has been closed.
+        """
+        self._raise_error()
+        if not self._thread.is_alive():
+            raise ValueError('The recorder has been closed')
+        if self.written >= self.frames:
+            return
+        buffer = self._free.get()
+        for out, field in zip(buffer, fields):
+            np.copyto(out, field)
+        self._filled.put((self.written, buffer))
+        self.written += 1
+
+    def close(self) -> None:
+        """Waits for every frame to be written, flushes the file and notes how many there are.
+
+        Raises:
+            Exception: Whatever the thread raised while writing, if it did.
+        """
+        if self._thread.is_alive():
+            self._filled.put(None)
+            self._thread.join()
+            self._file.flush()
+            self._write_metadata()
+        self._raise_error()
+
+    def __enter__(self) -> 'FrameRecorder':
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def _write(self) -> None:
+        while True:
+            item = self._filled.get()
+            if item is None:
+                return
+            index, buffer = item
+            try:
+                self._store(self._file[index], buffer)
+            except BaseException as error:
+                self._error = error
+                return
+            finally:
+                self._free.put(buffer)
+
+    def _store(self, out: np.ndarray, buffer: np.ndarray) -> None:
+        """Quantizes a frame into its place in the file. The buffer is scratch space."""
+        if self._colormaps:
+            for field, colormap, pixels in zip(buffer, self._colormaps, out):
+                colormap(field, pixels)
+            return
+        if self.quantize != 'uint8':
+            np.copyto(out, buffer, casting='unsafe')
+            return
+        for field, name in zip(buffer, self.fields):
+            low, high = self.limits[name]
+            field -= low
+            field *= 255 / (high - low)
+            np.clip(field, 0, 255, out=field)
+            np.rint(field, out=field)
+        np.copyto(out, buffer, casting='unsafe')
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def _write_metadata(self) -> None:
+        with open(self.path + '.json', 'w') as file:
+            json.dump(
+                {
+                    'fields': self.fields,
+                    'every': self.every,
+                    'quantize': self.quantize,
+                    'colormap': self.colormap,
+                    'limits': self.limits,
+                    'frames': self.written,
+                }, file)
+
+
+def read_frames(path: str) -> Dict[str, np.ndarray]:
+    """Opens a recording written by a FrameRecorder.
+
+    Args:
+        path: Where the recording was written.
+
+    Returns:
+        Dict[str, np.ndarray]: The (frames, side_length, side_length) frames of each field that
+            were written by the time the recording was closed, memory mapped so only the frames
+            that are used are read. uint8 fields are left as they were stored, dequantize turns them
+            back with the limits noted in path + '.json'. Coloured fields are
+            (frames, side_length, side_length, 3) pixels.
+    """
+    with open(path + '.json') as file:
+        metadata = json.load(file)
+    recording = np.load(path, mmap_mode='r')[:metadata['frames']]
+    return {
+        name: recording[:, index]
+        for index, name in enumerate(metadata['fields'])
+    }
+
+
+def dequantize(frames: np.ndarray,
+               limits: Tuple[float, float],
+               dtype: Union[type, np.dtype] = np.float32) -> np.ndarray:
+    """Turns uint8 frames back into values between the limits they were recorded with."""
+    low, high = limits
+    return frames.astype(dtype) * ((high - low) / 255) + low
@@ -0,0 +1,163 @@
+"""Turns fields of the fluid into uint8 RGB pixels through a colour lookup table.
+
+A colormap is a few colours along the range of a field, which lookup_table spreads out into a
+table of evenly spaced levels once. Rendering a frame is then one parallel pass over the field that
+scales each value between the limits to a level, clamps it, and copies that level's colour into an
+(x, y, 3) array, with nothing allocated when the array is passed back in each frame. pygame's
+surfarray.blit_array takes the result as is, and FrameRecorder uses it to record frames as colour.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from numba import njit, prange
+import numpy as np
+
+# The colours each colormap passes through, as (position between 0 and 1, (red, green, blue))
+COLORMAPS: Dict[str, List[Tuple[float, Tuple[int, int, int]]]] = {
+    'gray': [(0, (0, 0, 0)), (1, (255, 255, 255))],
+    'fire': [(0, (0, 0, 0)), (0.35, (200, 30, 0)), (0.7, (255, 190, 0)),
+             (1, (255, 255, 255))],
+    'ice': [(0, (0, 0, 0)), (0.35, (0, 40, 200)), (0.7, (0, 200, 255)),
+            (1, (255, 255, 255))],
+}
+
+
+def lookup_table(colormap: str, levels: int = 256) -> np.ndarray:
+    """Spreads the colours of a colormap out into evenly spaced levels.
+
+    Args:
+        colormap: The name of the colormap, one of the keys of COLORMAPS.
+        levels: How many colours the table has.
+
+    Returns:
+        np.ndarray: A (levels, 3) uint8 array of the colour at each level, from low to high.
+
+    Raises:
+        ValueError: If the colormap is not one of COLORMAPS.
+    """
+    if colormap not in COLORMAPS:
+        raise ValueError(f'Unknown colormap {colormap!r}, expected one of '
+                         f'{list(COLORMAPS)}')
+    positions, colours = zip(*COLORMAPS[colormap])
+    colours = np.array(colours, dtype=np.float64)
+    spread = np.linspace(0, 1, levels)
+    table = np.stack([
+        np.interp(spread, positions, colours[:, channel])
+        for channel in range(3)
+    ],
+                     axis=1)
+    return np.rint(table).astype(np.uint8)
+
+
+@njit
+def _level(value: float, low: float, scale: float, top: int) -> int:
+    level = (value - low) * scale
+    # Written so that nan lands on the lowest level too
+    if not level >= 0:
+        return 0
+    if level >= top:
+        return top
+    return int(level)
+
+
+@njit(parallel=True)
+def _colour(field: np.ndarray, table: np.ndarray, low: float, scale: float,
+            out: np.ndarray) -> None:
+    top = table.shape[0] - 1
+    for i in prange(field.shape[0]):
+        for j in range(field.shape[1]):
+            level = _level(field[i, j], low, scale, top)
+            for channel in range(3):
+                out[i, j, channel] = table[level, channel]
+
+
+@njit(parallel=True)
+def _colour_speed(vel_x: np.ndarray, vel_y: np.ndarray, table: np.ndarray,
+                  low: float, scale: float, out: np.ndarray) -> None:
+    top = table.shape[0] - 1
+    for i in prange(vel_x.shape[0]):
+        for j in range(vel_x.shape[1]):
+            speed = np.sqrt(vel_x[i, j]**2 + vel_y[i, j]**2)
+            level = _level(speed, low, scale, top)
+            for channel in range(3):
+                out[i, j, channel] = table[level, channel]
+
+
+class Colormap:
+    """Renders fields to uint8 RGB pixels through the lookup table of a colormap.
+
+    Attributes:
+        name: The name of the colormap, one of the keys of COLORMAPS.
+        limits: The (low, high) values shown as the first and last colours of the table. Anything
+            outside them is clamped.
+        table: The (levels, 3) uint8 lookup table.
+    """
+    def __init__(self,
+                 name: str = 'fire',
+                 limits: Tuple[float, float] = (0, 1),
+                 levels: int = 256):
+        """Builds the lookup table.
+
+        Raises:
+            ValueError: If the colormap is not one of COLORMAPS, or high is not above low.
+        """
+        low, high = limits
+        if high <= low:
+            raise ValueError(f'Expected limits of (low, high), got {limits}')
+        self.name = name
+        self.limits = (float(low), float(high))
+        self.table = lookup_table(name, levels)
+        self._scale = levels / (high - low)
+
+    def __call__(self,
+                 field: np.ndarray,
+                 out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Renders a field such as the density.
+
+        Args:
+            field: The 2d field, indexed [x, y].
+            out: A uint8 array shaped like the field with 3 more on the end to render into.
+
+        Returns:
+            np.ndarray: The (x, y, 3) pixels, which is out if it was given.
+
+        Raises:
+            ValueError: If out is not a uint8 array of the field's shape with 3 channels.
+        """
+        out = self._output(field.shape, out)
+        _colour(field, self.table, field.dtype.type(self.limits[0]),
+                field.dtype.type(self._scale), out)
+        return out
+
+    def speed(self,
+              vel_x: np.ndarray,
+              vel_y: np.ndarray,
+              out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Renders the magnitude of the velocity, without making a field of it first.
+
+        Args:
+            vel_x: The velocity in the x direction, indexed [x, y].
+            vel_y: The velocity in the y direction, shaped like vel_x.
+            out: A uint8 array shaped like vel_x with 3 more on the end to render into.
+
+        Returns:
+            np.ndarray: The (x, y, 3) pixels, which is out if it was given.
+
+        Raises:
+            ValueError: If out is not a uint8 array of the velocities' shape with 3 channels.
+        """
+        out = self._output(vel_x.shape, out)
+        _colour_speed(vel_x, vel_y, self.table,
+                      vel_x.dtype.type(self.limits[0]),
+                      vel_x.dtype.type(self._scale), out)
+        return out
+
+    def _output(self, shape: Tuple[int, ...],
+                out: Optional[np.ndarray]) -> np.ndarray:
+        shape = (*shape, 3)
+        if out is None:
+            return np.empty(shape, np.uint8)
+        if out.shape != shape or out.dtype != np.uint8:
+            raise ValueError(f'Expected out to be a {shape} uint8 array, got '
+                             f'a {out.shape} {out.dtype.name} one')
+        return out
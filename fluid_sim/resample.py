@@ -0,0 +1,109 @@
+"""Scales a field of the simulated board up or down to the size it is shown at.
+
+The board and the output both cover the same square, each cell or pixel at the centre of its
+square, so output pixel u sits at (u + 0.5) * board / output - 0.5 on the board. Bilinear
+interpolation is separable, so it is done as two passes of whole array operations: the rows the
+output needs are blended first, into an (output, board) array, and then the columns of that. The
+positions, weights and scratch arrays are worked out once for a pair of sizes, so scaling a frame
+only costs the two passes and allocates nothing.
+"""
+
+from typing import Optional, Union
+
+import numpy as np
+
+
+class Bilinear:
+    """Bilinearly scales (source_size, source_size) fields to (target_size, target_size).
+
+    Attributes:
+        source_size: The length of each side of the fields that are scaled.
+        target_size: The length of each side of what they are scaled to.
+        dtype: The dtype of the fields and of what they are scaled to.
+    """
+    def __init__(self,
+                 source_size: int,
+                 target_size: int,
+                 dtype: Union[type, np.dtype] = np.float64):
+        """Works out which source cells and weights make up each row and column of the target.
+
+        Raises:
+            ValueError: If either size is less than 2.
+        """
+        if min(source_size, target_size) < 2:
+            raise ValueError(f'Expected both sizes to be at least 2, got '
+                             f'{source_size} and {target_size}')
+        self.source_size = source_size
+        self.target_size = target_size
+        self.dtype = np.dtype(dtype)
+
+        positions = np.clip(
+            to_source(np.arange(target_size), source_size, target_size), 0,
+            source_size - 1)
+        # The cell before each position, and how far past it the position is
+        self._lower = np.minimum(np.floor(positions),
+                                 source_size - 2).astype(np.intp)
+        self._upper = self._lower + 1
+        weights = (positions - self._lower).astype(self.dtype)
+        self._row_weights = weights.reshape(-1, 1)
+        self._row_rest = 1 - self._row_weights
+        self._col_weights = weights.reshape(1, -1)
+        self._col_rest = 1 - self._col_weights
+
+        self._rows: np.ndarray = np.empty((target_size, source_size),
+                                          self.dtype)
+        self._rows_upper: np.ndarray = np.empty((target_size, source_size),
+                                                self.dtype)
+        self._cols_upper: np.ndarray = np.empty((target_size, target_size),
+                                                self.dtype)
+
+    def __call__(self,
+                 field: np.ndarray,
+                 out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Scales a field.
+
+        Args:
+            field: The (source_size, source_size) field, indexed [x, y].
+            out: A (target_size, target_size) array of dtype to write into instead of a new one.
+
+        Returns:
+            np.ndarray: The scaled field, indexed [x, y], which is out if it was given.
+
+        Raises:
+            ValueError: If out is not shaped like the target or is not of dtype.
+        """
+        shape = (self.target_size, self.target_size)
+        if out is None:
+            out = np.empty(shape, self.dtype)
+        elif out.shape != shape or out.dtype != self.dtype:
+            raise ValueError(f'Expected out to be a {shape} {self.dtype.name} '
+                             f'array, got a {out.shape} {out.dtype.name} one')
+
+        rows, upper = self._rows, self._rows_upper
+        np.take(field, self._lower, axis=0, out=rows)
+        np.take(field, self._upper, axis=0, out=upper)
+        rows *= self._row_rest
+        upper *= self._row_weights
+        rows += upper
+
+        np.take(rows, self._lower, axis=1, out=out)
+        np.take(rows, self._upper, axis=1, out=self._cols_upper)
+        out *= self._col_rest
+        self._cols_upper *= self._col_weights
+        out += self._cols_upper
+        return out
+
+
+def to_source(positions: np.ndarray, source_size: int,
+              target_size: int) -> np.ndarray:
+    """Where positions on a target_size side are on a source_size one, as fractional cells."""
+    return (np.asarray(positions) + 0.5) * (source_size / target_size) - 0.5
+
+
+def nearest(positions: np.ndarray, source_size: int,
+            target_size: int) -> np.ndarray:
+    """The source cell nearest to each target position, such as to add to a field at a pixel of
+    the output. Positions off the target stay off the source.
+    """
+    return np.rint(to_source(positions, source_size,
+                             target_size)).astype(np.intp)
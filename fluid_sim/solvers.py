@@ -0,0 +1,350 @@
+"""Iterative solvers for the linear systems in diffuse and project, for when a fixed number of
+relaxation sweeps is not enough.
+
+Red-black sweeps only smooth out the error between neighbouring cells, the large scale part of the
+error shrinks by a fraction of a percent per sweep on big grids, so it takes thousands of sweeps to
+actually make the velocity field divergence free, and high viscosities and diffusion rates need
+hundreds. The solvers here run until the residual is below a tolerance instead.
+
+They work on the host arrays the numpy and numba-cpu backends use, indexed [x, y] like the rest of
+the solver. Only the interior of a field is solved for, the border is set with set_bnd afterwards.
+Their scratch fields are allocated in the dtype of the fields they solve, so a float32 field is
+solved in single precision.
+"""
+
+from typing import List, NamedTuple, Tuple, Union
+import numpy as np
+
+from fluid_sim.numpy_utils import _grid, set_bnd
+
+
+class SolveResult(NamedTuple):
+    """How a solve went.
+
+    Attributes:
+        iterations: How many iterations (multigrid cycles) the solver ran.
+        residual: The residual norm at the end, relative to the norm of the right hand side.
+    """
+    iterations: int
+    residual: float
+
+
+class _Level:
+    """One grid in the multigrid hierarchy.
+
+    The pressure equation is the graph Laplacian of the grid, every cell is coupled to each of its
+    neighbours with a weight and its diagonal is the sum of those weights. At the finest level all
+    the weights are 1, and a cell on the edge of the field is simply missing the coupling to the
+    border, which is what set_bnd copying the cell into the border amounts to.
+
+    Fields on every level keep a one cell border like the simulated fields do, and the weights to
+    it are 0, so the finest level can work on p directly whatever set_bnd left in its border.
+    """
+    def __init__(self, weights_x: np.ndarray, weights_y: np.ndarray):
+        self.shape = (weights_x.shape[0] + 1, weights_x.shape[1])
+        # weights_x[i, j] couples interior cells (i - 1, j) and (i, j), and likewise for y, so the
+        # padded arrays have a 0 weight for the border on either side
+        self.weights_x = np.pad(weights_x, ((1, 1), (0, 0)))
+        self.weights_y = np.pad(weights_y, ((0, 0), (1, 1)))
+
+        diagonal = (self.weights_x[:-1, :] + self.weights_x[1:, :] +
+                    self.weights_y[:, :-1] + self.weights_y[:, 1:])
+        # A cell with no neighbours has nothing to solve, dividing by 1 leaves it as it is
+        diagonal[diagonal == 0] = 1
+        self.diagonal = diagonal
+
+        n, m = self.shape
+        self.colours = []
+        for parity in range(2):
+            for i in range(2):
+                j = (parity - i) % 2
+                self.colours.append((slice(i, n, 2), slice(j, m, 2)))
+
+    def zeros(self) -> np.ndarray:
+        """A field for this level, border included."""
+        return np.zeros((self.shape[0] + 2, self.shape[1] + 2),
+                        self.diagonal.dtype)
+
+    def neighbours(self, u: np.ndarray) -> np.ndarray:
+        """The weighted sum of the neighbours of every interior cell of u."""
+        return (self.weights_x[:-1, :] * u[:-2, 1:-1] +
+                self.weights_x[1:, :] * u[2:, 1:-1] +
+                self.weights_y[:, :-1] * u[1:-1, :-2] +
+                self.weights_y[:, 1:] * u[1:-1, 2:])
+
+    def apply(self, u: np.ndarray) -> np.ndarray:
+        """Multiplies u by the Laplacian of this level."""
+        return self.diagonal * u[1:-1, 1:-1] - self.neighbours(u)
+
+    def residual(self, u: np.ndarray, rhs: np.ndarray) -> np.ndarray:
+        return rhs[1:-1, 1:-1] - self.apply(u)
+
+    def smooth(self, u: np.ndarray, rhs: np.ndarray, sweeps: int) -> None:
+        """Red-black Gauss-Seidel, the same relaxation lin_solve does.
+
+        Each colour is two strided slices of the interior, one starting on an even row and one on
+        an odd row, with the neighbours and weights offset from them.
+        """
+        n, m = self.shape
+        for _ in range(sweeps):
+            for rows, cols in self.colours:
+                i, j = rows.start, cols.start
+                neighbours = (
+                    self.weights_x[i:n:2, cols] * u[i:n:2, j + 1:m + 1:2] +
+                    self.weights_x[i + 1:n + 1:2, cols] *
+                    u[i + 2:n + 2:2, j + 1:m + 1:2] +
+                    self.weights_y[rows, j:m:2] * u[i + 1:n + 1:2, j:m:2] +
+                    self.weights_y[rows, j + 1:m + 1:2] *
+                    u[i + 1:n + 1:2, j + 2:m + 2:2])
+                u[i + 1:n + 1:2,
+                  j + 1:m + 1:2] = (rhs[i + 1:n + 1:2, j + 1:m + 1:2] +
+                                    neighbours) / self.diagonal[rows, cols]
+
+    def coarsen(self) -> '_Level':
+        """Builds the next coarser level by merging every 2x2 block of cells into one.
+
+        The coarse weights are the sum of the fine weights crossing between two blocks, which
+        makes the coarse operator exactly the fine operator restricted to piecewise constant
+        fields. That holds for odd sized grids too, the last row or column of blocks just has fewer
+        cells in it.
+        """
+        weights_x = _pair_sum(self.weights_x[2:-1:2, :], axis=1)
+        weights_y = _pair_sum(self.weights_y[:, 2:-1:2], axis=0)
+        return _Level(weights_x, weights_y)
+
+
+def _pair_sum(array: np.ndarray, axis: int) -> np.ndarray:
+    """Adds every pair of entries along an axis together, keeping a lone last entry as it is."""
+    if array.shape[axis] % 2:
+        padding = [(0, 0), (0, 0)]
+        padding[axis] = (0, 1)
+        array = np.pad(array, padding)
+    if axis == 0:
+        return array[0::2, :] + array[1::2, :]
+    return array[:, 0::2] + array[:, 1::2]
+
+
+def _restrict(fine: np.ndarray) -> np.ndarray:
+    """Sums the residual over each 2x2 block onto the coarse grid, adding its border."""
+    return np.pad(_pair_sum(_pair_sum(fine, axis=0), axis=1), 1)
+
+
+def _prolong(coarse: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """Copies each coarse cell back onto the 2x2 block of fine cells it came from."""
+    interior = coarse[1:-1, 1:-1].repeat(2, axis=0).repeat(2, axis=1)
+    return np.pad(interior[:shape[0], :shape[1]], 1)
+
+
+class MultigridSolver:
+    def __init__(self,
+                 side_length: int,
+                 tolerance: float = 1e-3,
+                 max_cycles: int = 20,
+                 smoothing_sweeps: int = 2,
+                 coarsest_size: int = 8,
+                 dtype: Union[type, np.dtype] = np.float64):
+        """A geometric multigrid solver for the pressure equation of a side_length field.
+
+        Each V-cycle smooths the error on the field, moves what is left of it onto a grid half the
+        size, where the large scale error looks small scale again and smoothing works on it, and
+        so on down to a grid of a few cells. The corrections are then carried back up. A cycle
+        costs about as much as a handful of sweeps but cuts the residual by a roughly constant
+        factor whatever the grid size, so a solve is O(side_length**2).
+
+        The hierarchy only depends on the size of the field, so it is built once here.
+
+        Args:
+            side_length: The length of each side of the simulated field, including the border.
+            tolerance: The residual, relative to the divergence, that a solve stops at.
+            max_cycles: The most V-cycles a solve will run.
+            smoothing_sweeps: How many red-black sweeps are done on each level before and after
+                visiting the coarser one.
+            coarsest_size: The grids stop being halved once a side is this small.
+            dtype: The dtype of the fields being solved.
+        """
+        self.side_length = side_length
+        self.tolerance = tolerance
+        self.max_cycles = max_cycles
+        self.smoothing_sweeps = smoothing_sweeps
+
+        interior = side_length - 2
+        level = _Level(np.ones((interior - 1, interior), dtype),
+                       np.ones((interior, interior - 1), dtype))
+        self.levels: List[_Level] = [level]
+        while min(level.shape) > coarsest_size:
+            level = level.coarsen()
+            self.levels.append(level)
+
+    def solve(self, p: np.ndarray, div: np.ndarray) -> SolveResult:
+        """Solves for the pressure p from the divergence div in place, using p as the first guess.
+
+        Only the interior of p is solved for, the border is then set with set_bnd.
+
+        Args:
+            p: The pressure field, either flat or (side_length, side_length).
+            div: The divergence field, the same shape as p.
+
+        Returns:
+            SolveResult: How many V-cycles were run and the relative residual they reached.
+        """
+        p = _grid(p, self.side_length)
+        # With only walls around it the pressure is only known up to a constant, and any part of
+        # the divergence that is the same everywhere can never be solved away
+        rhs = _grid(div, self.side_length).copy()
+        rhs[1:-1, 1:-1] -= rhs[1:-1, 1:-1].mean()
+
+        norm = np.linalg.norm(rhs[1:-1, 1:-1])
+        if norm == 0:
+            p[1:-1, 1:-1] = 0
+            set_bnd(self.side_length, 0, p)
+            return SolveResult(0, 0.0)
+
+        residual = np.linalg.norm(self.levels[0].residual(p, rhs)) / norm
+        cycles = 0
+        while residual > self.tolerance and cycles < self.max_cycles:
+            self._cycle(0, p, rhs)
+            residual = np.linalg.norm(self.levels[0].residual(p, rhs)) / norm
+            cycles += 1
+        set_bnd(self.side_length, 0, p)
+        return SolveResult(cycles, float(residual))
+
+    def _cycle(self, depth: int, u: np.ndarray, rhs: np.ndarray) -> None:
+        level = self.levels[depth]
+        if depth == len(self.levels) - 1:
+            level.smooth(u, rhs, 10 * max(level.shape))
+            return
+
+        level.smooth(u, rhs, self.smoothing_sweeps)
+
+        residual = level.residual(u, rhs)
+        correction = self.levels[depth + 1].zeros()
+        self._cycle(depth + 1, correction, _restrict(residual))
+        error = _prolong(correction, level.shape)
+
+        # A piecewise constant correction has the right shape but not the right size, so it is
+        # scaled by however much minimises the error in the energy norm
+        scale = (np.vdot(error[1:-1, 1:-1], residual) /
+                 np.vdot(error[1:-1, 1:-1], level.apply(error)))
+        if np.isfinite(scale):
+            u[1:-1, 1:-1] += scale * error[1:-1, 1:-1]
+
+        level.smooth(u, rhs, self.smoothing_sweeps)
+
+
+class ConjugateGradientSolver:
+    def __init__(self,
+                 side_length: int,
+                 tolerance: float = 1e-3,
+                 max_iterations: int = 200,
+                 dtype: Union[type, np.dtype] = np.float64):
+        """A Jacobi preconditioned conjugate gradient solver for the systems lin_solve relaxes.
+
+        lin_solve moves every interior cell towards (prev + a * neighbours) / c, where the
+        neighbours of cells next to the border are whatever set_bnd copied there. So it is
+        relaxing c * current - a * neighbours = prev, which is symmetric and positive (semi)
+        definite, and that is the system solved here. It is never built as a matrix, multiplying
+        by it is the same stencil.
+
+        Conjugate gradients needs about the square root as many iterations as relaxation does,
+        which is what makes it worth it for the stiff systems large values of a make.
+
+        The scratch fields a solve needs are allocated once here and reused.
+
+        Args:
+            side_length: The length of each side of the simulated field, including the border.
+            tolerance: The residual, relative to prev, that a solve stops at.
+            max_iterations: The most iterations a solve will run.
+            dtype: The dtype of the fields being solved.
+        """
+        self.side_length = side_length
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+
+        self.dtype = np.dtype(dtype)
+        interior = (side_length - 2, side_length - 2)
+        self._direction: np.ndarray = np.zeros((side_length, side_length),
+                                               dtype)
+        self._product: np.ndarray = np.zeros(interior, dtype)
+        self._residual: np.ndarray = np.zeros(interior, dtype)
+        self._preconditioned: np.ndarray = np.zeros(interior, dtype)
+
+    def _apply(self, side: int, x: np.ndarray, a: float, c: float,
+               out: np.ndarray) -> None:
+        set_bnd(self.side_length, side, x)
+        np.multiply(c, x[1:-1, 1:-1], out=out)
+        out -= a * (x[:-2, 1:-1] + x[2:, 1:-1] + x[1:-1, :-2] + x[1:-1, 2:])
+
+    def _diagonal(self, side: int, a: float, c: float) -> np.ndarray:
+        """The diagonal of the system. Cells next to the border also see themselves through it,
+        with the sign set_bnd gives that border.
+        """
+        x_sign = -1 if side == 1 else 1
+        y_sign = -1 if side == 2 else 1
+
+        diagonal: np.ndarray = np.full(
+            (self.side_length - 2, self.side_length - 2), float(c), self.dtype)
+        diagonal[0, :] -= a * x_sign
+        diagonal[-1, :] -= a * x_sign
+        diagonal[:, 0] -= a * y_sign
+        diagonal[:, -1] -= a * y_sign
+        return diagonal
+
+    def solve(self, side: int, current_list: np.ndarray, prev_list: np.ndarray,
+              a: float, c: float) -> SolveResult:
+        """Solves the system lin_solve relaxes for current_list in place, using it as the first
+        guess.
+
+        Args:
+            side: The side of the simulated field as an integer, as passed to set_bnd.
+            current_list: The field being solved for, either flat or (side_length, side_length).
+            prev_list: The right hand side, the same shape as current_list.
+            a: The weight of the neighbouring cells.
+            c: The weight of the cell itself.
+
+        Returns:
+            SolveResult: How many iterations were run and the relative residual they reached.
+        """
+        x = _grid(current_list, self.side_length)
+        rhs = _grid(prev_list, self.side_length)[1:-1, 1:-1]
+        if side == 0 and c == 4 * a:
+            # The pressure equation, which like in MultigridSolver.solve can only be solved once
+            # the part of the divergence that is the same everywhere is taken away
+            rhs = rhs - rhs.mean()
+
+        norm = np.linalg.norm(rhs)
+        if norm == 0:
+            x[1:-1, 1:-1] = 0
+            set_bnd(self.side_length, side, x)
+            return SolveResult(0, 0.0)
+
+        inverse_diagonal = 1 / self._diagonal(side, a, c)
+        direction = self._direction
+        product = self._product
+        residual = self._residual
+        preconditioned = self._preconditioned
+
+        self._apply(side, x, a, c, product)
+        np.subtract(rhs, product, out=residual)
+        np.multiply(residual, inverse_diagonal, out=preconditioned)
+        direction[1:-1, 1:-1] = preconditioned
+        alignment = np.vdot(residual, preconditioned)
+
+        relative = np.linalg.norm(residual) / norm
+        iterations = 0
+        while relative > self.tolerance and iterations < self.max_iterations:
+            self._apply(side, direction, a, c, product)
+            step = alignment / np.vdot(direction[1:-1, 1:-1], product)
+            x[1:-1, 1:-1] += step * direction[1:-1, 1:-1]
+            residual -= step * product
+
+            np.multiply(residual, inverse_diagonal, out=preconditioned)
+            new_alignment = np.vdot(residual, preconditioned)
+            direction[1:-1, 1:-1] *= new_alignment / alignment
+            direction[1:-1, 1:-1] += preconditioned
+            alignment = new_alignment
+
+            relative = np.linalg.norm(residual) / norm
+            iterations += 1
+
+        set_bnd(self.side_length, side, x)
+        return SolveResult(iterations, float(relative))
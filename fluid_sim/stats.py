@@ -0,0 +1,159 @@
+"""Rolling timings and counters of the stages of a step, for working out where a slow step went.
+
+A Fluid made with stats=True times each of its stages, the copies to and from the device, each
+diffuse, project and advect, and the velocity and density steps around them, and counts how many
+iterations each solve ran and how many bytes were copied. Only the last window samples of each are
+kept, in a ring buffer per name, so recording a sample is a couple of array writes and the memory
+used does not grow however long the simulation runs.
+
+Without stats the Fluid times its stages with a no-op instead, so nothing is measured or stored.
+"""
+
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class _Ring:
+    """The last window samples recorded under one name, and how many there have been in all."""
+    def __init__(self, window: int):
+        self.values = np.zeros(window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float) -> None:
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+        self.total += value
+
+    def last(self) -> np.ndarray:
+        """The kept samples, oldest first."""
+        window = len(self.values)
+        if self.count <= window:
+            return self.values[:self.count].copy()
+        start = self.count % window
+        return np.concatenate((self.values[start:], self.values[:start]))
+
+
+class _Timer:
+    """Records how long the code it wraps took, after waiting for the device to finish it."""
+    def __init__(self, stats: 'StepStats', name: str):
+        self._stats = stats
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self._stats.synchronize()
+        self._stats.record(self._name, time.perf_counter() - self._start)
+
+
+class _Untimed:
+    """Stands in for a _Timer when nothing is measured."""
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info: object) -> None:
+        pass
+
+
+_UNTIMED = _Untimed()
+
+
+def untimed(name: str) -> _Untimed:
+    """Times nothing, what a Fluid without stats wraps its stages with."""
+    return _UNTIMED
+
+
+class StepStats:
+    """Timings in seconds and counters of the last window samples under each name.
+
+    Timings are named after the stage they time. The iterations a solve ran are under its name with
+    '_iterations' after it, and the bytes each copy moved under 'to_device_bytes' and
+    'to_host_bytes'. A name that is recorded several times a step, like to_device, has a sample
+    for each time.
+
+    Attributes:
+        window: How many of the latest samples of each name are kept.
+        steps: How many steps have been recorded.
+    """
+    def __init__(self,
+                 window: int = 100,
+                 synchronize: Optional[Callable[[], None]] = None):
+        """Starts with nothing recorded.
+
+        Args:
+            window: How many of the latest samples of each name to keep.
+            synchronize: Waits for the device to finish what it has been given. It is called before
+                each timing is taken, so that the time of a stage on the gpu is not counted
+                towards whichever stage happens to wait for it next. Defaults to not waiting.
+
+        Raises:
+            ValueError: If window is not positive.
+        """
+        if window < 1:
+            raise ValueError(f'window must be positive, got {window}')
+        self.window = window
+        self.synchronize = synchronize or (lambda: None)
+        self.steps = 0
+        self._rings: Dict[str, _Ring] = {}
+
+    def timed(self, name: str) -> _Timer:
+        """A context manager that records how long the code it wraps took under name."""
+        return _Timer(self, name)
+
+    def record(self, name: str, value: float) -> None:
+        """Adds a sample under name, dropping the oldest once there are window of them."""
+        ring = self._rings.get(name)
+        if ring is None:
+            ring = self._rings[name] = _Ring(self.window)
+        ring.add(value)
+
+    def names(self) -> List[str]:
+        """Every name that has been recorded, in the order they were first recorded."""
+        return list(self._rings)
+
+    def samples(self, name: str) -> np.ndarray:
+        """The kept samples under name, oldest first.
+
+        Raises:
+            KeyError: If nothing has been recorded under name.
+        """
+        return self._rings[name].last()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """The statistics of the kept samples under each name.
+
+        Returns:
+            Dict[str, Dict[str, float]]: For each name the mean, median, 95th percentile and
+                largest of the kept samples, with the count and total of every sample ever
+                recorded under it.
+        """
+        summary = {}
+        for name, ring in self._rings.items():
+            values = ring.last()
+            summary[name] = {
+                'count': ring.count,
+                'total': ring.total,
+                'mean': float(values.mean()),
+                'median': float(np.median(values)),
+                'p95': float(np.percentile(values, 95)),
+                'max': float(values.max()),
+            }
+        return summary
+
+    def export(self) -> Dict:
+        """The summary with the number of steps and window, as plain values that json can dump."""
+        return {
+            'steps': self.steps,
+            'window': self.window,
+            'stats': self.summary(),
+        }
+
+    def reset(self) -> None:
+        """Forgets everything recorded so far."""
+        self.steps = 0
+        self._rings.clear()
@@ -0,0 +1,87 @@
+"""Keeps track of which parts of the board hold any fluid, so that a step can skip the rest.
+
+The board is split into square tiles. A tile is active while any of its density or velocity is
+above a threshold, and every tile within a halo of an active one is stepped as well, which gives
+the fluid room to spread or flow into before the next step activates the tiles it reaches. Once a
+tile is not stepped any more whatever is left in it is zeroed, so tiles that are skipped always
+read as empty to the ones next to them.
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+
+# How many tiles around an active tile are stepped along with it
+TILE_HALO = 1
+
+
+class ActiveTiles:
+    """The tiles a step covers.
+
+    Attributes:
+        size: The length of each side of a tile in cells.
+        threshold: The largest density or speed a tile can hold and still be skipped.
+        stepped: A (tiles, tiles) mask of the tiles the next step covers, indexed [x, y].
+        origins: The (count, 2) x and y of the first cell of every stepped tile.
+    """
+    def __init__(self,
+                 side_length: int,
+                 size: int = 32,
+                 threshold: float = 1e-4):
+        """Starts with every tile stepped, until the first update finds which hold fluid.
+
+        Args:
+            side_length: The length of each side of the board.
+            size: The length of each side of a tile in cells.
+            threshold: The largest density or speed a tile can hold and still be skipped.
+
+        Raises:
+            ValueError: If size is not positive.
+        """
+        if size < 1:
+            raise ValueError(f'Expected a positive tile size, got {size}')
+        self.side_length = side_length
+        self.size = size
+        self.threshold = threshold
+        count = -(-side_length // size)
+        self.stepped: np.ndarray = np.ones((count, count), dtype=bool)
+        self.origins = self._origins()
+
+    def update(self, maxima: np.ndarray) -> np.ndarray:
+        """Works out which tiles the next step covers from how much each holds now.
+
+        Args:
+            maxima: The (tiles, tiles) largest absolute density or velocity in each tile, as
+                numba_utils.tile_maxima finds.
+
+        Returns:
+            np.ndarray: A mask of the tiles that were stepped but no longer are, which should be
+            zeroed in every field the step uses.
+        """
+        active = maxima > self.threshold
+        padded = np.pad(active, TILE_HALO)
+        stepped = np.zeros_like(active)
+        for dx in range(2 * TILE_HALO + 1):
+            for dy in range(2 * TILE_HALO + 1):
+                stepped |= padded[dx:dx + active.shape[0],
+                                  dy:dy + active.shape[1]]
+
+        released = self.stepped & ~stepped
+        self.stepped = stepped
+        self.origins = self._origins()
+        return released
+
+    def slices(self, tiles: np.ndarray) -> List[Tuple[slice, slice]]:
+        """The cells of each of the tiles in a tile mask, as slices of the board."""
+        return [(slice(x * self.size, (x + 1) * self.size),
+                 slice(y * self.size, (y + 1) * self.size))
+                for x, y in np.argwhere(tiles)]
+
+    @property
+    def fraction(self) -> float:
+        """How much of the board the next step covers."""
+        return float(self.stepped.mean())
+
+    def _origins(self) -> np.ndarray:
+        return np.ascontiguousarray(np.argwhere(self.stepped) * self.size,
+                                    dtype=np.int64)
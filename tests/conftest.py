@@ -0,0 +1,5 @@
+"""Runs the cuda backend on numba's simulator, so every backend can be tested without a gpu."""
+
+import os
+
+os.environ.setdefault('NUMBA_ENABLE_CUDASIM', '1')
@@ -0,0 +1,197 @@
+"""Every backend, and every option that should not change the result, steps the same fluid."""
+
+import numpy as np
+import pytest
+
+from fluid_sim import numba_utils, numpy_utils
+from fluid_sim.fluid import Fluid
+
+FIELDS = ('density', 'vel_x', 'vel_y')
+
+SIDE_LENGTH = 24
+# The cuda simulator runs each thread in python, so its boards are kept tiny
+CUDA_SIDE_LENGTH = 8
+
+
+def _stir(fluid: Fluid, steps: int = 4) -> Fluid:
+    """Adds a jet of fluid to the middle of the board before each step."""
+    centre = fluid.N // 2
+    for _ in range(steps):
+        fluid.add_density(centre, centre, 100)
+        fluid.add_velocity(centre, centre, 3, -2)
+        fluid.step()
+    return fluid
+
+
+def _run(side_length: int = SIDE_LENGTH, steps: int = 4, **kwargs) -> Fluid:
+    kwargs.setdefault('backend', 'numpy')
+    return _stir(Fluid(side_length, 0.05, 1e-4, 1e-4, **kwargs), steps)
+
+
+def _assert_close(fluid: Fluid, other: Fluid, **tolerance) -> None:
+    for name in FIELDS:
+        np.testing.assert_allclose(getattr(fluid, name),
+                                   getattr(other, name),
+                                   err_msg=name,
+                                   **tolerance)
+
+
+def _assert_same(fluid: Fluid, other: Fluid) -> None:
+    for name in FIELDS:
+        np.testing.assert_array_equal(getattr(fluid, name),
+                                      getattr(other, name),
+                                      err_msg=name)
+
+
+def test_numba_cpu_advects_like_numpy():
+    """Advection reads and writes separate fields, so the compiled kernel gives what numpy does."""
+    random = np.random.RandomState(0)
+    prev = random.rand(SIDE_LENGTH, SIDE_LENGTH)
+    vel_x = random.randn(SIDE_LENGTH, SIDE_LENGTH)
+    vel_y = random.randn(SIDE_LENGTH, SIDE_LENGTH)
+    results = []
+    for backend in (numba_utils, numpy_utils):
+        current = np.zeros((SIDE_LENGTH, SIDE_LENGTH))
+        backend.advect(SIDE_LENGTH, 0, current, prev, vel_x, vel_y, 0.1)
+        results.append(current)
+    np.testing.assert_allclose(*results, rtol=1e-12, atol=1e-12)
+
+
+def test_numba_cpu_matches_numpy():
+    """The compiled kernels run the same red-black sweeps as the whole array ones."""
+    _assert_close(_run(backend='numba-cpu'), _run(), rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize('resident', [False, True])
+def test_cuda_matches_numpy(resident):
+    """The gpu kernels, on numba's simulator, step the same fluid as the cpu, whether or not the
+    fields stay on the device between steps.
+    """
+    _assert_close(_run(CUDA_SIDE_LENGTH, 2, backend='cuda', resident=resident),
+                  _run(CUDA_SIDE_LENGTH, 2),
+                  rtol=1e-9,
+                  atol=1e-9)
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'numba-cpu'])
+def test_steps_are_reproducible(backend):
+    """Red-black sweeps have no races, so the same steps always give the same fluid."""
+    _assert_same(_run(backend=backend), _run(backend=backend))
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'numba-cpu'])
+def test_float32_follows_float64(backend):
+    """Single precision stays close to double precision over a few steps."""
+    single = _run(backend=backend, dtype=np.float32)
+    assert single.density.dtype == np.float32
+    _assert_close(single, _run(backend=backend), rtol=1e-3, atol=1e-3)
+
+
+def test_resident_matches_eager():
+    """Keeping the fields on the device and queueing edits changes nothing."""
+    _assert_same(_run(backend='numba-cpu', resident=True),
+                 _run(backend='numba-cpu'))
+
+
+def test_fused_matches_plain():
+    """Fused sweeps update every cell from the same neighbours in the same order, so only
+    rounding tells them apart.
+    """
+    _assert_close(_run(64, backend='numba-cpu', fused=True),
+                  _run(64, backend='numba-cpu'),
+                  rtol=1e-12,
+                  atol=1e-12)
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'numba-cpu'])
+def test_empty_obstacles_match_none(backend):
+    """A mask with no solid cells leaves only the border, as without obstacles."""
+    obstacles = np.zeros((SIDE_LENGTH, SIDE_LENGTH), dtype=bool)
+    _assert_close(_run(backend=backend, obstacles=obstacles),
+                  _run(backend=backend),
+                  rtol=1e-12,
+                  atol=1e-12)
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'numba-cpu'])
+def test_obstacles_block_the_flow(backend):
+    """A wall across the jet keeps its density from reaching the cells behind the wall."""
+    obstacles = np.zeros((SIDE_LENGTH, SIDE_LENGTH), dtype=bool)
+    obstacles[14:17, 4:20] = True
+    behind = (slice(17, 22), slice(6, 18))
+    walled = _run(backend=backend, obstacles=obstacles).density[behind]
+    assert walled.sum() < 1e-12 * _run(backend=backend).density[behind].sum()
+
+
+def test_tiles_follow_whole_board():
+    """Stepping only the tiles that hold fluid stays close to stepping the whole board. The
+    solves stop at the edge of the stepped tiles, so the two are not the same.
+    """
+    tiled = _run(64, backend='numba-cpu', tile_size=8)
+    whole = _run(64, backend='numba-cpu')
+    assert not tiled.tiles.stepped.all()
+    for name in FIELDS:
+        field = getattr(whole, name)
+        np.testing.assert_allclose(getattr(tiled, name),
+                                   field,
+                                   atol=1e-2 * np.abs(field).max(),
+                                   err_msg=name)
+
+
+def test_add_many_matches_add():
+    """Adding at many positions at once adds up the same as adding at each in turn."""
+    x = np.array([3, 5, 5, 40])
+    y = np.array([4, 6, 6, 2])
+    amounts = np.array([1.0, 2.0, 3.0, 4.0])
+    many = Fluid(SIDE_LENGTH, 0.05, 0, 0, backend='numpy')
+    many.add_density_many(x, y, amounts)
+    many.add_velocity_many(x, y, amounts, -amounts)
+    each = Fluid(SIDE_LENGTH, 0.05, 0, 0, backend='numpy')
+    for position in zip(x, y, amounts):
+        if position[0] < SIDE_LENGTH:
+            each.add_density(*position)
+            each.add_velocity(*position, -position[2])
+    _assert_same(many, each)
+
+
+def test_dissipation_off_changes_nothing():
+    """A rate of 0 takes the same path through advect as no dissipation."""
+    _assert_same(_run(backend='numba-cpu', density_dissipation=0),
+                 _run(backend='numba-cpu'))
+
+
+@pytest.mark.parametrize('dissipation', ['exponential', 'linear'])
+def test_dissipation(dissipation):
+    """Every backend dissipates alike, and the density only ever fades towards 0."""
+    rates = {
+        'density_dissipation': 20,
+        'velocity_dissipation': 2,
+        'dissipation': dissipation
+    }
+    numpy = _run(**rates)
+    _assert_close(_run(backend='numba-cpu', **rates),
+                  numpy,
+                  rtol=1e-9,
+                  atol=1e-9)
+    _assert_close(_run(CUDA_SIDE_LENGTH, 2, backend='cuda', **rates),
+                  _run(CUDA_SIDE_LENGTH, 2, **rates),
+                  rtol=1e-9,
+                  atol=1e-9)
+    assert numpy.density.min() >= 0
+    # Slower fluid carries less density out through the border, so only the density's own
+    # dissipation is compared
+    del rates['density_dissipation']
+    assert numpy.density.sum() < _run(**rates).density.sum()
+
+
+def test_advance_splits_by_speed():
+    """Fast fluid is advanced in short steps and calm fluid in one, leaving dt as it was."""
+    fluid = Fluid(SIDE_LENGTH, 0.01, 1e-4, 1e-4, backend='numpy', cfl=1)
+    assert fluid.advance(0.1).substeps == 1
+
+    fluid.add_velocity(12, 12, 10, 0)
+    result = fluid.advance(0.1)
+    assert result.max_speed == 10
+    assert result.substeps == int(np.ceil(0.1 * (SIDE_LENGTH - 2) * 10))
+    assert result.dt * result.substeps == pytest.approx(0.1)
+    assert fluid.dt == 0.01
@@ -0,0 +1,60 @@
+"""Every fluid of a batch steps as a Fluid of its own with the same parameters would."""
+
+import numpy as np
+import pytest
+
+from fluid_sim.batch import FluidBatch
+from fluid_sim.fluid import Fluid
+
+SIDE_LENGTH = 16
+DTS = [0.02, 0.05, 0.1]
+DIFFUSION_RATES = [1e-4, 1e-3, 0]
+VISCOSITIES = [1e-4, 1e-3, 1e-2]
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'numba-cpu'])
+def test_members_match_fluids(backend):
+    """Each member gets its own dt, diffusion rate and viscosity out of the stacks."""
+    batch = FluidBatch(len(DTS),
+                       SIDE_LENGTH,
+                       DTS,
+                       DIFFUSION_RATES,
+                       VISCOSITIES,
+                       backend=backend)
+    # A batch runs a fixed number of sweeps from 0, like a Fluid that never stops early
+    fluids = [
+        Fluid(SIDE_LENGTH,
+              dt,
+              diffusion_rate,
+              viscosity,
+              backend=backend,
+              iterations=batch.iterations,
+              tolerance=0,
+              warm_start=False) for dt, diffusion_rate, viscosity in zip(
+                  DTS, DIFFUSION_RATES, VISCOSITIES)
+    ]
+    centre = SIDE_LENGTH // 2
+    for _ in range(3):
+        for member, fluid in enumerate(fluids):
+            batch.add_density(member, centre, centre, 100)
+            batch.add_velocity(member, centre, centre, 3, -2)
+            fluid.add_density(centre, centre, 100)
+            fluid.add_velocity(centre, centre, 3, -2)
+            fluid.step()
+        batch.step()
+
+    for member, fluid in enumerate(fluids):
+        for name in ('density', 'vel_x', 'vel_y'):
+            np.testing.assert_allclose(getattr(batch, name)[member],
+                                       getattr(fluid, name),
+                                       rtol=1e-12,
+                                       atol=1e-12,
+                                       err_msg=f'{name} of member {member}')
+
+
+def test_one_value_for_every_member():
+    """A single value is shared by the whole batch, and a sequence must have one per member."""
+    batch = FluidBatch(3, SIDE_LENGTH, 0.1, 0, 1e-4, backend='numpy')
+    np.testing.assert_array_equal(batch.dt, [0.1, 0.1, 0.1])
+    with pytest.raises(ValueError):
+        FluidBatch(3, SIDE_LENGTH, [0.1, 0.2], 0, 1e-4, backend='numpy')
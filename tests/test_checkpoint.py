@@ -0,0 +1,98 @@
+"""Saving a fluid to a checkpoint and loading it back."""
+
+import numpy as np
+import pytest
+
+from fluid_sim import checkpoint
+from fluid_sim.fluid import FIELDS, Fluid
+
+
+def _stirred(side_length: int = 16, steps: int = 3, **kwargs) -> Fluid:
+    fluid = Fluid(side_length, 0.05, 1e-4, 1e-4, backend='numpy', **kwargs)
+    for _ in range(steps):
+        fluid.add_density(side_length // 2, side_length // 2, 100)
+        fluid.add_velocity(side_length // 2, side_length // 2, 2, -1)
+        fluid.step()
+    return fluid
+
+
+def _assert_same(fluid: Fluid, other: Fluid) -> None:
+    for name in FIELDS:
+        np.testing.assert_array_equal(getattr(fluid, name),
+                                      getattr(other, name))
+
+
+def test_round_trip(tmp_path):
+    """A loaded checkpoint holds the fields that were saved and steps on the same."""
+    fluid = _stirred()
+    fluid.save_checkpoint(str(tmp_path / 'full.ckp'))
+    restored = Fluid.load_checkpoint(str(tmp_path / 'full.ckp'))
+    _assert_same(fluid, restored)
+
+    # The restored fluid steps on exactly as the original does
+    fluid.step()
+    restored.step()
+    _assert_same(fluid, restored)
+
+
+def test_incremental_round_trip(tmp_path):
+    """An incremental checkpoint restores the fluid over its base."""
+    fluid = _stirred(side_length=40)
+    fluid.save_checkpoint(str(tmp_path / 'full.ckp'))
+    fluid.add_density(5, 5, 10)
+    fluid.step()
+    fluid.save_checkpoint(str(tmp_path / 'later.ckp'),
+                          base=str(tmp_path / 'full.ckp'),
+                          tile_size=8)
+    _assert_same(fluid, Fluid.load_checkpoint(str(tmp_path / 'later.ckp')))
+
+
+@pytest.mark.parametrize('steps', [0, 1])
+def test_save_over_the_loaded_checkpoint(tmp_path, steps):
+    """A loaded fluid can be saved over the checkpoint its fields are mapped from."""
+    path = str(tmp_path / 'run.ckp')
+    _stirred().save_checkpoint(path)
+    fluid = Fluid.load_checkpoint(path)
+    for _ in range(steps):
+        fluid.step()
+
+    fluid.save_checkpoint(path)
+    _assert_same(fluid, Fluid.load_checkpoint(path))
+    assert [entry.name for entry in tmp_path.iterdir()] == ['run.ckp']
+
+
+def test_save_over_the_base(tmp_path):
+    """An incremental checkpoint is refused in place of its base, which is left alone."""
+    base = str(tmp_path / 'full.ckp')
+    original = _stirred()
+    original.save_checkpoint(base)
+    fluid = Fluid.load_checkpoint(base)
+    fluid.step()
+
+    with pytest.raises(ValueError):
+        fluid.save_checkpoint(base, base=base)
+    # The base is left as it was
+    _assert_same(original, Fluid.load_checkpoint(base))
+
+
+def test_not_a_checkpoint(tmp_path):
+    """Other files are refused."""
+    path = tmp_path / 'other.ckp'
+    path.write_bytes(b'0' * 64)
+    with pytest.raises(ValueError):
+        checkpoint.read(str(path))
+
+
+def test_incremental_no_bigger_than_full(tmp_path):
+    """Arrays whose padded tiles would outweigh them are stored whole, so an incremental
+    checkpoint of a board that is not a multiple of the tile size is no bigger than a full one.
+    """
+    fluid = _stirred(side_length=66)
+    full = tmp_path / 'full.ckp'
+    fluid.save_checkpoint(str(full))
+    fluid.step()
+    later = tmp_path / 'later.ckp'
+    fluid.save_checkpoint(str(later), base=str(full))
+
+    assert later.stat().st_size <= full.stat().st_size
+    _assert_same(fluid, Fluid.load_checkpoint(str(later)))
@@ -0,0 +1,65 @@
+"""A board split across worker processes steps as one process stepping the whole board does."""
+
+import numpy as np
+import pytest
+
+from fluid_sim.batch import FluidBatch
+
+# Shared memory needs python 3.8 or later
+shared_memory = pytest.importorskip('multiprocessing.shared_memory')
+from fluid_sim.distributed import DistributedFluid  # noqa: E402
+
+SIDE_LENGTH = 16
+FIELDS = ('density', 'vel_x', 'vel_y')
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_workers_match_one_process(dtype):
+    """Two workers exchanging halos give exactly the fields of a batch of one."""
+    batch = FluidBatch(1,
+                       SIDE_LENGTH,
+                       0.05,
+                       1e-4,
+                       1e-4,
+                       backend='numpy',
+                       dtype=dtype)
+    with DistributedFluid(SIDE_LENGTH,
+                          0.05,
+                          1e-4,
+                          1e-4,
+                          workers=2,
+                          dtype=dtype) as fluid:
+        centre = SIDE_LENGTH // 2
+        for _ in range(3):
+            fluid.add_density(centre, centre, 100)
+            fluid.add_velocity(centre, centre, 3, -2)
+            batch.add_density(0, centre, centre, 100)
+            batch.add_velocity(0, centre, centre, 3, -2)
+            fluid.step()
+            batch.step()
+
+        for name in FIELDS:
+            np.testing.assert_array_equal(getattr(fluid, name),
+                                          getattr(batch, name)[0],
+                                          err_msg=name)
+        name = fluid._memory.name
+
+    # Leaving the with block stopped the workers and unlinked the shared memory
+    assert fluid.closed
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+
+
+def test_close_frees_the_memory():
+    """Closing stops the workers and unlinks the shared memory, and can be done twice."""
+    fluid = DistributedFluid(SIDE_LENGTH, 0.05, 1e-4, 1e-4, workers=2)
+    fluid.step()
+    name = fluid._memory.name
+    fluid.close()
+    fluid.close()
+
+    assert not any(process.is_alive() for process in fluid._processes)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+    with pytest.raises(ValueError):
+        fluid.step()
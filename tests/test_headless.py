@@ -0,0 +1,41 @@
+"""Headless runs of the fluid-sim entry point."""
+
+import json
+
+import pytest
+
+from fluid_sim import headless
+from fluid_sim.fluid import Fluid
+from fluid_sim.main import main
+
+
+def test_main_writes_the_results(tmp_path, capsys):
+    """--headless steps without a window, prints the throughput and writes it as JSON."""
+    output = tmp_path / 'results.json'
+    main([
+        '--headless', '--steps', '3', '--size', '32', '--backend', 'numpy',
+        '--stats', '--output',
+        str(output)
+    ])
+    assert 'steps/sec' in capsys.readouterr().out
+
+    results = json.loads(output.read_text())
+    assert results['backend'] == 'numpy'
+    assert results['dtype'] == 'float64'
+    assert results['size'] == 32
+    assert results['steps'] == 3
+    for name in ('seconds', 'steps_per_sec', 'cells_per_sec', 'median_ms',
+                 'p95_ms', 'max_ms'):
+        assert results[name] > 0, name
+    # The warmup step is stepped too but not timed
+    assert results['stats']['steps'] == 4
+    assert 'step' in results['stats']['stats']
+
+
+@pytest.mark.parametrize('scenario', list(headless.SCENARIOS))
+def test_scenarios_add_fluid(scenario):
+    """Every scenario puts some fluid on the board."""
+    fluid = Fluid(32, 0.05, 1e-4, 1e-4, backend='numpy')
+    results = headless.run(fluid, scenario, 2, warmup=0)
+    assert results['steps'] == 2
+    assert fluid.density.sum() > 0
@@ -0,0 +1,80 @@
+"""Recording the fields of a fluid to a memory mapped file as it steps."""
+
+import json
+from typing import List
+
+import numpy as np
+
+from fluid_sim.fluid import Fluid
+from fluid_sim.recorder import dequantize, read_frames
+
+SIDE_LENGTH = 16
+FIELDS = ('density', 'vel_x')
+
+
+def _step(fluid: Fluid, steps: int) -> List[np.ndarray]:
+    """Steps a stirred fluid, returning a copy of the recorded fields after each step."""
+    centre = SIDE_LENGTH // 2
+    expected = []
+    for _ in range(steps):
+        fluid.add_density(centre, centre, 100)
+        fluid.add_velocity(centre, centre, 3, -2)
+        fluid.step()
+        expected.append(np.stack([getattr(fluid, name) for name in FIELDS]))
+    return expected
+
+
+def test_frames_match_the_steps(tmp_path):
+    """Every frame the thread writes holds the fields as they were after its step."""
+    path = str(tmp_path / 'run.npy')
+    fluid = Fluid(SIDE_LENGTH, 0.05, 1e-4, 1e-4, backend='numpy')
+    # Fewer buffers than frames, so steps wait on the thread for some of them
+    fluid.record(path, 6, FIELDS, buffers=2)
+    expected = _step(fluid, 6)
+    fluid.stop_recording()
+
+    recording = np.load(path, mmap_mode='r')
+    assert recording.shape == (6, len(FIELDS), SIDE_LENGTH, SIDE_LENGTH)
+    assert recording.dtype == np.float64
+    for frame, fields in zip(recording, expected):
+        np.testing.assert_array_equal(frame, fields)
+
+    frames = read_frames(path)
+    np.testing.assert_array_equal(frames['vel_x'], recording[:, 1])
+
+
+def test_closed_early(tmp_path):
+    """A recording stopped before it is full still loads, with only the frames written noted."""
+    path = str(tmp_path / 'run.npy')
+    fluid = Fluid(SIDE_LENGTH, 0.05, 1e-4, 1e-4, backend='numpy')
+    fluid.record(path, 10, FIELDS, every=2)
+    expected = _step(fluid, 5)[::2]
+    fluid.stop_recording()
+
+    with open(path + '.json') as file:
+        assert json.load(file)['frames'] == 3
+    np.testing.assert_array_equal(np.load(path, mmap_mode='r')[:3], expected)
+    frames = read_frames(path)
+    assert len(frames['density']) == 3
+    np.testing.assert_array_equal(frames['density'],
+                                  [fields[0] for fields in expected])
+
+
+def test_uint8_frames(tmp_path):
+    """uint8 frames come back within a level of the fields, clipped to their limits."""
+    path = str(tmp_path / 'run.npy')
+    limits = {'density': (0, 50), 'vel_x': (-1, 1)}
+    fluid = Fluid(SIDE_LENGTH, 0.05, 1e-4, 1e-4, backend='numpy')
+    fluid.record(path, 3, FIELDS, quantize='uint8', limits=limits)
+    expected = _step(fluid, 3)
+    fluid.stop_recording()
+
+    frames = read_frames(path)
+    for index, name in enumerate(FIELDS):
+        assert frames[name].dtype == np.uint8
+        low, high = limits[name]
+        fields = np.clip([fields[index] for fields in expected], low, high)
+        np.testing.assert_allclose(dequantize(frames[name], limits[name],
+                                              np.float64),
+                                   fields,
+                                   atol=(high - low) / 255)
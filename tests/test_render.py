@@ -0,0 +1,47 @@
+"""Colouring fields through the lookup table of a colormap."""
+
+import numpy as np
+import pytest
+
+from fluid_sim.render import COLORMAPS, Colormap, lookup_table
+
+
+def test_table_runs_through_the_colours():
+    """The table starts and ends on the colormap's first and last colours."""
+    for name, colours in COLORMAPS.items():
+        table = lookup_table(name, 256)
+        assert table.shape == (256, 3)
+        assert table.dtype == np.uint8
+        assert tuple(table[0]) == colours[0][1]
+        assert tuple(table[-1]) == colours[-1][1]
+    with pytest.raises(ValueError):
+        lookup_table('rainbow')
+
+
+def test_limits_map_to_the_ends_of_the_table():
+    """0 and the top of the limits are the first and last entries, and past them is clamped."""
+    colormap = Colormap('fire', limits=(0, 200))
+    field = np.array([[0.0, 200.0, 100.0], [-5.0, 1e9, np.nan]])
+    pixels = colormap(field)
+    assert pixels.shape == (2, 3, 3)
+    assert pixels.dtype == np.uint8
+
+    first, last = colormap.table[0], colormap.table[-1]
+    for x, y, colour in ((0, 0, first), (0, 1, last), (1, 0, first),
+                         (1, 1, last), (1, 2, first)):
+        np.testing.assert_array_equal(pixels[x, y], colour)
+    np.testing.assert_array_equal(pixels[0, 2], colormap.table[128])
+
+
+def test_speed_and_out():
+    """Speed is coloured by the length of the velocity, into out when it is given."""
+    colormap = Colormap('gray', limits=(0, 10))
+    vel_x = np.array([[3.0, 0.0]], dtype=np.float32)
+    vel_y = np.array([[4.0, 20.0]], dtype=np.float32)
+    out = np.zeros((1, 2, 3), np.uint8)
+    assert colormap.speed(vel_x, vel_y, out) is out
+    np.testing.assert_array_equal(out[0, 0], colormap.table[128])
+    np.testing.assert_array_equal(out[0, 1], colormap.table[-1])
+
+    with pytest.raises(ValueError):
+        colormap(vel_x, np.zeros((1, 2, 3), np.float32))
@@ -0,0 +1,53 @@
+"""Scaling fields of the board to the output size and back."""
+
+import numpy as np
+
+from fluid_sim.fluid import Fluid
+from fluid_sim.resample import Bilinear
+
+
+def test_constant_stays_constant():
+    """The weights of every output pixel add up to 1, so a constant field stays constant."""
+    for source_size, target_size in ((16, 64), (64, 16), (10, 37)):
+        field = np.full((source_size, source_size), 2.5)
+        np.testing.assert_allclose(Bilinear(source_size, target_size)(field),
+                                   2.5,
+                                   rtol=1e-12)
+
+
+def test_two_by_two_to_four_by_four():
+    """Output pixels sit at -0.25, 0.25, 0.75 and 1.25 cells, and the outer two are clamped."""
+    # Goes up by 2 along x and 1 along y, so the result is 2 * weight along x + weight along y
+    field = np.array([[0.0, 1.0], [2.0, 3.0]])
+    expected = np.array([[0.0, 0.25, 0.75, 1.0], [0.5, 0.75, 1.25, 1.5],
+                         [1.5, 1.75, 2.25, 2.5], [2.0, 2.25, 2.75, 3.0]])
+    np.testing.assert_allclose(Bilinear(2, 4)(field), expected, rtol=1e-12)
+
+    # Passing out back in writes into it
+    out = np.empty((4, 4))
+    assert Bilinear(2, 4)(field, out) is out
+    np.testing.assert_allclose(out, expected, rtol=1e-12)
+
+
+def test_render_scales_the_board():
+    """A fluid with a bigger output renders each field through Bilinear."""
+    fluid = Fluid(16, 0.05, 1e-4, 1e-4, backend='numpy', output_size=64)
+    fluid.add_density(8, 5, 100)
+    fluid.step()
+    rendered = fluid.render('density')
+    assert rendered.shape == (64, 64)
+    np.testing.assert_array_equal(rendered, Bilinear(16, 64)(fluid.density))
+
+
+def test_output_space_lands_on_the_nearest_cell():
+    """Pixel u of a 4 times bigger output is (u + 0.5) / 4 - 0.5 cells along, rounded."""
+    fluid = Fluid(16, 0.05, 1e-4, 1e-4, backend='numpy', output_size=64)
+    # 8.875 rounds to 9, 2.125 to 2 and 15.375 to 15
+    fluid.add_density_many(np.array([37, 10]),
+                           np.array([10, 63]),
+                           np.array([1.0, 2.0]),
+                           output_space=True)
+    expected = np.zeros((16, 16))
+    expected[9, 2] = 1
+    expected[2, 15] = 2
+    np.testing.assert_array_equal(fluid.density, expected)
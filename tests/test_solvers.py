@@ -0,0 +1,151 @@
+"""The solvers reach the same answer as running red-black sweeps until they stop changing it."""
+
+import numpy as np
+import pytest
+
+from fluid_sim import numpy_utils
+from fluid_sim.fluid import Fluid
+from fluid_sim.solvers import ConjugateGradientSolver, MultigridSolver
+
+SIDE_LENGTH = 18
+
+
+def _divergence() -> np.ndarray:
+    """A random right hand side that sums to 0, so that the walled pressure equation has a
+    solution.
+    """
+    div = np.zeros((SIDE_LENGTH, SIDE_LENGTH))
+    div[1:-1, 1:-1] = np.random.RandomState(0).randn(SIDE_LENGTH - 2,
+                                                     SIDE_LENGTH - 2)
+    div[1:-1, 1:-1] -= div[1:-1, 1:-1].mean()
+    return div
+
+
+def _swept(side: int, prev: np.ndarray, a: float, c: float) -> np.ndarray:
+    """Runs enough red-black sweeps that the field no longer changes."""
+    current = np.zeros((SIDE_LENGTH, SIDE_LENGTH))
+    for _ in range(5000):
+        numpy_utils.lin_solve(SIDE_LENGTH, side, current, prev, a, c)
+    return current
+
+
+def test_multigrid_solves_the_pressure():
+    """Multigrid stops below the tolerance, at the pressure thousands of sweeps converge to."""
+    div = _divergence()
+    solver = MultigridSolver(SIDE_LENGTH, tolerance=1e-10, max_cycles=100)
+    p = np.zeros((SIDE_LENGTH, SIDE_LENGTH))
+    result = solver.solve(p, div)
+    assert result.residual <= 1e-10
+    assert result.iterations < solver.max_cycles
+
+    # The pressure is only known up to a constant
+    swept = _swept(0, div, 1, 4)[1:-1, 1:-1]
+    interior = p[1:-1, 1:-1]
+    np.testing.assert_allclose(interior - interior.mean(),
+                               swept - swept.mean(),
+                               atol=1e-8)
+
+
+@pytest.mark.parametrize('side, a, c', [(1, 0.5, 3), (0, 1, 4)])
+def test_conjugate_gradient_solves_lin_solve(side, a, c):
+    """Conjugate gradients solve what lin_solve relaxes, for diffusing a velocity and for the
+    pressure.
+    """
+    prev = _divergence()
+    solver = ConjugateGradientSolver(SIDE_LENGTH,
+                                     tolerance=1e-10,
+                                     max_iterations=500)
+    current = np.zeros((SIDE_LENGTH, SIDE_LENGTH))
+    result = solver.solve(side, current, prev, a, c)
+    assert result.residual <= 1e-10
+    assert result.iterations < solver.max_iterations
+
+    swept = _swept(side, prev, a, c)
+    if side == 0:
+        current -= current[1:-1, 1:-1].mean()
+        swept -= swept[1:-1, 1:-1].mean()
+    np.testing.assert_allclose(current[1:-1, 1:-1],
+                               swept[1:-1, 1:-1],
+                               atol=1e-8)
+
+
+@pytest.mark.parametrize('solvers', [{
+    'pressure_solver': 'multigrid'
+}, {
+    'pressure_solver': 'cg',
+    'diffusion_solver': 'cg'
+}])
+@pytest.mark.parametrize('backend', ['numpy', 'numba-cpu'])
+def test_fluid_solves_to_tolerance(backend, solvers):
+    """Every solve of a step with multigrid or conjugate gradients stops below the tolerance."""
+    fluid = Fluid(SIDE_LENGTH,
+                  0.05,
+                  1e-4,
+                  1e-4,
+                  backend=backend,
+                  tolerance=1e-6,
+                  **solvers)
+    for _ in range(3):
+        fluid.add_density(SIDE_LENGTH // 2, SIDE_LENGTH // 2, 100)
+        fluid.add_velocity(SIDE_LENGTH // 2, SIDE_LENGTH // 2, 3, -2)
+        fluid.step()
+    assert fluid.solve_results
+    for name, result in fluid.solve_results.items():
+        assert result.residual <= 1e-6, name
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'numba-cpu'])
+def test_warm_start_saves_sweeps(backend):
+    """Gauss-seidel projects stop at the tolerance, and starting them from the last step's
+    pressure gets there in fewer sweeps than starting from 0.
+    """
+    sweeps = {}
+    for warm_start in (True, False):
+        fluid = Fluid(SIDE_LENGTH,
+                      0.05,
+                      1e-4,
+                      1e-4,
+                      backend=backend,
+                      iterations=1000,
+                      tolerance=1e-4,
+                      warm_start=warm_start)
+        for _ in range(6):
+            fluid.add_density(SIDE_LENGTH // 2, SIDE_LENGTH // 2, 100)
+            fluid.add_velocity(SIDE_LENGTH // 2, SIDE_LENGTH // 2, 3, -2)
+            fluid.step()
+        for name, result in fluid.solve_results.items():
+            assert result.residual <= 1e-4, name
+            assert result.iterations < 1000, name
+        sweeps[warm_start] = sum(result.iterations
+                                 for result in fluid.solve_results.values())
+    assert sweeps[True] < sweeps[False]
+
+
+@pytest.mark.parametrize('solvers', [{
+    'pressure_solver': 'multigrid',
+    'max_cycles': 2
+}, {
+    'pressure_solver': 'cg',
+    'diffusion_solver': 'cg',
+    'max_iterations': 3
+}])
+def test_solves_stop_at_their_cap(solvers):
+    """A tolerance the solvers cannot reach stops every solve at max_cycles or max_iterations."""
+    fluid = Fluid(SIDE_LENGTH,
+                  0.05,
+                  1e-4,
+                  1e-4,
+                  backend='numpy',
+                  tolerance=1e-300,
+                  **solvers)
+    fluid.add_density(SIDE_LENGTH // 2, SIDE_LENGTH // 2, 100)
+    fluid.add_velocity(SIDE_LENGTH // 2, SIDE_LENGTH // 2, 3, -2)
+    fluid.step()
+    cap = solvers.get('max_cycles', solvers.get('max_iterations'))
+    assert fluid.solve_results
+    for name, result in fluid.solve_results.items():
+        assert result.iterations == cap, name
+        assert result.residual > 1e-300, name
+    for limit in ('max_cycles', 'max_iterations'):
+        with pytest.raises(ValueError):
+            Fluid(SIDE_LENGTH, 0.05, 0, 0, backend='numpy', **{limit: 0})
@@ -0,0 +1,54 @@
+"""The rolling timings and counters a Fluid keeps of its steps."""
+
+import numpy as np
+import pytest
+
+from fluid_sim.fluid import Fluid
+from fluid_sim.stats import StepStats
+
+
+def test_ring_keeps_the_latest_samples():
+    """Only the last window samples are kept, oldest first, while the count and total go on."""
+    stats = StepStats(window=3)
+    for value in range(1, 6):
+        stats.record('stage', value)
+    np.testing.assert_array_equal(stats.samples('stage'), [3, 4, 5])
+    summary = stats.summary()['stage']
+    assert summary['count'] == 5
+    assert summary['total'] == 15
+    assert summary['max'] == 5
+    with pytest.raises(ValueError):
+        StepStats(window=0)
+
+
+def test_fluid_times_every_stage():
+    """A Fluid with stats times each stage of every step and counts what its solves ran."""
+    fluid = Fluid(16,
+                  0.05,
+                  1e-4,
+                  1e-4,
+                  backend='numpy',
+                  stats=True,
+                  stats_window=3)
+    for _ in range(5):
+        fluid.add_density(8, 8, 100)
+        fluid.add_velocity(8, 8, 3, -2)
+        fluid.step()
+
+    assert fluid.stats.steps == 5
+    names = fluid.stats.names()
+    for name in ('step', 'vel_step', 'density_step', 'diffuse_vel_x',
+                 'project_diffused', 'advect_vel_x', 'project_advected',
+                 'diffuse_density', 'advect_density', 'to_device', 'to_host',
+                 'project_advected_iterations'):
+        assert name in names, name
+    assert len(fluid.stats.samples('step')) == 3
+    assert fluid.stats.summary()['step']['count'] == 5
+    assert (fluid.stats.samples('step') > 0).all()
+
+
+def test_no_stats():
+    """Without stats nothing is kept."""
+    fluid = Fluid(16, 0.05, 1e-4, 1e-4, backend='numpy')
+    fluid.step()
+    assert fluid.stats is None